@@ -18,16 +18,17 @@
 # along with whether. If not, see <http://www.gnu.org/licenses/gpl.html>.
 
 from os import environ
+import time
 import asyncio
 from dotenv import load_dotenv
 import board
 
 import adafruit_mcp3xxx.mcp3008 as MCP
 import adafruit_logging as logging
-from whether import RingBuffer, logger, DHT22, Anemometer, WindDirection, Raingauge, PiJuice, RPi, HomeAssistant
+from whether import RingBuffer, logger, BatchedHandler, loadDirectionTable, CircuitBreaker, MCP3008Bus, DHT22, Anemometer, WindDirection, Raingauge, PiJuice, RPi, PowerPolicy, Outbox, FanOut, HomeAssistant, WeatherUnderground, OpenWeatherMap, RawStream, TimeSeriesStore, GorillaCodec, DiagnosticsServer, tracer, LoopMonitor
 
 # Load calibration of the wind direction resistor network
-from winddirectioncalibration import windDirections
+windDirections = loadDirectionTable("winddirectioncalibration.json")
 
 # Pin settings for Raspberry Pi
 TempHumPin = board.D4    # DHT22
@@ -45,7 +46,7 @@ if loglevel is not None:
     # look up the log level
     level = 0
     if loglevel.isdigit():
-        level = loglevel
+        level = int(loglevel)
     else:
         # Adafruit's logging doesn't allow strings as levels
         loglevel = loglevel.lower()
@@ -55,7 +56,48 @@ if loglevel is not None:
                 break
     logger.setLevel(level)
 
+# Write the log in batches in the background, to a file if one is given
+loghandler = BatchedHandler(filename=environ.get('LOGFILE') or None)
+logger.addHandler(loghandler)
+
+async def reportFirstSamples(start, sensors, timeout = 300):
+    '''Report the time from startup to each sensor's first sample,
+    giving up on any that haven't sampled within the timeout. Samples
+    are noticed by listening to the sensors, as the reporters swap
+    their rings.
+
+    :param start: the (monotonic) start time
+    :param sensors: the sensors
+    :param timeout: (optional) time to wait for first samples in seconds (defaults to 5m)'''
+    waiting = []
+
+    def sampled(s, ev = None):
+        if s in waiting:
+            logger.info("{id}: first sample after {t:.2f}s".format(id=s.id(),
+                                                                   t=time.monotonic() - start))
+            waiting.remove(s)
+
+    for s in sensors:
+        waiting.append(s)
+        s.addListener(sampled)
+        if len(s.events()) > 0:
+            # sampled before we started listening
+            sampled(s)
+    try:
+        while len(waiting) > 0:
+            if time.monotonic() - start > timeout:
+                logger.warning("No samples after {t:.0f}s from {ids}".format(t=timeout,
+                                                                           ids=", ".join([s.id() for s in waiting])))
+                return
+            await asyncio.sleep(0.1)
+        logger.info("All sensors sampling after {t:.2f}s".format(t=time.monotonic() - start))
+    finally:
+        for s in sensors:
+            s.removeListener(sampled)
+
 async def main():
+    start = time.monotonic()
+
     # Create the sensor ring buffers
     thbuf = RingBuffer(100)
     wsbuf = RingBuffer(100)
@@ -63,35 +105,93 @@ async def main():
     rgbuf = RingBuffer(100)
     pjbuf = RingBuffer(100)
     rpbuf = RingBuffer(100)
+    ppbuf = RingBuffer(10)
+
+    # Create the shared ADC for the analogue sensors, and the sensors,
+    # initialising the hardware concurrently
+    (adc, th, ws, rg, pj, rp) = await asyncio.gather(
+        asyncio.to_thread(MCP3008Bus, WindDirPin, tick=1),
+        asyncio.to_thread(DHT22, 'temperature-humidity', TempHumPin, thbuf, 10),
+        asyncio.to_thread(Anemometer, 'windspeed', WindPin, wsbuf, 1),
+        asyncio.to_thread(Raingauge, 'rainfall', RainPin, rgbuf, 1),
+        asyncio.to_thread(PiJuice, 'pi-juice', pjbuf, 10),
+        asyncio.to_thread(RPi, 'pi', rpbuf, 10))
+    wd = WindDirection('wind-direction', None, WindDirChannel, windDirections, wdbuf, 1,
+                       adc=adc, oversample=16)
 
-    # Create the sensors
-    th = DHT22('temperature-humidity', TempHumPin, thbuf, 10)
-    ws = Anemometer('windspeed', WindPin, wsbuf, 1)
-    wd = WindDirection('wind-direction', WindDirPin, WindDirChannel, windDirections, wdbuf, 1)
-    rg = Raingauge('rainfall', RainPin, rgbuf, 1)
-    pj = PiJuice('pi-juice', pjbuf, 10)
-    rp = RPi('pi', rpbuf, 10)
+    # Stop sampling hardware that's absent or broken
+    breakers = []
+    for s in [th, wd, pj, rp]:
+        b = CircuitBreaker(s.id())
+        s.setCircuitBreaker(b)
+        breakers.append(b)
 
-    # Create the reporter
+    # Let the slowly-changing channels back off while they're stable
+    pj.setAdaptive({PiJuice.BATTERY_CHARGE_PERCENTAGE: 1}, 10, 30)
+    rp.setAdaptive({RPi.CPU_TEMPERATURE: 1}, 10, 30)
+
+    # Scale everything back as the battery runs down, dropping
+    # wifi monitoring altogether when it's critical
+    pp = PowerPolicy('power', pj, ppbuf,
+                     sensors=[th, ws, wd, rg, rp],
+                     optional=[rp])
+
+    # Create the reporters, which all share one summary of the
+    # sensors each period. Home Assistant connects in the background
+    # once running
+    sensors = {FanOut.TEMPERATURE: th,
+               FanOut.HUMIDITY: th,
+               FanOut.WINDSPEED: ws,
+               FanOut.WINDDIRECTION: wd,
+               FanOut.RAININTENSITY: rg,
+               FanOut.BATTERY: pj,
+               FanOut.CPU: rp,
+               FanOut.POWER: pp}
     ha = HomeAssistant(environ["MQTT_SERVER"], environ["MQTT_USERNAME"], environ["MQTT_PASSWORD"],
                        "homeassistant/sensor/whether/state",
-                       {HomeAssistant.TEMPERATURE: th,
-                        HomeAssistant.HUMIDITY: th,
-                        HomeAssistant.WINDSPEED: ws,
-                        HomeAssistant.WINDDIRECTION: wd,
-                        HomeAssistant.RAININTENSITY: rg,
-                        HomeAssistant.BATTERY: pj,
-                        HomeAssistant.CPU: rp},
-                       period=30)
-
-    # Start the coroutines
+                       sensors,
+                       outbox=Outbox(environ.get("OUTBOX_DIR", "outbox")),
+                       perField=environ.get("REPORT_BY_EXCEPTION", "no").lower() in ["yes", "true", "1"])
+    for b in breakers:
+        ha.addBreaker(b)
+    sinks = [ha]
+    if environ.get("WU_STATION_ID", "") != "":
+        sinks.append(WeatherUnderground(environ["WU_STATION_ID"], environ["WU_STATION_KEY"]))
+    if environ.get("OW_STATION_ID", "") != "":
+        sinks.append(OpenWeatherMap(environ["OW_STATION_ID"], environ["OW_API_KEY"]))
+    reporter = FanOut(sensors, sinks, period=30)
+
+    # Stream every wind sample, sharing the reporter's connection
+    rs = RawStream(ha.connection(), "whether/raw", [ws, wd],
+                   period=10, maxEvents=100)
+
+    # Keep every event locally, compressed to spare the SD card
+    st = TimeSeriesStore(environ.get("STORE_DIR", "store"), [th, ws, wd, rg, pj, rp],
+                         maxBytes=int(environ.get("STORE_MAX_MB", "64")) * 1024 * 1024,
+                         codec=GorillaCodec())
+    pp.setReporters([reporter, rs, st])
+
+    # Start the coroutines, sensors first
     tht = asyncio.create_task(th.run())
     wst = asyncio.create_task(ws.run())
     wdt = asyncio.create_task(wd.run())
     rgt = asyncio.create_task(rg.run())
     pjt = asyncio.create_task(pj.run())
     rpt = asyncio.create_task(rp.run())
-    hat = asyncio.create_task(ha.run())
-    await asyncio.gather(tht, wst, wdt, rgt, pjt, rpt, hat)
+    ppt = asyncio.create_task(pp.run())
+    rept = asyncio.create_task(reporter.run())
+    rst = asyncio.create_task(rs.run())
+    stt = asyncio.create_task(st.run())
+    fst = asyncio.create_task(reportFirstSamples(start, [th, ws, wd, rg, pj, rp]))
+
+    # Serve the metrics and trace locally, and watch for anything
+    # blocking the event loop
+    if environ.get("TRACE", "no").lower() in ["yes", "true", "1"]:
+        tracer.enable()
+    ds = DiagnosticsServer(port=int(environ.get("METRICS_PORT", "9877")))
+    dst = asyncio.create_task(ds.run())
+    lmt = asyncio.create_task(LoopMonitor().run())
+    lht = asyncio.create_task(loghandler.run())
+    await asyncio.gather(tht, wst, wdt, rgt, pjt, rpt, ppt, rept, rst, stt, fst, dst, lmt, lht)
 
 asyncio.run(main())
@@ -0,0 +1,49 @@
+#!/bin/env python
+
+# Benchmark the payload codecs
+#
+# Encodes a typical Home Assistant payload with each codec, and
+# reports the size of the encoding and the time taken to encode
+# and decode it.
+
+import timeit
+from whether.payloads import JSONCodec, CBORCodec, MessagePackCodec, StructSchema, StructCodec
+
+runs = 10000
+
+payload = {'temperature': 12.3,
+           'humidity': 81.0,
+           'wind_speed': 3.4666666666666663,
+           'wind_speed_gust': 6.0,
+           'wind_dir': 'SSW',
+           'wind_dir_deg': 202.5,
+           'rainfall': 0.0,
+           'battery_charge': 87.0,
+           'battery_temp': 21.0,
+           'battery_voltage': 4012.0,
+           'battery_current': -180.0,
+           'cpu_temp': 47.2,
+           'cpu_wifi': -61,
+           'power_tier': 'normal'}
+
+schema = StructSchema(1, [('temperature', 'f'),
+                          ('humidity', 'f'),
+                          ('wind_speed', 'f'),
+                          ('wind_speed_gust', 'f'),
+                          ('wind_dir', '3s'),
+                          ('wind_dir_deg', 'f'),
+                          ('rainfall', 'f'),
+                          ('battery_charge', 'f'),
+                          ('battery_temp', 'f'),
+                          ('battery_voltage', 'f'),
+                          ('battery_current', 'f'),
+                          ('cpu_temp', 'f'),
+                          ('cpu_wifi', 'h'),
+                          ('power_tier', '8s')])
+
+print("{c:10} {b:>6} {e:>12} {d:>12}".format(c="codec", b="bytes", e="encode (us)", d="decode (us)"))
+for c in [JSONCodec(), CBORCodec(), MessagePackCodec(), StructCodec(schema)]:
+    bs = c.encode(payload)
+    te = timeit.timeit(lambda: c.encode(payload), number=runs) / runs * 1e6
+    td = timeit.timeit(lambda: c.decode(bs), number=runs) / runs * 1e6
+    print("{c:10} {b:6d} {e:12.2f} {d:12.2f}".format(c=c.NAME, b=len(bs), e=te, d=td))
@@ -0,0 +1,148 @@
+#!/bin/env python
+
+# Benchmark the compression of raw events
+#
+# Encodes columns of events in blocks, as the time-series store and
+# the raw stream do, and reports for each encoding the size, the
+# compression ratio against fixed-width columns, the size of a month
+# of events, and the rate of encoding and decoding.
+#
+# Given a directory of a time-series store, the benchmark uses the
+# events recorded there. Otherwise it uses a synthetic day of 1Hz
+# wind samples and minutely temperature samples.
+
+from sys import argv
+import math
+import time
+import zlib
+import struct
+import random
+from whether.compression import GorillaCodec
+from whether.payloads import MessagePackCodec
+from whether.tsstore import TimeSeriesStore
+
+runs = 3
+blockRows = 1024
+month = 30 * 24 * 60 * 60
+
+
+def synthetic():
+    '''Return a day of synthetic events, as columns and formats for each sensor.'''
+    rnd = random.Random(42)
+    t0 = 1700000000.0
+    dirs = ["N", "NNE", "NE", "ENE", "E", "ESE", "SE", "SSE",
+            "S", "SSW", "SW", "WSW", "W", "WNW", "NW", "NNW"]
+
+    # wind sampled at 1Hz with some jitter, speed and direction drifting
+    n = 24 * 60 * 60
+    ts, speeds, ds, adcs = [], [], [], []
+    speed, d = 3.0, 9
+    for i in range(n):
+        ts.append(t0 + i + rnd.uniform(0, 0.005))
+        speed = max(0.0, speed + rnd.gauss(0, 0.2))
+        speeds.append(round(speed / 0.333) * 0.333)     # whole anemometer clicks
+        if rnd.random() < 0.02:
+            d = (d + rnd.choice([-1, 1])) % len(dirs)
+        ds.append(dirs[d])
+        adcs.append(d * 4096 / len(dirs) + rnd.gauss(0, 8))
+    wind = (dict(time=ts, windspeed=speeds, winddir=ds, windrawadc=adcs),
+            dict(time='d', windspeed='f', winddir='3s', windrawadc='f'))
+
+    # temperature and humidity every minute
+    m = 24 * 60
+    ts = [t0 + 60 * i + rnd.uniform(0, 0.05) for i in range(m)]
+    temps = [round(10 + 5 * math.sin(2 * math.pi * i / m) + rnd.gauss(0, 0.1), 1) for i in range(m)]
+    hums = [round(80 - 10 * math.sin(2 * math.pi * i / m) + rnd.gauss(0, 0.5), 1) for i in range(m)]
+    th = (dict(time=ts, temperature=temps, humidity=hums),
+          dict(time='d', temperature='f', humidity='f'))
+
+    return dict(wind=wind, th=th)
+
+
+def recorded(directory):
+    '''Return the events recorded in a time-series store, as columns and formats for each sensor.'''
+    st = TimeSeriesStore(directory, [], maxAge=math.inf, maxBytes=math.inf)
+    data = dict()
+    for id in st.sensors():
+        cols = st.read(id)
+        layout = st.layout(id)
+        data[id] = (dict([(t, cols[t]) for (t, _) in layout if t in cols]), dict(layout))
+    return data
+
+
+def blocks(cols):
+    '''Split columns into blocks.'''
+    n = len(next(iter(cols.values())))
+    return [dict([(t, c[i:i + blockRows]) for (t, c) in cols.items()]) for i in range(0, n, blockRows)]
+
+
+def fixedWidth(formats):
+    '''Return functions to pack and unpack blocks of fixed-width columns.'''
+    def pack(cols):
+        parts = []
+        for (t, c) in cols.items():
+            f = formats[t]
+            if f.endswith('s'):
+                parts.append(struct.pack('<' + f * len(c), *[b'' if v is None else v.encode() for v in c]))
+            else:
+                parts.append(struct.pack('<{n}{f}'.format(n=len(c), f=f),
+                                         *[math.nan if v is None else v for v in c]))
+        return struct.pack('<I', len(next(iter(cols.values())))) + b''.join(parts)
+
+    def unpack(data):
+        n = struct.unpack_from('<I', data)[0]
+        i = 4
+        cols = dict()
+        for (t, f) in formats.items():
+            fmt = '<' + f * n if f.endswith('s') else '<{n}{f}'.format(n=n, f=f)
+            cols[t] = list(struct.unpack_from(fmt, data, i))
+            i += struct.calcsize(fmt)
+        return cols
+
+    return (pack, unpack)
+
+
+def encodings(formats):
+    '''Return the encodings to compare, as names and encode and decode functions.'''
+    (pack, unpack) = fixedWidth(formats)
+    mp = MessagePackCodec()
+    g = GorillaCodec()
+    return [("fixed", pack, unpack),
+            ("fixed+zlib", lambda b: zlib.compress(pack(b)), lambda d: unpack(zlib.decompress(d))),
+            ("msgpack+zlib", lambda b: zlib.compress(mp.encode(b)), lambda d: mp.decode(zlib.decompress(d))),
+            ("gorilla", lambda b: g.encode(b, formats), g.decode),
+            ("gorilla+zlib", lambda b: zlib.compress(g.encode(b, formats)), lambda d: g.decode(zlib.decompress(d)))]
+
+
+def timed(f, xs):
+    '''Return the results and best time of applying a function to a list.'''
+    best = math.inf
+    for _ in range(runs):
+        t = time.perf_counter()
+        ys = [f(x) for x in xs]
+        best = min(best, time.perf_counter() - t)
+    return (ys, best)
+
+
+data = recorded(argv[1]) if len(argv) > 1 else synthetic()
+for (id, (cols, formats)) in data.items():
+    n = len(cols['time'])
+    if n < 2:
+        continue
+    span = cols['time'][-1] - cols['time'][0]
+    bs = blocks(cols)
+    print("{id}: {n} events over {h:.1f} hours".format(id=id, n=n, h=span / 3600))
+    print("{c:14} {b:>10} {r:>7} {m:>12} {e:>13} {d:>13}".format(c="encoding", b="bytes", r="ratio",
+                                                                   m="MB/month", e="encode (ev/s)",
+                                                                   d="decode (ev/s)"))
+    fixed = None
+    for (name, enc, dec) in encodings(formats):
+        (ds, te) = timed(enc, bs)
+        (_, td) = timed(dec, ds)
+        size = sum([len(d) for d in ds])
+        fixed = size if fixed is None else fixed
+        print("{c:14} {b:10d} {r:7.2f} {m:12.2f} {e:13.0f} {d:13.0f}".format(c=name, b=size,
+                                                                             r=fixed / size,
+                                                                             m=size / span * month / 1e6,
+                                                                             e=n / te, d=n / td))
+    print()
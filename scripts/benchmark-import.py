@@ -0,0 +1,33 @@
+#!/bin/env python
+
+# Benchmark the time taken to import whether
+#
+# Each import is timed in a fresh interpreter, so that nothing is
+# already cached in sys.modules. The package itself is timed first,
+# followed by each of the names given on the command line (which
+# will be imported on demand).
+
+from sys import argv, executable
+import subprocess
+import statistics
+
+runs = 20
+
+def importTime(stmt):
+    '''Return the median time in ms to run an import statement
+    in a fresh interpreter.'''
+    code = ("import time; t = time.perf_counter(); {s}; "
+            "print((time.perf_counter() - t) * 1000)").format(s=stmt)
+    ts = []
+    for _ in range(runs):
+        out = subprocess.run([executable, '-c', code],
+                             capture_output=True, text=True, check=True)
+        ts.append(float(out.stdout))
+    return statistics.median(ts)
+
+stmts = ["import whether"] + ["from whether import {n}".format(n=n) for n in argv[1:]]
+for s in stmts:
+    try:
+        print("{s:40} {t:8.2f}ms".format(s=s, t=importTime(s)))
+    except subprocess.CalledProcessError:
+        print("{s:40} failed".format(s=s))
@@ -1,6 +1,7 @@
 #!/bin/env python
 
 from sys import exit
+import json
 from datetime import datetime
 import busio
 import digitalio
@@ -14,7 +15,7 @@ mcp = MCP.MCP3008(spi, cs)
 
 channel = AnalogIn(mcp, MCP.P0)
 
-fn = "winddirectioncalibration.py"
+fn = "winddirectioncalibration.json"
 sensitivity = 0.04
 directions = ["N", "NNE", "NE", "ENE",
               "E", "ESE", "SE", "SSE",
@@ -59,19 +60,11 @@ if abs(vnow - values[directions[0]]) > vnow * sensitivity:
 # write out the calibrated constants
 ts = datetime.now()
 with open(fn, "w") as fh:
-    # add header
-    print("# windDirections.py: Wind direction sensor calibration values", file=fh)
-    print(f"# Collected {ts}", file=fh)
-    print("", file=fh)
-
-    # output the calibration values
-    print("windDirections = dict(", file=fh)
-    for i in range(len(directions)):
-        dir = directions[i]
-        val = values[dir]
-        print(f"   {dir}={val},", file=fh)
-    print(")", file=fh)
-    print(f"windDirectionSensitivity = {sensitivity}", file=fh)
+    json.dump(dict(collected=str(ts),
+                   sensitivity=sensitivity,
+                   bits=10,
+                   directions=values),
+              fh, indent=3)
 print(f"The calibration values have been written to {fn}")
 
 exit(0)
@@ -0,0 +1,164 @@
+# A minimal MQTT broker for testing
+#
+# Copyright (C) 2023 Simon Dobson
+#
+# This file is part of whether, a modular IoT weather station
+#
+# whether is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# whether is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with whether. If not, see <http://www.gnu.org/licenses/gpl.html>.
+
+import asyncio
+
+
+class FakeBroker:
+    '''A minimal MQTT 3.1.1 broker, just enough to test clients.
+
+    The broker accepts all connections, acknowledges QoS 1 publishes,
+    answers pings, and records the messages it receives. It also
+    remembers retained messages and sends them to clients that
+    subscribe to their topics, and can deliver messages to
+    subscribers. Acknowledgements can be withheld to simulate a
+    slow server, and connections can be dropped.
+    '''
+
+    def __init__(self):
+        self._server = None
+        self._writers = []
+        self._subscriptions = dict()
+        self.messages = []
+        self.retained = dict()
+        self.connections = 0
+        self.ack = True
+
+    async def start(self):
+        '''Start the broker on a free port.
+
+        :returns: the port'''
+        self._server = await asyncio.start_server(self._serve, '127.0.0.1', 0)
+        return self._server.sockets[0].getsockname()[1]
+
+    async def stop(self):
+        '''Stop the broker, closing all connections.'''
+        self.drop()
+        self._server.close()
+        await self._server.wait_closed()
+
+    def drop(self):
+        '''Drop all client connections.'''
+        for w in self._writers:
+            w.close()
+        self._writers = []
+        self._subscriptions = dict()
+
+    def _packet(self, t, body):
+        '''Build a packet.'''
+        n = len(body)
+        rl = bytearray()
+        while True:
+            b = n % 128
+            n = n // 128
+            rl.append(b | (0x80 if n > 0 else 0))
+            if n == 0:
+                break
+        return bytes([t]) + bytes(rl) + body
+
+    def _publish(self, topic, payload, retain = False):
+        '''Build a QoS 0 publish packet.'''
+        t = topic.encode()
+        return self._packet(0x30 | (1 if retain else 0),
+                            len(t).to_bytes(2, 'big') + t + payload)
+
+    def deliver(self, topic, payload):
+        '''Deliver a message to subscribers.
+
+        :param topic: the topic
+        :param payload: the payload'''
+        for (w, ts) in self._subscriptions.items():
+            if topic in ts:
+                w.write(self._publish(topic, payload))
+
+    async def _serve(self, reader, writer):
+        self._writers.append(writer)
+        try:
+            while True:
+                h = await reader.readexactly(1)
+                n, m = 0, 1
+                while True:
+                    b = (await reader.readexactly(1))[0]
+                    n += (b & 0x7f) * m
+                    m *= 128
+                    if b < 128:
+                        break
+                body = await reader.readexactly(n)
+                t = h[0] >> 4
+                if t == 1:
+                    # CONNECT
+                    self.connections += 1
+                    writer.write(b'\x20\x02\x00\x00')
+                elif t == 3:
+                    # PUBLISH
+                    qos = (h[0] >> 1) & 3
+                    retain = h[0] & 1
+                    tl = int.from_bytes(body[:2], 'big')
+                    topic = body[2:2 + tl].decode()
+                    i = 2 + tl
+                    if qos > 0:
+                        pid = body[i:i + 2]
+                        i += 2
+                    payload = body[i:]
+                    self.messages.append((topic, payload, retain))
+                    if retain:
+                        self.retained[topic] = payload
+                    if qos > 0 and self.ack:
+                        writer.write(b'\x40\x02' + pid)
+                    self.deliver(topic, payload)
+                elif t == 8:
+                    # SUBSCRIBE
+                    pid = body[:2]
+                    i = 2
+                    ts = self._subscriptions.setdefault(writer, set())
+                    rcs = bytearray()
+                    new = []
+                    while i < len(body):
+                        tl = int.from_bytes(body[i:i + 2], 'big')
+                        topic = body[i + 2:i + 2 + tl].decode()
+                        i += 3 + tl
+                        ts.add(topic)
+                        new.append(topic)
+                        rcs.append(0)
+                    writer.write(self._packet(0x90, pid + bytes(rcs)))
+                    for topic in new:
+                        if topic in self.retained:
+                            writer.write(self._publish(topic, self.retained[topic], True))
+                elif t == 10:
+                    # UNSUBSCRIBE
+                    pid = body[:2]
+                    i = 2
+                    ts = self._subscriptions.get(writer, set())
+                    while i < len(body):
+                        tl = int.from_bytes(body[i:i + 2], 'big')
+                        ts.discard(body[i + 2:i + 2 + tl].decode())
+                        i += 2 + tl
+                    writer.write(b'\xb0\x02' + pid)
+                elif t == 12:
+                    # PINGREQ
+                    writer.write(b'\xd0\x00')
+                elif t == 14:
+                    # DISCONNECT
+                    break
+                await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            self._subscriptions.pop(writer, None)
+            writer.close()
@@ -0,0 +1,81 @@
+# A minimal HTTP server for testing web reporters
+#
+# Copyright (C) 2023 Simon Dobson
+#
+# This file is part of whether, a modular IoT weather station
+#
+# whether is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# whether is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with whether. If not, see <http://www.gnu.org/licenses/gpl.html>.
+
+import time
+import threading
+from urllib.parse import urlparse, parse_qs
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+
+class FakeHTTPServer:
+    '''A minimal HTTP server, just enough to test web reporters.
+
+    The server runs in a background thread and records the requests
+    it receives. It answers each with the next of a list of canned
+    responses, or with a default once the list is exhausted, and
+    can be made slow. Connections are kept alive.
+    '''
+
+    def __init__(self):
+        self._server = None
+        self._thread = None
+        self.requests = []
+        self.responses = []
+        self.default = (200, b"success")
+        self.delay = 0
+
+    def start(self):
+        '''Start the server on a free port.
+
+        :returns: the URL of the server'''
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def _respond(self):
+                n = int(self.headers.get('Content-Length', 0))
+                body = self.rfile.read(n)
+                url = urlparse(self.path)
+                server.requests.append((self.command, url.path, parse_qs(url.query),
+                                        body, self.client_address[1]))
+                if server.delay > 0:
+                    time.sleep(server.delay)
+                (status, payload) = server.responses.pop(0) if len(server.responses) > 0 else server.default
+                self.send_response(status)
+                self.send_header('Content-Length', str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            do_GET = _respond
+            do_POST = _respond
+
+            def log_message(self, format, *args):
+                pass
+
+        self._server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self._server.daemon_threads = True
+        self._thread = threading.Thread(target=self._server.serve_forever, args=(0.05,), daemon=True)
+        self._thread.start()
+        return "http://127.0.0.1:{p}/upload".format(p=self._server.server_address[1])
+
+    def stop(self):
+        '''Stop the server.'''
+        self._server.shutdown()
+        self._server.server_close()
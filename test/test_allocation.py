@@ -0,0 +1,85 @@
+# Tests of allocation on the sampling hot path
+#
+# Copyright (C) 2023 Simon Dobson
+#
+# This file is part of whether, a modular IoT weather station
+#
+# whether is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# whether is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with whether. If not, see <http://www.gnu.org/licenses/gpl.html>.
+
+import unittest
+import tracemalloc
+from whether import RingBuffer, Sampler
+
+
+class ReadingSampler(Sampler):
+    '''A sampler that fills its events in place.'''
+
+    def __init__(self, ring):
+        super().__init__('reading', ring, 1)
+        self._v = 1000.0
+
+    def sampleInto(self, ev):
+        self._v += 0.5
+        ev['v'] = self._v
+        return True
+
+
+class AllocationTest(unittest.TestCase):
+
+    def allocated(self, s, n):
+        '''Return the bytes retained per sample after n samples, and
+        the peak transient allocation.'''
+        tracemalloc.start()
+        try:
+            before = tracemalloc.get_traced_memory()[0]
+            tracemalloc.reset_peak()
+            for _ in range(n):
+                s.takeSample()
+            (after, peak) = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+        return ((after - before) / n, peak - before)
+
+    def testSlotsPreallocated(self):
+        '''Test a sensor pre-allocates its ring's slots.'''
+        ring = RingBuffer(10)
+        ReadingSampler(ring)
+        self.assertIsNotNone(ring.claim())
+
+    def testSlotsReused(self):
+        '''Test that samples are written into the ring's slots.'''
+        ring = RingBuffer(5)
+        s = ReadingSampler(ring)
+        slots = set([id(ring.claim())])
+        for _ in range(20):
+            s.takeSample()
+            slots.add(id(ring.claim()))
+        self.assertEqual(len(slots), 6)
+
+    def testNoAllocation(self):
+        '''Test that sampling doesn't retain memory once the ring's
+        slots have all been used once.'''
+        ring = RingBuffer(50)
+        s = ReadingSampler(ring)
+        for _ in range(100):
+            s.takeSample()
+        (retained, peak) = self.allocated(s, 1000)
+        self.assertLess(retained, 1)
+        self.assertLess(peak, 512)
+
+    def testSampleStillWorks(self):
+        '''Test that sample() still returns a fresh event.'''
+        s = ReadingSampler(RingBuffer(5))
+        ev = s.sample()
+        self.assertEqual(ev['v'], 1000.5)
@@ -0,0 +1,115 @@
+# Tests of circuit breakers
+#
+# Copyright (C) 2023 Simon Dobson
+#
+# This file is part of whether, a modular IoT weather station
+#
+# whether is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# whether is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with whether. If not, see <http://www.gnu.org/licenses/gpl.html>.
+
+import unittest
+from whether import RingBuffer, Sampler, CircuitBreaker
+
+
+class FailingSampler(Sampler):
+    '''A sampler that fails to order.'''
+
+    def __init__(self):
+        super().__init__('failing', RingBuffer(10), 1)
+        self.broken = True
+        self.calls = 0
+
+    def sample(self):
+        self.calls += 1
+        if self.broken:
+            raise RuntimeError("broken")
+        return {'v': 1}
+
+
+class CircuitBreakerTest(unittest.TestCase):
+
+    def setUp(self):
+        self._health = RingBuffer(10)
+        self._breaker = CircuitBreaker('test', failures=3, backoff=10, maxBackoff=40,
+                                       ring=self._health)
+
+    def testOpens(self):
+        '''Test the breaker opens after enough failures.'''
+        for i in range(2):
+            self.assertTrue(self._breaker.allow(i))
+            self._breaker.failure(i)
+        self.assertEqual(self._breaker.state(), CircuitBreaker.CLOSED)
+        self._breaker.failure(2)
+        self.assertEqual(self._breaker.state(), CircuitBreaker.OPEN)
+        self.assertFalse(self._breaker.allow(3))
+        self.assertEqual(len(self._health), 1)
+        self.assertEqual(self._health.peek()[CircuitBreaker.STATE], CircuitBreaker.OPEN)
+
+    def testSuccessResets(self):
+        '''Test a success resets the failure count.'''
+        self._breaker.failure(0)
+        self._breaker.failure(1)
+        self._breaker.success()
+        self._breaker.failure(2)
+        self._breaker.failure(3)
+        self.assertEqual(self._breaker.state(), CircuitBreaker.CLOSED)
+        self.assertEqual(len(self._health), 0)
+
+    def testBackoff(self):
+        '''Test the probes back off exponentially to the maximum.'''
+        for i in range(3):
+            self._breaker.failure(0)
+        now = 0
+        for b in [20, 40, 40]:
+            now += self._breaker.backoff()
+            self.assertFalse(self._breaker.allow(now - 1))
+            self.assertTrue(self._breaker.allow(now))
+            self.assertEqual(self._breaker.state(), CircuitBreaker.HALF_OPEN)
+            self._breaker.failure(now)
+            self.assertEqual(self._breaker.state(), CircuitBreaker.OPEN)
+            self.assertEqual(self._breaker.backoff(), b)
+
+    def testRecovers(self):
+        '''Test a successful probe closes the breaker.'''
+        for i in range(3):
+            self._breaker.failure(0)
+        self.assertTrue(self._breaker.allow(10))
+        self._breaker.success()
+        self.assertEqual(self._breaker.state(), CircuitBreaker.CLOSED)
+        self.assertEqual(self._breaker.backoff(), 10)
+        self.assertEqual([ev[CircuitBreaker.STATE] for ev in self._health],
+                         [CircuitBreaker.OPEN, CircuitBreaker.HALF_OPEN, CircuitBreaker.CLOSED])
+
+    def testSampler(self):
+        '''Test an open breaker stops a sampler sampling.'''
+        s = FailingSampler()
+        s.setCircuitBreaker(CircuitBreaker(s.id(), failures=2, backoff=1000))
+        for _ in range(10):
+            s.takeSample()
+        self.assertEqual(s.calls, 2)
+        self.assertEqual(s.circuitBreaker().state(), CircuitBreaker.OPEN)
+        self.assertTrue(s.events().empty())
+
+    def testListenerFails(self):
+        '''Test a failing listener isn't held against the sensor.'''
+        s = FailingSampler()
+        s.broken = False
+        s.setCircuitBreaker(CircuitBreaker(s.id(), failures=1))
+
+        def listener(sensor, ev):
+            raise ValueError("listener")
+
+        s.addListener(listener)
+        s.takeSample()
+        self.assertEqual(s.circuitBreaker().state(), CircuitBreaker.CLOSED)
+        self.assertEqual(len(s.events()), 1)
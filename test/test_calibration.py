@@ -0,0 +1,77 @@
+# Tests of direction calibration tables
+#
+# Copyright (C) 2023 Simon Dobson
+#
+# This file is part of whether, a modular IoT weather station
+#
+# whether is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# whether is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with whether. If not, see <http://www.gnu.org/licenses/gpl.html>.
+
+import os
+import unittest
+from tempfile import NamedTemporaryFile
+from whether import DirectionTable, loadDirectionTable
+
+
+class DirectionTableTest(unittest.TestCase):
+
+    CALIBRATION = dict(N=9856, NNE=7168, NE=18496, ENE=13120,
+                       E=26944, ESE=23616, SE=48640, SSE=46656,
+                       S=62656, SSW=57920, SW=60544, WSW=52032,
+                       W=55552, WNW=35648, NW=38848, NNW=8960)
+
+    def nearest(self, r):
+        '''Find the distance to the nearest point by brute force.'''
+        return min([abs(r - v) for v in self.CALIBRATION.values()])
+
+    def testCalibrationPoints(self):
+        '''Test the calibration points map to themselves.'''
+        t = DirectionTable(self.CALIBRATION)
+        for (d, v) in self.CALIBRATION.items():
+            self.assertEqual(t.direction(v), d)
+
+    def testAllCodes(self):
+        '''Test every ADC code maps to its nearest point (or one of
+        them, for codes exactly between two points).'''
+        t = DirectionTable(self.CALIBRATION)
+        for c in range(1024):
+            r = c << 6
+            d = t.direction(r)
+            self.assertEqual(abs(r - self.CALIBRATION[d]), self.nearest(r))
+
+    def testIndex(self):
+        '''Test indices are into the sorted directions.'''
+        t = DirectionTable(self.CALIBRATION)
+        self.assertEqual(len(t.directions()), 16)
+        self.assertEqual(t.directions()[0], 'NNE')
+        self.assertEqual(t.directions()[t.index(0)], 'NNE')
+        self.assertEqual(t.directions()[t.index(65535)], 'S')
+
+    def testEmpty(self):
+        '''Test we reject empty calibrations.'''
+        with self.assertRaises(ValueError):
+            DirectionTable(dict())
+
+    def testSaveLoad(self):
+        '''Test we can round-trip a table through a file.'''
+        t = DirectionTable(self.CALIBRATION)
+        with NamedTemporaryFile(suffix='.json', delete=False) as fh:
+            fn = fh.name
+        try:
+            t.save(fn, sensitivity=0.04)
+            t1 = loadDirectionTable(fn)
+            self.assertEqual(t1.calibration(), self.CALIBRATION)
+            for c in range(1024):
+                self.assertEqual(t1.direction(c << 6), t.direction(c << 6))
+        finally:
+            os.unlink(fn)
@@ -0,0 +1,114 @@
+# Tests of time-series compression
+#
+# Copyright (C) 2023 Simon Dobson
+#
+# This file is part of whether, a modular IoT weather station
+#
+# whether is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# whether is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with whether. If not, see <http://www.gnu.org/licenses/gpl.html>.
+
+import unittest
+import io
+import math
+import random
+from whether.compression import GorillaCodec
+
+
+class GorillaCodecTest(unittest.TestCase):
+
+    def setUp(self):
+        self._codec = GorillaCodec()
+
+    def roundTrip(self, cols, formats = None):
+        return self._codec.decode(self._codec.encode(cols, formats))
+
+    def testTimestamps(self):
+        '''Test timestamps survive to the resolution, including irregular ones.'''
+        rnd = random.Random(1)
+        ts = [1700000000.0]
+        for i in range(500):
+            ts.append(ts[-1] + rnd.choice([1.0, 1.0, 1.0, 1.003, 0.998, 5.0, 3600.25]))
+        ts.append(ts[-1] - 10.0)
+        ts2 = self.roundTrip(dict(time=ts))["time"]
+        self.assertEqual(len(ts2), len(ts))
+        for (t, t2) in zip(ts, ts2):
+            self.assertAlmostEqual(t, t2, places=3)
+
+    def testRegularTimestampsSmall(self):
+        '''Test regular timestamps take about a bit each.'''
+        ts = [1700000000.0 + i for i in range(1000)]
+        bs = self._codec.encode(dict(time=ts))
+        self.assertLess(len(bs), 1000 // 8 + 32)
+
+    def testFloats(self):
+        '''Test floats round-trip exactly, with missing values.'''
+        vs = [1.5, 1.5, 2.25, -0.0, 1e300, None, math.pi, 3.14, 3.14, 0.1]
+        self.assertEqual(self.roundTrip(dict(v=vs))["v"], vs)
+
+    def testSingleFloats(self):
+        '''Test floats given the "f" format are rounded to 32 bits, and compress better.'''
+        rnd = random.Random(2)
+        vs = [10 + rnd.gauss(0, 0.1) for _ in range(200)]
+        vs2 = self.roundTrip(dict(v=vs), dict(v='f'))["v"]
+        for (v, v2) in zip(vs, vs2):
+            self.assertAlmostEqual(v, v2, places=5)
+        self.assertLess(len(self._codec.encode(dict(v=vs), dict(v='f'))),
+                        len(self._codec.encode(dict(v=vs))))
+
+    def testIntegers(self):
+        '''Test integers round-trip.'''
+        vs = [-61, -61, -60, 0, 2 ** 40, -(2 ** 40), 7]
+        vs2 = self.roundTrip(dict(v=vs))["v"]
+        self.assertEqual(vs2, vs)
+        self.assertTrue(all([isinstance(v, int) for v in vs2]))
+
+    def testStrings(self):
+        '''Test categorical strings round-trip, with missing values.'''
+        vs = ["N", "N", "NNE", None, "N", "SSW", "SSW", "", "N"]
+        self.assertEqual(self.roundTrip(dict(winddir=vs))["winddir"], vs)
+
+    def testOneString(self):
+        '''Test a column of a single repeated value.'''
+        vs = ["normal"] * 100
+        bs = self._codec.encode(dict(tier=vs))
+        self.assertEqual(self._codec.decode(bs)["tier"], vs)
+        self.assertLess(len(bs), 32)
+
+    def testBlock(self):
+        '''Test a block of mixed columns, including the empty block.'''
+        cols = dict(time=[1.0, 2.0, 3.0], windspeed=[0.5, None, 1.0], winddir=["N", "S", "N"])
+        self.assertEqual(self.roundTrip(cols), cols)
+        self.assertEqual(self.roundTrip(dict(time=[])), dict(time=[]))
+        with self.assertRaises(ValueError):
+            self._codec.encode(dict(a=[1], b=[1, 2]))
+
+    def testMissingTimestamps(self):
+        '''Test a timestamp column with missing values is still stored.'''
+        cols = dict(time=[1.0, None, 3.0])
+        self.assertEqual(self.roundTrip(cols), cols)
+
+    def testStream(self):
+        '''Test blocks can be streamed, ignoring a truncated one.'''
+        fh = io.BytesIO()
+        blocks = [dict(time=[float(i), i + 1.0], v=[i, i]) for i in range(5)]
+        for b in blocks:
+            self._codec.writeBlock(fh, b)
+        n = fh.tell()
+        self._codec.writeBlock(fh, dict(time=[1.0] * 100))
+        fh.truncate(n + 5)
+        fh.seek(0)
+        self.assertEqual(list(self._codec.readBlocks(fh)), blocks)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,57 @@
+# Tests of deadbands
+#
+# Copyright (C) 2023 Simon Dobson
+#
+# This file is part of whether, a modular IoT weather station
+#
+# whether is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# whether is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with whether. If not, see <http://www.gnu.org/licenses/gpl.html>.
+
+import unittest
+from whether.deadband import Deadband
+
+
+class DeadbandTest(unittest.TestCase):
+
+    def testFirstDue(self):
+        '''Test the first value is always due.'''
+        db = Deadband(1)
+        self.assertTrue(db.due(10, 0))
+
+    def testThreshold(self):
+        '''Test values are only due when they move beyond the threshold.'''
+        db = Deadband(1, 100)
+        db.reported(10, 0)
+        self.assertFalse(db.due(10.5, 1))
+        self.assertFalse(db.due(9, 1))
+        self.assertTrue(db.due(11.5, 1))
+        self.assertTrue(db.due(8.5, 1))
+
+    def testHeartbeat(self):
+        '''Test unchanged values are due after the maximum silence.'''
+        db = Deadband(1, 100)
+        db.reported(10, 0)
+        self.assertFalse(db.due(10, 99))
+        self.assertTrue(db.due(10, 100))
+
+    def testNonNumeric(self):
+        '''Test non-numeric values are due when they change.'''
+        db = Deadband(5, 100)
+        db.reported("N", 0)
+        self.assertFalse(db.due("N", 1))
+        self.assertTrue(db.due("NNE", 1))
+        self.assertTrue(db.due(None, 1))
+
+
+if __name__ == '__main__':
+    unittest.main()
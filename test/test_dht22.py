@@ -0,0 +1,144 @@
+# Tests of DHT22 read pacing
+#
+# Copyright (C) 2023 Simon Dobson
+#
+# This file is part of whether, a modular IoT weather station
+#
+# whether is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# whether is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with whether. If not, see <http://www.gnu.org/licenses/gpl.html>.
+
+import unittest
+from unittest.mock import patch, PropertyMock
+from whether import RingBuffer, DHT22, CircuitBreaker
+
+
+class DHT22Test(unittest.TestCase):
+
+    def setUp(self):
+        with patch('adafruit_dht.DHT22'):
+            self._dht = DHT22('th', None, RingBuffer(10), period=10,
+                              minInterval=2, budget=5, maxAge=60)
+        self._now = 100.0
+        self._clock = patch('time.monotonic', lambda: self._now)
+        self._clock.start()
+
+    def tearDown(self):
+        self._clock.stop()
+
+    def reading(self, t, h):
+        '''Make the device return the given reading.'''
+        type(self._dht._dht).temperature = PropertyMock(return_value=t)
+        type(self._dht._dht).humidity = PropertyMock(return_value=h)
+
+    def failing(self):
+        '''Make the device fail to read.'''
+        type(self._dht._dht).temperature = PropertyMock(side_effect=RuntimeError("checksum"))
+
+    def testFresh(self):
+        '''Test a fresh reading has age zero.'''
+        self.reading(20.0, 50.0)
+        ev = self._dht.sample()
+        self.assertEqual(ev[DHT22.TEMPERATURE], 20.0)
+        self.assertEqual(ev[DHT22.HUMIDITY], 50.0)
+        self.assertEqual(ev[DHT22.AGE], 0)
+
+    def testPacing(self):
+        '''Test we serve from the cache inside the pacing window.'''
+        self.reading(20.0, 50.0)
+        self._dht.sample()
+        self.reading(21.0, 51.0)
+        self._now += 1
+        ev = self._dht.sample()
+        self.assertEqual(ev[DHT22.TEMPERATURE], 20.0)
+        self.assertEqual(ev[DHT22.AGE], 1)
+        self._now += 2
+        ev = self._dht.sample()
+        self.assertEqual(ev[DHT22.TEMPERATURE], 21.0)
+        self.assertEqual(ev[DHT22.AGE], 0)
+
+    def testRetry(self):
+        '''Test we retry quickly within the budget, then serve the cache.'''
+        self.reading(20.0, 50.0)
+        self._dht.sample()
+        self.assertEqual(self._dht.delay(), 10)
+
+        self.failing()
+        self._now += 10
+        self.assertIsNone(self._dht.sample())
+        self.assertLess(self._dht.delay(), 10)
+        self._now += 3
+        self.assertIsNone(self._dht.sample())
+        self._now += 3
+        ev = self._dht.sample()
+        self.assertEqual(ev[DHT22.TEMPERATURE], 20.0)
+        self.assertEqual(ev[DHT22.AGE], 16)
+        self.assertEqual(self._dht.delay(), 10)
+
+    def testRetrySucceeds(self):
+        '''Test a successful retry ends the retrying.'''
+        self.failing()
+        self.assertIsNone(self._dht.sample())
+        self.reading(20.0, 50.0)
+        self._now += 3
+        ev = self._dht.sample()
+        self.assertEqual(ev[DHT22.AGE], 0)
+        self.assertEqual(self._dht.delay(), 10)
+
+    def testNoCache(self):
+        '''Test we raise an error when out of retries with no cache.'''
+        self.failing()
+        self._dht.sample()
+        self._now += 6
+        with self.assertRaises(RuntimeError):
+            self._dht.sample()
+
+    def testTooOld(self):
+        '''Test we don't serve readings older than the maximum age.'''
+        self.reading(20.0, 50.0)
+        self._dht.sample()
+        self.failing()
+        self._now += 100
+        self._dht.sample()
+        self._now += 6
+        with self.assertRaises(RuntimeError):
+            self._dht.sample()
+
+    def testBreakerOpens(self):
+        '''Test a dead sensor opens its breaker despite the cache and retries.'''
+        b = CircuitBreaker('th', failures=3, backoff=1000)
+        self._dht.setCircuitBreaker(b)
+        self.reading(20.0, 50.0)
+        self._dht.takeSample()
+        self.failing()
+        for _ in range(100):
+            self._now += self._dht.delay()
+            self._dht.takeSample()
+        self.assertEqual(b.state(), CircuitBreaker.OPEN)
+
+    def testBreakerProbes(self):
+        '''Test a probe keeps retrying until the sensor recovers.'''
+        b = CircuitBreaker('th', failures=1, backoff=10)
+        self._dht.setCircuitBreaker(b)
+        self.failing()
+        self._dht.takeSample()
+        self._now += 6
+        self._dht.takeSample()
+        self.assertEqual(b.state(), CircuitBreaker.OPEN)
+        self._now += 10
+        self._dht.takeSample()
+        self.assertEqual(b.state(), CircuitBreaker.HALF_OPEN)
+        self.reading(20.0, 50.0)
+        self._now += self._dht.delay()
+        self._dht.takeSample()
+        self.assertEqual(b.state(), CircuitBreaker.CLOSED)
+        self.assertEqual(len(self._dht.events()), 1)
@@ -0,0 +1,128 @@
+# Tests of typed events
+#
+# Copyright (C) 2023 Simon Dobson
+#
+# This file is part of whether, a modular IoT weather station
+#
+# whether is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# whether is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with whether. If not, see <http://www.gnu.org/licenses/gpl.html>.
+
+import unittest
+import json
+import math
+from whether import RingBuffer, Sampler, eventClass
+
+
+TestEvent = eventClass("TestEvent",
+                       ["time", "id", "temp", "dir"],
+                       {"time": 'd', "temp": 'f', "dir": '3s'})
+
+
+class TypedSampler(Sampler):
+
+    EVENT = TestEvent
+
+    def sampleInto(self, ev):
+        ev["temp"] = 21.5
+        ev["dir"] = "NNE"
+        return True
+
+
+class EventTest(unittest.TestCase):
+
+    def testDictAccess(self):
+        '''Test events behave like dicts.'''
+        ev = TestEvent()
+        self.assertEqual(len(ev), 0)
+        self.assertNotIn("temp", ev)
+        self.assertIsNone(ev.get("temp"))
+        with self.assertRaises(KeyError):
+            ev["temp"]
+        ev["temp"] = 10
+        ev.update({"dir": "N"})
+        self.assertEqual(ev["temp"], 10)
+        self.assertIn("temp", ev)
+        self.assertEqual(list(ev.keys()), ["temp", "dir"])
+        self.assertEqual(ev, {"temp": 10, "dir": "N"})
+
+    def testNoNewTags(self):
+        '''Test we can't add tags that aren't in the class.'''
+        ev = TestEvent()
+        with self.assertRaises(KeyError):
+            ev["rain"] = 1
+        with self.assertRaises(AttributeError):
+            ev.rain = 1
+
+    def testJSON(self):
+        '''Test JSON serialisation matches the standard encoder.'''
+        ev = TestEvent()
+        ev.update({"time": 1700000000.25, "id": "th\"1", "temp": 21.5})
+        d = json.loads(ev.toJSON())
+        self.assertEqual(d, {"time": 1700000000.25, "id": "th\"1", "temp": 21.5, "dir": None})
+
+    def testJSONPercent(self):
+        '''Test tags containing % serialise to JSON.'''
+        E = eventClass("E", ["a%b", "%s"])
+        ev = E()
+        ev["a%b"] = 1
+        self.assertEqual(json.loads(ev.toJSON()), {"a%b": 1, "%s": None})
+
+    def testBinary(self):
+        '''Test binary serialisation round-trips.'''
+        ev = TestEvent()
+        ev.update({"time": 1700000000.25, "id": "th1", "temp": 21.5, "dir": "SSW"})
+        bs = ev.toBinary()
+        self.assertEqual(len(bs), 8 + 4 + 3)
+        ev1 = TestEvent().fromBinary(bs)
+        self.assertEqual(ev1, {"time": 1700000000.25, "temp": 21.5, "dir": "SSW"})
+
+    def testBinaryMissing(self):
+        '''Test missing numeric values round-trip as None.'''
+        ev = TestEvent()
+        ev["time"] = 0.0
+        ev1 = TestEvent().fromBinary(ev.toBinary())
+        self.assertIsNone(ev1["temp"])
+        self.assertEqual(ev1["dir"], "")
+
+    def testFormats(self):
+        '''Test we can retrieve the binary layout.'''
+        self.assertEqual(TestEvent.formats(), {"time": 'd', "temp": 'f', "dir": '3s'})
+        self.assertEqual(list(TestEvent.formats().keys()), ["time", "temp", "dir"])
+        self.assertEqual(eventClass("E", ["a"]).formats(), dict())
+
+    def testNoBinary(self):
+        '''Test we can't serialise to binary without a layout.'''
+        E = eventClass("E", ["a"])
+        ev = E()
+        with self.assertRaises(ValueError):
+            ev.toBinary()
+
+    def testBadFormat(self):
+        '''Test we can't give a format for a missing tag.'''
+        with self.assertRaises(ValueError):
+            eventClass("E", ["a"], {"b": 'f'})
+
+    def testSamplerSlots(self):
+        '''Test a sampler fills its ring with typed events.'''
+        ring = RingBuffer(4)
+        s = TypedSampler("t", ring)
+        s.takeSample()
+        ev = ring.pop()
+        self.assertIsInstance(ev, TestEvent)
+        self.assertEqual(ev["id"], "t")
+        self.assertEqual(ev["dir"], "NNE")
+        self.assertFalse(math.isnan(ev["time"]))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,75 @@
+# Tests of decimation filters
+#
+# Copyright (C) 2023 Simon Dobson
+#
+# This file is part of whether, a modular IoT weather station
+#
+# whether is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# whether is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with whether. If not, see <http://www.gnu.org/licenses/gpl.html>.
+
+import unittest
+from array import array
+import whether.filters
+from whether.filters import boxcar, majority
+from whether import DirectionTable
+
+
+class FiltersTest(unittest.TestCase):
+
+    def setUp(self):
+        self._numpy = whether.filters.numpy
+
+    def tearDown(self):
+        whether.filters.numpy = self._numpy
+
+    def withAndWithoutNumPy(self, f):
+        '''Run a test both with NumPy (if available) and without.'''
+        if self._numpy is not None:
+            f()
+        whether.filters.numpy = None
+        f()
+
+    def testBoxcar(self):
+        '''Test we average a block.'''
+        def check():
+            self.assertEqual(boxcar(array('H', [10, 20, 30, 40])), 25)
+            self.assertEqual(boxcar(array('H', [65535, 65535])), 65535)
+        self.withAndWithoutNumPy(check)
+
+    def testBoxcarEmpty(self):
+        '''Test we can't average an empty block.'''
+        with self.assertRaises(ValueError):
+            boxcar(array('H'))
+
+    def testMajority(self):
+        '''Test the most common class wins.'''
+        lut = array('B', [0, 0, 1, 1, 2, 2, 3, 3])
+        def check():
+            self.assertEqual(majority(array('H', [0, 2, 3, 3, 7]), lut, 0, 4), 1)
+            self.assertEqual(majority(array('H', [7, 6, 0]), lut, 0, 4), 3)
+        self.withAndWithoutNumPy(check)
+
+    def testMajorityTie(self):
+        '''Test ties go to the lower class.'''
+        lut = array('B', [0, 0, 1, 1, 2, 2, 3, 3])
+        def check():
+            self.assertEqual(majority(array('H', [6, 2, 7, 3]), lut, 0, 4), 1)
+        self.withAndWithoutNumPy(check)
+
+    def testVote(self):
+        '''Test voting on directions despite noise.'''
+        t = DirectionTable(dict(N=9856, NNE=7168, NNW=8960, S=62656))
+        block = array('H', [9856, 9900, 9000, 9856, 9800, 7168])
+        def check():
+            self.assertEqual(t.directions()[t.vote(block)], 'N')
+        self.withAndWithoutNumPy(check)
@@ -0,0 +1,210 @@
+# Tests of the Home Assistant reporter
+#
+# Copyright (C) 2023 Simon Dobson
+#
+# This file is part of whether, a modular IoT weather station
+#
+# whether is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# whether is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with whether. If not, see <http://www.gnu.org/licenses/gpl.html>.
+
+import unittest
+import asyncio
+import json
+from test.fakebroker import FakeBroker
+from whether import RingBuffer, Sampler, HomeAssistant, CircuitBreaker
+from whether.payloads import JSONCodec, CBORCodec
+
+
+class Thermometer(Sampler):
+
+    TEMPERATURE = "temp"
+
+    def sample(self):
+        return {self.TEMPERATURE: 20}
+
+
+class HomeAssistantTest(unittest.TestCase):
+
+    def reporter(self, server, port = 1883, **kwds):
+        self._th = Thermometer("th", RingBuffer(10), 0.01)
+        ha = HomeAssistant(server, "user", "password", "whether/state",
+                           {HomeAssistant.TEMPERATURE: self._th},
+                           period=0.05, port=port, timeout=0.1, backoff=0.01, maxBackoff=0.04,
+                           **kwds)
+        ha.DISCOVERY_WAIT = 0.05
+        return ha
+
+    def configs(self, ms):
+        return [m for m in ms if m[0] == "homeassistant/sensor/temperature/config"]
+
+    def testNotConnectedAtStart(self):
+        '''Test creating the reporter doesn't connect.'''
+        ha = self.reporter("127.0.0.1")
+        self.assertFalse(ha.connected())
+
+    def testJSONOnly(self):
+        '''Test the reporter refuses codecs Home Assistant can't read.'''
+        self.reporter("127.0.0.1", codec=JSONCodec())
+        with self.assertRaises(ValueError):
+            self.reporter("127.0.0.1", codec=CBORCodec())
+
+    def testDiscoverThenReport(self):
+        '''Test we issue discovery messages and then report.'''
+        async def main():
+            broker = FakeBroker()
+            port = await broker.start()
+            ha = self.reporter("127.0.0.1", port)
+            tasks = [asyncio.create_task(self._th.run()),
+                     asyncio.create_task(ha.run())]
+            while len(self.configs(broker.messages)) == 0 or broker.messages[-1][0] != "whether/state":
+                await asyncio.sleep(0.01)
+            for t in tasks:
+                t.cancel()
+            await broker.stop()
+            return broker.messages
+
+        ms = asyncio.run(asyncio.wait_for(main(), 5))
+        cs = self.configs(ms)
+        self.assertEqual(len(cs), 1)
+        self.assertTrue(cs[0][2])
+        self.assertEqual(json.loads(cs[0][1])['unique_id'], "whether-temperature")
+        self.assertEqual(ms[-1][0], "whether/state")
+        self.assertEqual(json.loads(ms[-1][1])['temperature'], 20)
+
+    def testRetainedDiscovery(self):
+        '''Test we don't republish discovery messages the server holds.'''
+        async def main():
+            broker = FakeBroker()
+            port = await broker.start()
+            ha = self.reporter("127.0.0.1", port)
+            (topic, config) = ha.discovery()[0]
+            broker.retained[topic] = config
+            task = asyncio.create_task(ha.connection().run())
+            await asyncio.sleep(0.2)
+            task.cancel()
+            await broker.stop()
+            return broker.messages
+
+        ms = asyncio.run(asyncio.wait_for(main(), 5))
+        self.assertEqual(len(self.configs(ms)), 0)
+
+    def testChangedDiscovery(self):
+        '''Test we republish discovery messages that have changed.'''
+        async def main():
+            broker = FakeBroker()
+            port = await broker.start()
+            ha = self.reporter("127.0.0.1", port)
+            (topic, _) = ha.discovery()[0]
+            broker.retained[topic] = b"{}"
+            task = asyncio.create_task(ha.connection().run())
+            await asyncio.sleep(0.2)
+            task.cancel()
+            await broker.stop()
+            return (broker.retained[topic], ha.discovery()[0][1])
+
+        (retained, config) = asyncio.run(asyncio.wait_for(main(), 5))
+        self.assertEqual(retained, config)
+
+    def testBirthMessage(self):
+        '''Test we republish discovery messages when Home Assistant starts.'''
+        async def main():
+            broker = FakeBroker()
+            port = await broker.start()
+            ha = self.reporter("127.0.0.1", port)
+            task = asyncio.create_task(ha.connection().run())
+            await asyncio.sleep(0.2)
+            n = len(self.configs(broker.messages))
+            broker.deliver("homeassistant/status", b"online")
+            await asyncio.sleep(0.1)
+            task.cancel()
+            await broker.stop()
+            return (n, len(self.configs(broker.messages)))
+
+        (before, after) = asyncio.run(asyncio.wait_for(main(), 5))
+        self.assertEqual(before, 1)
+        self.assertEqual(after, 2)
+
+    def testPerField(self):
+        '''Test publishing fields by exception.'''
+        async def main():
+            broker = FakeBroker()
+            port = await broker.start()
+            ha = self.reporter("127.0.0.1", port, perField=True, heartbeat=0.2)
+            tasks = [asyncio.create_task(self._th.run()),
+                     asyncio.create_task(ha.run())]
+            await asyncio.sleep(0.35)
+            for t in tasks:
+                t.cancel()
+            await broker.stop()
+            return broker.messages
+
+        ms = asyncio.run(asyncio.wait_for(main(), 5))
+        config = json.loads(self.configs(ms)[0][1])
+        self.assertEqual(config['state_topic'], "whether/state/temperature")
+        self.assertNotIn('value_template', config)
+
+        # the unchanging temperature is sent once, then again on the heartbeat
+        fs = [m for m in ms if m[0] == "whether/state/temperature"]
+        self.assertEqual(len(fs), 2)
+        self.assertEqual(fs[0][1:], (b"20.0", 1))
+
+    def testPerFieldMissing(self):
+        '''Test fields without values aren't published by exception.'''
+        ha = self.reporter("127.0.0.1", perField=True)
+        ps = []
+        ha.connection().publish = lambda t, p, retain = False: ps.append((t, p, retain))
+        ha.submitFields({"temperature": 20.0, "humidity": None})
+        ha.submitFields({"temperature": 20.0, "humidity": 80.0})
+        self.assertEqual(ps, [("whether/state/temperature", "20.0", True),
+                              ("whether/state/humidity", "80.0", True)])
+
+    def testHealth(self):
+        '''Test sensor health is published on connection and when a breaker changes state.'''
+        async def main():
+            broker = FakeBroker()
+            port = await broker.start()
+            ha = self.reporter("127.0.0.1", port)
+            b = CircuitBreaker("th", failures=1)
+            ha.addBreaker(b)
+            task = asyncio.create_task(ha.connection().run())
+            await asyncio.sleep(0.2)
+            b.failure(0)
+            await asyncio.sleep(0.1)
+            task.cancel()
+            await broker.stop()
+            return broker.messages
+
+        ms = asyncio.run(asyncio.wait_for(main(), 5))
+        config = [json.loads(m[1]) for m in ms if m[0] == "homeassistant/sensor/th-health/config"][0]
+        self.assertEqual(config['state_topic'], "whether/state/health/th")
+        hs = [m[1:] for m in ms if m[0] == "whether/state/health/th"]
+        self.assertEqual(hs, [(b"ok", 1), (b"failed", 1)])
+
+    def testSensorsStartFirst(self):
+        '''Test sensors sample while the server is unreachable.'''
+        async def main():
+            ha = self.reporter("127.0.0.1", 1)
+            tasks = [asyncio.create_task(self._th.run()),
+                     asyncio.create_task(ha.run())]
+            await asyncio.sleep(0.1)
+            for t in tasks:
+                t.cancel()
+            return ha
+
+        ha = asyncio.run(main())
+        self.assertFalse(ha.connected())
+        self.assertGreater(len(self._th.events()), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,70 @@
+# Tests of lazy importing
+#
+# Copyright (C) 2023 Simon Dobson
+#
+# This file is part of whether, a modular IoT weather station
+#
+# whether is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# whether is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with whether. If not, see <http://www.gnu.org/licenses/gpl.html>.
+
+import unittest
+import sys
+import subprocess
+import whether
+
+
+class ImportTest(unittest.TestCase):
+
+    def modulesAfter(self, code):
+        '''Run code in a fresh interpreter and return the modules it loaded.
+
+        :param code: the code
+        :returns: a set of module names'''
+        out = subprocess.run([sys.executable, '-c', code + '; import sys; print(" ".join(sys.modules.keys()))'],
+                             capture_output=True, text=True, check=True)
+        return set(out.stdout.split())
+
+    def testImportIsLight(self):
+        '''Test importing the package doesn't import drivers or their libraries.'''
+        ms = self.modulesAfter('import whether')
+        for m in ['whether.sensortypes', 'whether.DHT22', 'whether.homeassistant',
+                  'keypad', 'adafruit_dht', 'pijuice', 'paho', 'requests', 'numpy']:
+            self.assertNotIn(m, ms)
+
+    def testImportOnUse(self):
+        '''Test a driver is imported when first used.'''
+        ms = self.modulesAfter('from whether import Host')
+        self.assertIn('whether.host', ms)
+        self.assertNotIn('whether.homeassistant', ms)
+
+    def testLazyNames(self):
+        '''Test lazily-imported names resolve to the right objects.'''
+        from whether.sensortypes import Sampler
+        self.assertIs(whether.Sampler, Sampler)
+        self.assertIn('Sampler', dir(whether))
+
+    def testImportStar(self):
+        '''Test a wildcard import only brings in the eagerly-imported names.'''
+        self.assertNotIn('Sampler', whether.__all__)
+        ms = self.modulesAfter('from whether import *')
+        for m in ['whether.sensortypes', 'whether.pijuice', 'pijuice', 'paho', 'requests']:
+            self.assertNotIn(m, ms)
+
+    def testUnknownName(self):
+        '''Test unknown names still raise AttributeError.'''
+        with self.assertRaises(AttributeError):
+            whether.NoSuchDriver
+
+
+if __name__ == '__main__':
+    unittest.main()
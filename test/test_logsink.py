@@ -0,0 +1,169 @@
+# Tests of lazy logging and the batched log sink
+#
+# Copyright (C) 2023 Simon Dobson
+#
+# This file is part of whether, a modular IoT weather station
+#
+# whether is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# whether is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with whether. If not, see <http://www.gnu.org/licenses/gpl.html>.
+
+import unittest
+import asyncio
+import io
+import os
+import tempfile
+from unittest.mock import patch
+import adafruit_logging as logging
+from whether import RingBuffer, LazyLogger, BatchedHandler
+
+
+class Formatted:
+    '''An argument that counts how often it's formatted.'''
+
+    def __init__(self):
+        self.n = 0
+
+    def __str__(self):
+        self.n += 1
+        return "formatted"
+
+
+class Recorder(logging.Handler):
+    '''A conventional handler recording messages.'''
+
+    def __init__(self):
+        super().__init__()
+        self.msgs = []
+
+    def emit(self, record):
+        self.msgs.append(record.msg)
+
+
+class LogSinkTest(unittest.TestCase):
+
+    def setUp(self):
+        self._logger = LazyLogger("test")
+        self._logger.setLevel(logging.INFO)
+        self._handler = BatchedHandler()
+        self._logger.addHandler(self._handler)
+
+    def testSuppressedNotFormatted(self):
+        '''Test messages below the level aren't formatted or queued.'''
+        a = Formatted()
+        self._logger.debug("value %s", a)
+        self.assertEqual(a.n, 0)
+        self.assertEqual(self._handler.pending(), 0)
+
+    def testFormattedLater(self):
+        '''Test queued messages are only formatted when written.'''
+        a = Formatted()
+        self._logger.info("value %s", a)
+        self.assertEqual(a.n, 0)
+        self.assertEqual(self._handler.pending(), 1)
+        self.assertTrue(self._handler.batch().endswith("INFO - value formatted\n"))
+        self.assertEqual(a.n, 1)
+        self.assertEqual(self._handler.batch(), "")
+
+    def testConventionalHandler(self):
+        '''Test other handlers get formatted messages.'''
+        h = Recorder()
+        self._logger.addHandler(h)
+        self._logger.info("value %s", 1)
+        self.assertEqual(h.msgs, ["value 1"])
+
+    def testRepeatsSummarised(self):
+        '''Test repeated messages are summarised.'''
+        self._logger.info("Dropped item from ring buffer %s", "X")
+        for _ in range(56):
+            self._logger.info("Dropped item from ring buffer %s", "X")
+        self._logger.warning("something else")
+        lines = self._handler.batch().splitlines()
+        self.assertEqual(len(lines), 3)
+        self.assertTrue(lines[0].endswith("Dropped item from ring buffer X"))
+        self.assertTrue(lines[1].endswith("WARNING - something else"))
+        self.assertTrue(lines[2].endswith("Dropped item from ring buffer X (repeated 57 times)"))
+
+    def testRingDrops(self):
+        '''Test ring buffer drops are summarised per ring.'''
+        import whether
+        whether.logger.addHandler(self._handler)
+        level = whether.logger.getEffectiveLevel()
+        whether.logger.setLevel(logging.INFO)
+        try:
+            r = RingBuffer(2, name="X")
+            for i in range(10):
+                r.push(i)
+        finally:
+            whether.logger.removeHandler(self._handler)
+            whether.logger.setLevel(level)
+        lines = self._handler.batch().splitlines()
+        self.assertEqual(len(lines), 2)
+        self.assertTrue(lines[1].endswith("Dropped item from ring buffer X (repeated 8 times)"))
+
+    def testBounded(self):
+        '''Test the queue is bounded.'''
+        h = BatchedHandler(maxRecords=3)
+        self._logger.addHandler(h)
+        for i in range(5):
+            self._logger.info("record %s", i)
+        self.assertEqual(h.pending(), 3)
+        lines = h.batch().splitlines()
+        self.assertEqual(len(lines), 4)
+        self.assertTrue(lines[3].endswith("2 log records discarded"))
+
+    def testBackgroundWrites(self):
+        '''Test records are written to a file in the background.'''
+        with tempfile.TemporaryDirectory() as dir:
+            fn = os.path.join(dir, "log")
+            h = BatchedHandler(filename=fn, interval=0.01)
+            self._logger.addHandler(h)
+
+            async def main():
+                t = asyncio.create_task(h.run())
+                self._logger.info("first")
+                await asyncio.sleep(0.1)
+                self._logger.info("second")
+                t.cancel()
+                await asyncio.gather(t, return_exceptions=True)
+
+            asyncio.run(main())
+            with open(fn) as fh:
+                lines = fh.read().splitlines()
+        self.assertEqual(len(lines), 2)
+        self.assertTrue(lines[1].endswith("INFO - second"))
+
+    def testUnwritableFile(self):
+        '''Test records go to standard error when the log file can't be written.'''
+        with tempfile.TemporaryDirectory() as dir:
+            fn = os.path.join(dir, "missing", "log")
+            h = BatchedHandler(filename=fn, interval=0.01)
+            self._logger.addHandler(h)
+
+            async def main():
+                t = asyncio.create_task(h.run())
+                self._logger.info("first")
+                self._logger.info("second")
+                await asyncio.sleep(0.1)
+                self.assertFalse(t.done())
+                t.cancel()
+                await asyncio.gather(t, return_exceptions=True)
+
+            with patch('sys.stderr', new_callable=io.StringIO) as err:
+                asyncio.run(main())
+        self.assertEqual(h.dropped(), 2)
+        self.assertIn("Can't write log", err.getvalue())
+        self.assertTrue(err.getvalue().endswith("INFO - second\n"))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,207 @@
+# Tests of the shared MCP3008 bus
+#
+# Copyright (C) 2023 Simon Dobson
+#
+# This file is part of whether, a modular IoT weather station
+#
+# whether is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# whether is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with whether. If not, see <http://www.gnu.org/licenses/gpl.html>.
+
+import unittest
+import asyncio
+from unittest.mock import patch
+from whether import RingBuffer, MCP3008Bus, AnalogueSampler, CircuitBreaker
+
+
+class FakeSPIDevice:
+    '''An SPI device with an MCP3008 on it, whose channels read as
+    their channel number plus the number of conversions so far.'''
+
+    def __init__(self, spi, cs, baudrate = 100000):
+        self.conversions = []
+        self.locks = 0
+
+    def __enter__(self):
+        self.locks += 1
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def write_readinto(self, out, into):
+        ch = (out[1] >> 4) & 0x07
+        self.conversions.append(ch)
+        v = (ch * 100 + len(self.conversions)) & 0x3ff
+        into[0] = 0
+        into[1] = v >> 8
+        into[2] = v & 0xff
+
+
+class Channel(AnalogueSampler):
+
+    VALUE = "value"
+
+    def convert(self, r, ev):
+        ev[self.VALUE] = r >> 6
+        return True
+
+
+class Stop(Exception):
+    pass
+
+
+class MCP3008BusTest(unittest.TestCase):
+
+    def setUp(self):
+        with patch('whether.mcp3008.digitalio.DigitalInOut'), \
+             patch('whether.mcp3008.SPIDevice', FakeSPIDevice):
+            self._bus = MCP3008Bus(None, tick=1, spi=object())
+        self._device = self._bus._device
+        self._now = 100.0
+        self._clock = patch('time.monotonic', lambda: self._now)
+        self._clock.start()
+
+    def tearDown(self):
+        self._clock.stop()
+
+    def sweepFor(self, ticks):
+        '''Run the sweep for a number of ticks on a fake clock.'''
+        n = [0]
+
+        async def tick(t):
+            n[0] += 1
+            if n[0] == ticks:
+                raise Stop()
+            self._now += t
+
+        async def main():
+            with patch('whether.mcp3008.asyncio.sleep', tick):
+                with self.assertRaises(Stop):
+                    await self._bus.sweeping()
+
+        asyncio.run(main())
+
+    def testRegister(self):
+        '''Test channels are validated and registered once each.'''
+        Channel("a", self._bus, 3, RingBuffer(10))
+        Channel("b", self._bus, 3, RingBuffer(10))
+        Channel("c", self._bus, 0, RingBuffer(10))
+        self.assertEqual(self._bus.channels(), [3, 0])
+        for ch in [-1, MCP3008Bus.CHANNELS]:
+            with self.assertRaises(ValueError):
+                Channel("d", self._bus, ch, RingBuffer(10))
+        with self.assertRaises(ValueError):
+            Channel("e", self._bus, 1, RingBuffer(10), oversample=0)
+
+    def testSweep(self):
+        '''Test a sweep converts each channel once in a single burst.'''
+        Channel("a", self._bus, 3, RingBuffer(10))
+        Channel("b", self._bus, 3, RingBuffer(10))
+        Channel("c", self._bus, 5, RingBuffer(10))
+        self._bus.sweep()
+        self.assertEqual(self._device.conversions, [3, 5])
+        self.assertEqual(self._device.locks, 1)
+
+    def testReadBlock(self):
+        '''Test an oversampled channel is read as a block and averaged.'''
+        s = Channel("a", self._bus, 2, RingBuffer(10), oversample=4)
+        block = self._bus.readBlock(2)
+        self.assertEqual(list(block), [(200 + i) << 6 for i in range(1, 5)])
+        self.assertEqual(self._device.locks, 1)
+
+        # not sweeping, so sampling reads a fresh block and averages it
+        ev = dict()
+        self.assertTrue(s.sampleInto(ev))
+        self.assertEqual(ev[Channel.VALUE], 206)
+        self.assertEqual(self._device.conversions, [2] * 8)
+
+    def testConvertedOncePerTick(self):
+        '''Test each channel is converted once per tick, however many samplers share it.'''
+        Channel("a", self._bus, 1, RingBuffer(10))
+        Channel("b", self._bus, 1, RingBuffer(10))
+        Channel("c", self._bus, 4, RingBuffer(10), oversample=3)
+        self._bus._sweeper = True     # read from the sweeps, as when running
+        self.sweepFor(5)
+        self.assertEqual(self._device.conversions.count(1), 5)
+        self.assertEqual(self._device.conversions.count(4), 5 * 3)
+        self.assertEqual(self._device.locks, 5)
+
+    def testSampledWhenDue(self):
+        '''Test each sampler is only sampled when its delay has passed.'''
+        fast = Channel("fast", self._bus, 1, RingBuffer(20), period=1)
+        slow = Channel("slow", self._bus, 1, RingBuffer(20), period=3)
+        self._bus._sweeper = True
+        self.sweepFor(7)
+        self.assertEqual(len(fast.events()), 7)
+        self.assertEqual(len(slow.events()), 3)
+
+    def testOpenBreakerSkipped(self):
+        '''Test a channel isn't read while its only sampler's breaker is open.'''
+        a = Channel("a", self._bus, 1, RingBuffer(20))
+        Channel("b", self._bus, 2, RingBuffer(20))
+        b = CircuitBreaker("a", failures=1, backoff=3)
+        a.setCircuitBreaker(b)
+        b.failure(self._now)
+        self._bus._sweeper = True
+        self.sweepFor(5)
+        self.assertEqual(self._device.conversions.count(2), 5)
+
+        # skipped until the probe is due, which then closes the breaker
+        self.assertEqual(self._device.conversions.count(1), 2)
+        self.assertEqual(b.state(), CircuitBreaker.CLOSED)
+        self.assertEqual(len(a.events()), 2)
+
+    def testSharedChannelRead(self):
+        '''Test a channel is still read for a sampler whose breaker is closed.'''
+        a = Channel("a", self._bus, 1, RingBuffer(20))
+        c = Channel("c", self._bus, 1, RingBuffer(20))
+        b = CircuitBreaker("a", failures=1, backoff=1000)
+        a.setCircuitBreaker(b)
+        b.failure(self._now)
+        self._bus._sweeper = True
+        self.sweepFor(3)
+        self.assertEqual(self._device.conversions.count(1), 3)
+        self.assertEqual(len(a.events()), 0)
+        self.assertEqual(len(c.events()), 3)
+
+    def testSharedRun(self):
+        '''Test samplers share a single sweep, which survives one of them being cancelled.'''
+        self._clock.stop()
+        self._bus._tick = 0.01
+        a = Channel("a", self._bus, 1, RingBuffer(10), period=0)
+        b = Channel("b", self._bus, 2, RingBuffer(10), period=0)
+
+        async def main():
+            ta = asyncio.create_task(a.run())
+            tb = asyncio.create_task(b.run())
+            await asyncio.sleep(0.05)
+            sweeper = self._bus._sweeper
+            ta.cancel()
+            await asyncio.sleep(0.05)
+            alive = not sweeper.done()
+            tb.cancel()
+            sweeper.cancel()
+            await asyncio.gather(ta, tb, sweeper, return_exceptions=True)
+            return alive
+
+        self.assertTrue(asyncio.run(main()))
+        self._clock.start()
+        self.assertGreater(len(a.events()), 1)
+        self.assertGreater(len(b.events()), 1)
+        n = len(self._device.conversions)
+        self.assertLessEqual(abs(self._device.conversions.count(1) - self._device.conversions.count(2)), 1)
+        self.assertGreater(n, 4)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,138 @@
+# Tests of metrics
+#
+# Copyright (C) 2023 Simon Dobson
+#
+# This file is part of whether, a modular IoT weather station
+#
+# whether is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# whether is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with whether. If not, see <http://www.gnu.org/licenses/gpl.html>.
+
+import unittest
+import asyncio
+from whether import RingBuffer, Sampler, Metrics, metrics, DiagnosticsServer
+
+
+class Flaky(Sampler):
+
+    VALUE = "v"
+
+    def __init__(self, id, ring, period = 1):
+        super().__init__(id, ring, period)
+        self.fail = False
+
+    def sample(self):
+        if self.fail:
+            raise ValueError("failed")
+        return {self.VALUE: 1}
+
+
+class MetricsTest(unittest.TestCase):
+
+    def testCounter(self):
+        '''Test counters are shared by name and labels.'''
+        m = Metrics()
+        c = m.counter("c_total", "A counter", dict(a="x"))
+        c.inc()
+        c.inc(2)
+        self.assertIs(m.counter("c_total", "A counter", dict(a="x")), c)
+        self.assertIsNot(m.counter("c_total", "A counter", dict(a="y")), c)
+        self.assertIn('c_total{a="x"} 3', m.render())
+
+    def testWrongType(self):
+        '''Test a name can't be re-used for a different type.'''
+        m = Metrics()
+        m.counter("c", "A counter")
+        with self.assertRaises(ValueError):
+            m.gauge("c", "A gauge")
+
+    def testGaugeFunction(self):
+        '''Test gauges read from functions.'''
+        m = Metrics()
+        vs = [5]
+        m.gauge("g", "A gauge", f=lambda: vs[0])
+        vs[0] = 7
+        text = m.render()
+        self.assertIn("# TYPE g gauge", text)
+        self.assertIn("g 7", text)
+
+    def testHistogram(self):
+        '''Test histogram buckets are cumulative.'''
+        m = Metrics()
+        h = m.histogram("h", "A histogram", buckets=[1, 10])
+        for v in [0.5, 1, 5, 20]:
+            h.observe(v)
+        text = m.render()
+        self.assertIn('h_bucket{le="1"} 2', text)
+        self.assertIn('h_bucket{le="10"} 3', text)
+        self.assertIn('h_bucket{le="+Inf"} 4', text)
+        self.assertIn('h_sum 26.5', text)
+        self.assertIn('h_count 4', text)
+
+    def testSensorMetrics(self):
+        '''Test sensors count samples, errors, and drops.'''
+        s = Flaky("flaky-metrics", RingBuffer(2))
+        for _ in range(3):
+            s.takeSample()
+        s.fail = True
+        s.takeSample()
+        labels = dict(sensor="flaky-metrics")
+        self.assertEqual(metrics.histogram("whether_sample_seconds", "", labels).count, 3)
+        self.assertEqual(metrics.counter("whether_sample_errors_total", "", labels).value, 1)
+        self.assertEqual(metrics.counter("whether_ring_drops_total", "", labels).value, 1)
+        self.assertIn('whether_ring_fill{sensor="flaky-metrics"} 2', metrics.render())
+
+    def testServer(self):
+        '''Test the metrics are served over HTTP.'''
+        m = Metrics()
+        m.counter("served_total", "A counter").inc()
+
+        async def get(port, path):
+            (reader, writer) = await asyncio.open_connection('127.0.0.1', port)
+            writer.write("GET {p} HTTP/1.1\r\nHost: localhost\r\n\r\n".format(p=path).encode())
+            data = await reader.read()
+            writer.close()
+            return data
+
+        async def main():
+            ds = DiagnosticsServer(port=0, registry=m)
+            await ds.start()
+            try:
+                return (await get(ds.port(), "/metrics"),
+                        await get(ds.port(), "/trace"),
+                        await get(ds.port(), "/nowhere"))
+            finally:
+                await ds.stop()
+
+        (ok, trace, missing) = asyncio.run(asyncio.wait_for(main(), 5))
+        self.assertTrue(ok.startswith(b"HTTP/1.1 200 OK"))
+        self.assertIn(b"text/plain; version=0.0.4", ok)
+        self.assertTrue(ok.endswith(b"served_total 1\n"))
+        self.assertIn(b'{"traceEvents": ', trace)
+        self.assertTrue(missing.startswith(b"HTTP/1.1 404"))
+
+    def testPortInUse(self):
+        '''Test the server gives up quietly if its port is taken.'''
+        async def main():
+            ds = DiagnosticsServer(port=0, registry=Metrics())
+            await ds.start()
+            try:
+                other = DiagnosticsServer(port=ds.port(), registry=Metrics())
+                await asyncio.wait_for(other.run(), 1)
+            finally:
+                await ds.stop()
+
+        asyncio.run(main())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,116 @@
+# Tests of the asyncio MQTT transport
+#
+# Copyright (C) 2023 Simon Dobson
+#
+# This file is part of whether, a modular IoT weather station
+#
+# whether is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# whether is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with whether. If not, see <http://www.gnu.org/licenses/gpl.html>.
+
+import unittest
+import asyncio
+from test.fakebroker import FakeBroker
+from whether.mqtt import MQTTConnection
+
+
+class MQTTTest(unittest.TestCase):
+
+    def station(self, f, **kwds):
+        '''Run a test coroutine against a fake broker.
+
+        :param f: a coroutine function taking the broker and a connection'''
+        async def main():
+            broker = FakeBroker()
+            port = await broker.start()
+            conn = MQTTConnection('127.0.0.1', port=port,
+                                  timeout=1, backoff=0.05, maxBackoff=0.1, **kwds)
+            t = asyncio.create_task(conn.run())
+            try:
+                await f(broker, conn)
+            finally:
+                t.cancel()
+                await broker.stop()
+        asyncio.run(asyncio.wait_for(main(), 5))
+
+    async def until(self, p):
+        '''Wait until a predicate holds.'''
+        while not p():
+            await asyncio.sleep(0.01)
+
+    def testPublishAcknowledged(self):
+        '''Test QoS 1 publishes complete when acknowledged.'''
+        async def f(broker, conn):
+            await self.until(conn.connected)
+            mid = await conn.publish("t", b"hello")
+            self.assertIsNotNone(mid)
+            self.assertEqual(broker.messages, [("t", b"hello", 0)])
+        self.station(f)
+
+    def testQueuedWhileDisconnected(self):
+        '''Test QoS 1 messages published before connecting are sent once connected.'''
+        async def f(broker, conn):
+            ack = conn.publish("t", b"early")
+            await ack
+            self.assertEqual(broker.messages, [("t", b"early", 0)])
+        self.station(f)
+
+    def testBoundedQueue(self):
+        '''Test messages are dropped when the window and queue are full.'''
+        async def f(broker, conn):
+            broker.ack = False
+            await self.until(conn.connected)
+            acks = [conn.publish("t", b"x") for _ in range(4)]
+            self.assertIsNone(acks[-1])
+        self.station(f, inflight=1, queued=3)
+
+    def testReconnect(self):
+        '''Test we reconnect, and call the connection callbacks, when the connection drops.'''
+        async def f(broker, conn):
+            ns = []
+            conn.addConnectCallback(lambda: ns.append(1))
+            await self.until(conn.connected)
+            broker.drop()
+            await self.until(lambda: not conn.connected())
+            await self.until(conn.connected)
+            self.assertEqual(broker.connections, 2)
+            self.assertEqual(len(ns), 2)
+        self.station(f)
+
+    def testSubscribeRenewed(self):
+        '''Test subscriptions receive retained and live messages, and are renewed on reconnection.'''
+        async def f(broker, conn):
+            ms = []
+            broker.retained["s"] = b"old"
+            conn.subscribe("s", lambda t, p, r: ms.append((t, p, r)))
+            await self.until(lambda: len(ms) == 1)
+            broker.deliver("s", b"new")
+            await self.until(lambda: len(ms) == 2)
+            broker.drop()
+            await self.until(lambda: len(ms) == 3)
+            self.assertEqual(ms, [("s", b"old", True), ("s", b"new", False), ("s", b"old", True)])
+        self.station(f)
+
+    def testNoServer(self):
+        '''Test we keep retrying when there's no server.'''
+        async def main():
+            conn = MQTTConnection('127.0.0.1', port=1, timeout=0.1, backoff=0.01, maxBackoff=0.02)
+            t = asyncio.create_task(conn.run())
+            await asyncio.sleep(0.1)
+            self.assertFalse(conn.connected())
+            self.assertFalse(t.done())
+            t.cancel()
+        asyncio.run(main())
+
+
+if __name__ == '__main__':
+    unittest.main()
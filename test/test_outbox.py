@@ -0,0 +1,120 @@
+# Tests of the store-and-forward outbox
+#
+# Copyright (C) 2023 Simon Dobson
+#
+# This file is part of whether, a modular IoT weather station
+#
+# whether is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# whether is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with whether. If not, see <http://www.gnu.org/licenses/gpl.html>.
+
+import unittest
+import os
+import asyncio
+from tempfile import TemporaryDirectory
+from test.fakebroker import FakeBroker
+from whether.mqtt import MQTTConnection
+from whether.outbox import Outbox
+
+
+class OutboxTest(unittest.TestCase):
+
+    def setUp(self):
+        self._dir = TemporaryDirectory()
+        self._outboxes = []
+
+    def tearDown(self):
+        for ob in self._outboxes:
+            ob.close()
+        self._dir.cleanup()
+
+    def outbox(self, **kwds):
+        ob = Outbox(self._dir.name, **kwds)
+        self._outboxes.append(ob)
+        return ob
+
+    def segments(self):
+        return [fn for fn in os.listdir(self._dir.name) if fn.endswith(Outbox.SEGMENT_SUFFIX)]
+
+    def testAppendAck(self):
+        '''Test messages are queued until acknowledged.'''
+        ob = self.outbox()
+        seqs = [ob.append("t", "m{i}".format(i=i)) for i in range(3)]
+        self.assertEqual(ob.backlog(), 3)
+        ob.ack(seqs[1])
+        self.assertEqual(ob.backlog(), 2)
+        self.assertEqual([p for (_, _, p) in ob.records()], [b"m0", b"m2"])
+
+    def testRecovery(self):
+        '''Test unacknowledged messages survive a restart, and a torn record is dropped.'''
+        ob = self.outbox(segmentSize=50)
+        seqs = [ob.append("t", "m{i}".format(i=i)) for i in range(10)]
+        for seq in seqs[:5]:
+            ob.ack(seq)
+        ob.close()
+        self._outboxes.remove(ob)
+
+        # simulate a crash part-way through writing a record
+        last = sorted(self.segments())[-1]
+        with open(os.path.join(self._dir.name, last), 'ab') as fh:
+            fh.write(b'\x01\x02\x03')
+
+        ob1 = self.outbox(segmentSize=50)
+        self.assertEqual([p for (_, _, p) in ob1.records()], [b"m5", b"m6", b"m7", b"m8", b"m9"])
+        self.assertEqual(ob1.append("t", "m10"), seqs[-1] + 1)
+
+    def testCompaction(self):
+        '''Test acknowledged segments are deleted.'''
+        ob = self.outbox(segmentSize=50)
+        seqs = [ob.append("t", "m{i}".format(i=i)) for i in range(10)]
+        n = len(self.segments())
+        self.assertGreater(n, 2)
+        for seq in seqs:
+            ob.ack(seq)
+        self.assertEqual(len(self.segments()), 1)
+        self.assertEqual(ob.backlog(), 0)
+
+    def testRetention(self):
+        '''Test the oldest messages are dropped when the outbox is full.'''
+        ob = self.outbox(segmentSize=50, maxBytes=200)
+        for i in range(30):
+            ob.append("t", "m{i}".format(i=i))
+        total = sum([os.path.getsize(os.path.join(self._dir.name, fn)) for fn in self.segments()])
+        self.assertLess(total, 200 + 50 + 30)
+        ps = [p for (_, _, p) in ob.records()]
+        self.assertEqual(ps[-1], b"m29")
+        self.assertNotIn(b"m0", ps)
+        self.assertEqual(ob.backlog(), len(ps))
+
+    def testReplay(self):
+        '''Test the backlog is replayed oldest first once connected.'''
+        async def main():
+            broker = FakeBroker()
+            port = await broker.start()
+            conn = MQTTConnection('127.0.0.1', port=port, timeout=1, backoff=0.05)
+            ob = self.outbox(rate=1000, batch=2)
+            for i in range(5):
+                ob.submit(conn, "t", "m{i}".format(i=i))
+            conn.addConnectCallback(lambda: ob.startReplay(conn))
+            t = asyncio.create_task(conn.run())
+            while ob.backlog() > 0:
+                await asyncio.sleep(0.01)
+            t.cancel()
+            await broker.stop()
+            return broker.messages
+
+        ms = asyncio.run(asyncio.wait_for(main(), 5))
+        self.assertEqual([p for (_, p, _) in ms], [b"m0", b"m1", b"m2", b"m3", b"m4"])
+
+
+if __name__ == '__main__':
+    unittest.main()
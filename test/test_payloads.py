@@ -0,0 +1,111 @@
+# Tests of payload encodings
+#
+# Copyright (C) 2023 Simon Dobson
+#
+# This file is part of whether, a modular IoT weather station
+#
+# whether is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# whether is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with whether. If not, see <http://www.gnu.org/licenses/gpl.html>.
+
+import unittest
+from whether.payloads import JSONCodec, CBORCodec, MessagePackCodec, StructSchema, StructCodec, decodePayload
+
+
+PAYLOAD = {'temperature': 12.5,
+           'humidity': 81.25,
+           'wind_speed': 3.1,
+           'wind_dir': 'SSW',
+           'wind_dir_deg': 202.5,
+           'cpu_wifi': -61,
+           'count': 70000,
+           'ok': True,
+           'missing': None,
+           'history': [1, 2.5, 'x'],
+           'raw': b'\x00\x01'}
+
+
+class CodecTest(unittest.TestCase):
+
+    def testRoundTrips(self):
+        '''Test the general codecs round-trip.'''
+        for c in [CBORCodec(), MessagePackCodec()]:
+            self.assertEqual(c.decode(c.encode(PAYLOAD)), PAYLOAD)
+        p = dict(PAYLOAD)
+        del p['raw']
+        self.assertEqual(JSONCodec().decode(JSONCodec().encode(p)), p)
+
+    def testSmaller(self):
+        '''Test the binary codecs are smaller than JSON.'''
+        p = dict(PAYLOAD)
+        del p['raw']
+        n = len(JSONCodec().encode(p))
+        for c in [CBORCodec(), MessagePackCodec()]:
+            self.assertLess(len(c.encode(p)), n)
+
+    def testCBORVectors(self):
+        '''Test CBOR encodings against examples from RFC 8949.'''
+        c = CBORCodec()
+        for (v, bs) in [(0, '00'), (23, '17'), (24, '1818'), (1000, '1903e8'),
+                        (1000000, '1a000f4240'), (-1, '20'), (-1000, '3903e7'),
+                        (1.5, 'fa3fc00000'), (1.1, 'fb3ff199999999999a'),
+                        (False, 'f4'), (None, 'f6'), ("IETF", '6449455446'),
+                        ([1, [2, 3]], '8201820203'), ({"a": 1}, 'a1616101')]:
+            self.assertEqual(c.encode(v).hex(), bs)
+            self.assertEqual(c.decode(bytes.fromhex(bs)), v)
+
+    def testMessagePackVectors(self):
+        '''Test MessagePack encodings against the specification.'''
+        c = MessagePackCodec()
+        for (v, bs) in [(0, '00'), (127, '7f'), (128, 'cc80'), (-1, 'ff'), (-33, 'd0df'),
+                        (65536, 'ce00010000'), (1.5, 'ca3fc00000'), (None, 'c0'),
+                        (True, 'c3'), ("abc", 'a3616263'), ([1, 2], '920102'),
+                        ({"a": 1}, '81a16101'), (b'\x01', 'c40101')]:
+            self.assertEqual(c.encode(v).hex(), bs)
+            self.assertEqual(c.decode(bytes.fromhex(bs)), v)
+
+    def testLongCollections(self):
+        '''Test the longer length encodings.'''
+        d = {str(i): i for i in range(300)}
+        s = 'x' * 70000
+        for c in [CBORCodec(), MessagePackCodec()]:
+            self.assertEqual(c.decode(c.encode(d)), d)
+            self.assertEqual(c.decode(c.encode(s)), s)
+
+    def testStruct(self):
+        '''Test the struct codec round-trips, with missing values.'''
+        s = StructSchema(3, [('temperature', 'f'), ('wind_dir', '3s'), ('cpu_wifi', 'h'), ('humidity', 'f')])
+        c = StructCodec(s)
+        bs = c.encode(dict(temperature=12.5, wind_dir='SSW', cpu_wifi=-61))
+        self.assertEqual(len(bs), s.size())
+        self.assertEqual(bs[0], 3)
+        self.assertEqual(c.decode(bs), dict(temperature=12.5, wind_dir='SSW', cpu_wifi=-61, humidity=None))
+
+    def testStructSchemas(self):
+        '''Test the decoder helper selects schemas by id.'''
+        s1 = StructSchema(1, [('a', 'f')])
+        s2 = StructSchema(2, [('b', 'B')])
+        bs = StructCodec(s2).encode(dict(b=7))
+        self.assertEqual(decodePayload(bs, "struct", [s1, s2]), dict(b=7))
+        with self.assertRaises(ValueError):
+            decodePayload(bs, "struct", [s1])
+
+    def testDecodeHelper(self):
+        '''Test the decoder helper for the general codecs.'''
+        for c in [JSONCodec(), CBORCodec(), MessagePackCodec()]:
+            self.assertEqual(decodePayload(c.encode(dict(a=1)), c.NAME), dict(a=1))
+        with self.assertRaises(ValueError):
+            decodePayload(b'', "xml")
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,93 @@
+# Tests of power policies
+#
+# Copyright (C) 2023 Simon Dobson
+#
+# This file is part of whether, a modular IoT weather station
+#
+# whether is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# whether is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with whether. If not, see <http://www.gnu.org/licenses/gpl.html>.
+
+import unittest
+from whether import RingBuffer, Sampler, PowerPolicy
+
+
+class Battery(Sampler):
+    '''A battery whose charge we can set.'''
+
+    BATTERY_CHARGE_PERCENTAGE = "charge"
+
+    def __init__(self):
+        super().__init__('battery', RingBuffer(10), 10)
+
+    def charge(self, c):
+        self.pushEvent({self.BATTERY_CHARGE_PERCENTAGE: c})
+
+
+class PowerPolicyTest(unittest.TestCase):
+
+    def setUp(self):
+        self._battery = Battery()
+        self._sensor = Sampler('sensor', RingBuffer(10), 2)
+        self._optional = Sampler('optional', RingBuffer(10), 10)
+        self._policy = PowerPolicy('power', self._battery, RingBuffer(10),
+                                   sensors=[self._sensor, self._optional],
+                                   optional=[self._optional])
+
+    def testNoBattery(self):
+        '''Test we stay in the top tier with no battery readings.'''
+        ev = self._policy.sample()
+        self.assertEqual(ev[PowerPolicy.TIER], 'normal')
+        self.assertIsNone(ev[PowerPolicy.CHARGE])
+        self.assertEqual(self._sensor.period(), 2)
+
+    def testTiers(self):
+        '''Test we move down the tiers as the battery drains.'''
+        for (c, t, p, s) in [(80, 'normal', 2, False),
+                             (40, 'saving', 4, False),
+                             (10, 'critical', 10, True)]:
+            self._battery.charge(c)
+            ev = self._policy.sample()
+            self.assertEqual(ev[PowerPolicy.TIER], t)
+            self.assertEqual(self._sensor.period(), p)
+            self.assertEqual(self._optional.suspended(), s)
+
+    def testHysteresis(self):
+        '''Test we need a margin to move back up a tier.'''
+        self._battery.charge(40)
+        self._policy.sample()
+        self._battery.charge(52)
+        self.assertEqual(self._policy.sample()[PowerPolicy.TIER], 'saving')
+        self._battery.charge(56)
+        self.assertEqual(self._policy.sample()[PowerPolicy.TIER], 'normal')
+        self.assertEqual(self._sensor.period(), 2)
+
+    def testResume(self):
+        '''Test suspended sensors resume when the battery recovers.'''
+        self._battery.charge(5)
+        self._policy.sample()
+        self.assertTrue(self._optional.suspended())
+        self._battery.charge(90)
+        self._policy.sample()
+        self.assertFalse(self._optional.suspended())
+
+    def testSwappedRing(self):
+        '''Test the charge survives the battery's ring being swapped by a reporter.'''
+        self._battery.charge(10)
+        self._battery.swapRing(RingBuffer(10))
+        self.assertEqual(self._policy.sample()[PowerPolicy.TIER], 'critical')
+
+    def testBadTiers(self):
+        '''Test we reject tiers out of order.'''
+        with self.assertRaises(ValueError):
+            PowerPolicy('power', self._battery, RingBuffer(10),
+                        tiers=[("low", 0, 2, False), ("high", 50, 1, False)])
@@ -0,0 +1,117 @@
+# Tests of raw event streams
+#
+# Copyright (C) 2023 Simon Dobson
+#
+# This file is part of whether, a modular IoT weather station
+#
+# whether is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# whether is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with whether. If not, see <http://www.gnu.org/licenses/gpl.html>.
+
+import unittest
+import asyncio
+from whether import RingBuffer, Sampler, eventClass
+from whether.payloads import CBORCodec
+from whether.rawstream import RawStream, decodeBatch
+from whether.compression import GorillaCodec
+
+
+class Vane(Sampler):
+
+    DIRECTION = "winddir"
+    EVENT = eventClass("VaneEvent", [Sampler.TIMESTAMP, Sampler.ID, DIRECTION])
+
+    def __init__(self, id, ring):
+        super().__init__(id, ring, 0.01)
+        self._n = 0
+
+    def sampleInto(self, ev):
+        self._n += 1
+        ev[self.DIRECTION] = "N" if self._n % 2 else "S"
+        return True
+
+
+class Connection:
+
+    def __init__(self):
+        self.messages = []
+
+    def publish(self, topic, payload):
+        self.messages.append((topic, payload))
+
+
+class RawStreamTest(unittest.TestCase):
+
+    def setUp(self):
+        self._conn = Connection()
+        self._vane = Vane("wd", RingBuffer(4))
+
+    def testBatchBySize(self):
+        '''Test a batch is published when it's full.'''
+        rs = RawStream(self._conn, "raw", [self._vane], maxEvents=10)
+        for _ in range(25):
+            self._vane.takeSample()
+        self.assertEqual(len(self._conn.messages), 2)
+        b = decodeBatch(self._conn.messages[1][1])
+        self.assertEqual(b[RawStream.SEQUENCE], 1)
+        cols = b[RawStream.SENSORS]["wd"]
+        self.assertEqual(cols[Vane.DIRECTION], ["N", "S"] * 5)
+        self.assertEqual(len(cols[Vane.TIMESTAMP]), 10)
+        self.assertNotIn(Vane.ID, cols)
+        self.assertEqual(rs.sequence(), 2)
+
+    def testBatchByTime(self):
+        '''Test a partial batch is published every period.'''
+        rs = RawStream(self._conn, "raw", [self._vane], period=0.05, codec=CBORCodec())
+
+        async def main():
+            ts = [asyncio.create_task(self._vane.run()),
+                  asyncio.create_task(rs.run())]
+            await asyncio.sleep(0.12)
+            for t in ts:
+                t.cancel()
+
+        asyncio.run(main())
+        self.assertGreaterEqual(len(self._conn.messages), 2)
+        seqs = [decodeBatch(p, "cbor")[RawStream.SEQUENCE] for (_, p) in self._conn.messages]
+        self.assertEqual(seqs, list(range(len(seqs))))
+
+    def testCompressedColumns(self):
+        '''Test batches with compressed columns decode to the same columns.'''
+        rs = RawStream(self._conn, "raw", [self._vane], columns=GorillaCodec())
+        for _ in range(10):
+            self._vane.takeSample()
+        rs.flush()
+        b = decodeBatch(self._conn.messages[0][1])
+        cols = b[RawStream.SENSORS]["wd"]
+        self.assertEqual(cols[Vane.DIRECTION], ["N", "S"] * 5)
+        self.assertEqual(len(cols[Vane.TIMESTAMP]), 10)
+
+    def testMissingTags(self):
+        '''Test columns stay aligned when events have different tags.'''
+        rs = RawStream(self._conn, "raw", [])
+        rs.record(self._vane, {"id": "wd", "a": 1})
+        rs.record(self._vane, {"id": "wd", "b": 2})
+        rs.record(self._vane, {"id": "wd", "a": 3})
+        cols = rs.batch()[RawStream.SENSORS]["wd"]
+        self.assertEqual(cols, {"a": [1, None, 3], "b": [None, 2, None]})
+
+    def testEmpty(self):
+        '''Test empty batches aren't published.'''
+        rs = RawStream(self._conn, "raw", [self._vane])
+        rs.flush()
+        self.assertEqual(self._conn.messages, [])
+        self.assertEqual(rs.sequence(), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,156 @@
+# Tests of the reporter base class
+#
+# Copyright (C) 2023 Simon Dobson
+#
+# This file is part of whether, a modular IoT weather station
+#
+# whether is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# whether is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with whether. If not, see <http://www.gnu.org/licenses/gpl.html>.
+
+import unittest
+import asyncio
+from whether import RingBuffer, Sampler, Reporter
+
+
+class Thermometer(Sampler):
+
+    TEMPERATURE = "temp"
+    HUMIDITY = "hum"
+
+    def __init__(self, id, ring, period = 1):
+        super().__init__(id, ring, period)
+        self._t = 0
+
+    def sample(self):
+        self._t += 1
+        return {self.TEMPERATURE: self._t, self.HUMIDITY: 50}
+
+
+class Vane(Sampler):
+
+    DIRECTION = "winddir"
+
+    def sample(self):
+        return {self.DIRECTION: "SSW"}
+
+
+class Board(Sampler):
+
+    CPU_TEMPERATURE = "temperature"
+    WIFI_SIGNAL_STRENGTH = "rssi"
+
+    def __init__(self, id, ring, rssi):
+        super().__init__(id, ring, 1)
+        self._rssi = rssi
+
+    def sample(self):
+        return {self.CPU_TEMPERATURE: 45.0, self.WIFI_SIGNAL_STRENGTH: self._rssi}
+
+
+class Failing(Reporter):
+
+    def __init__(self, sensors, period):
+        super().__init__(sensors, period)
+        self.submitted = 0
+
+    def submit(self, payload):
+        self.submitted += 1
+        raise ValueError("failed")
+
+
+class ReporterTest(unittest.TestCase):
+
+    def setUp(self):
+        self._th = Thermometer("th", RingBuffer(10))
+        self._r = Reporter({Reporter.TEMPERATURE: self._th,
+                            Reporter.HUMIDITY: self._th})
+
+    def testSwapRing(self):
+        '''Test swapping a sensor's ring.'''
+        self._th.takeSample()
+        ring = self._th.events()
+        spare = RingBuffer(10)
+        spare.push(dict())
+        old = self._th.swapRing(spare)
+        self.assertIs(old, ring)
+        self.assertEqual(len(old), 1)
+        self.assertIs(self._th.events(), spare)
+        self.assertTrue(spare.empty())
+        self.assertIsNotNone(spare.claim())
+
+    def testNoLostEvents(self):
+        '''Test events pushed while summarising aren't lost.'''
+        for _ in range(3):
+            self._th.takeSample()
+        rings = self._r.swapRings()
+
+        # a sample arriving while we summarise
+        self._th.takeSample()
+        payload = self._r.payload(rings)
+        self._r.recycle(rings)
+        self.assertEqual(payload['temperature'], 2)
+        self.assertEqual(payload['humidity'], 50)
+
+        rings = self._r.swapRings()
+        payload = self._r.payload(rings)
+        self.assertEqual(payload['temperature'], 4)
+
+    def testSparesReused(self):
+        '''Test the detached rings become the spares.'''
+        first = self._th.events()
+        rings = self._r.swapRings()
+        self.assertEqual(len(rings), 1)
+        self._r.recycle(rings)
+        self._th.takeSample()
+        self._r.swapRings()
+        self.assertIs(self._th.events(), first)
+        self.assertTrue(first.empty())
+
+    def testNoWindDirection(self):
+        '''Test a period without wind direction events gives no direction.'''
+        wd = Vane("wd", RingBuffer(10), 1)
+        r = Reporter({Reporter.WINDDIRECTION: wd})
+        payload = r.payload()
+        self.assertIsNone(payload['wind_dir'])
+        self.assertIsNone(payload['wind_dir_deg'])
+        wd.takeSample()
+        self.assertEqual(r.payload()['wind_dir_deg'], 202.5)
+
+    def testNoWifi(self):
+        '''Test a board with no wifi interface gives no signal strength.'''
+        c = Board("c", RingBuffer(10), None)
+        r = Reporter({Reporter.CPU: c})
+        c.takeSample()
+        payload = r.payload()
+        self.assertEqual(payload['cpu_temp'], 45.0)
+        self.assertIsNone(payload['cpu_wifi'])
+        c._rssi = -61
+        c.takeSample()
+        self.assertEqual(r.payload()['cpu_wifi'], -61)
+
+    def testFailureDoesntStopReporting(self):
+        '''Test a failing period doesn't stop the reporter.'''
+        r = Failing({Reporter.TEMPERATURE: self._th}, 0.02)
+
+        async def main():
+            t = asyncio.create_task(r.run())
+            await asyncio.sleep(0.09)
+            self.assertFalse(t.done())
+            t.cancel()
+
+        asyncio.run(main())
+        self.assertGreater(r.submitted, 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -146,3 +146,13 @@ class RingBufferTest(unittest.TestCase):
         for s in seq:
             ring.push(s)
         self.assertCountEqual([x for x in ring], seq)
+
+    def testLast(self):
+        '''Test we can see the most recent element.'''
+        ring = RingBuffer(3)
+        self.assertIsNone(ring.last())
+        for s in [1, 2, 3, 4]:
+            ring.push(s)
+            self.assertEqual(ring.last(), s)
+        ring.pop()
+        self.assertEqual(ring.last(), 4)
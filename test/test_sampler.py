@@ -0,0 +1,74 @@
+# Tests of samplers
+#
+# Copyright (C) 2023 Simon Dobson
+#
+# This file is part of whether, a modular IoT weather station
+#
+# whether is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# whether is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with whether. If not, see <http://www.gnu.org/licenses/gpl.html>.
+
+import unittest
+from whether import RingBuffer, Sampler
+
+
+class SamplerTest(unittest.TestCase):
+
+    def setUp(self):
+        self._sampler = Sampler('test', RingBuffer(10), 1)
+
+    def testNotAdaptive(self):
+        '''Test that the period doesn't change by default.'''
+        self.assertFalse(self._sampler.isAdaptive())
+        self._sampler.adapt({'v': 1})
+        self._sampler.adapt({'v': 100})
+        self.assertEqual(self._sampler.period(), 1)
+
+    def testStretch(self):
+        '''Test the period stretches while readings are stable.'''
+        self._sampler.setAdaptive({'v': 0.5}, 1, 8)
+        self.assertTrue(self._sampler.isAdaptive())
+        self._sampler.adapt({'v': 10})
+        self.assertEqual(self._sampler.period(), 2)
+        self._sampler.adapt({'v': 10.2})
+        self.assertEqual(self._sampler.period(), 4)
+        self._sampler.adapt({'v': 10.4})
+        self._sampler.adapt({'v': 10.4})
+        self.assertEqual(self._sampler.period(), 8)
+
+    def testShrink(self):
+        '''Test the period shrinks in proportion to the change.'''
+        self._sampler.setAdaptive({'v': 1}, 1, 16)
+        for _ in range(4):
+            self._sampler.adapt({'v': 10})
+        self.assertEqual(self._sampler.period(), 16)
+        self._sampler.adapt({'v': 14})
+        self.assertEqual(self._sampler.period(), 4)
+        self._sampler.adapt({'v': 114})
+        self.assertEqual(self._sampler.period(), 1)
+
+    def testCategorical(self):
+        '''Test that non-numeric values reset to the minimum period.'''
+        self._sampler.setAdaptive({'d': 0}, 2, 20)
+        self._sampler.adapt({'d': 'N'})
+        self._sampler.adapt({'d': 'N'})
+        self.assertEqual(self._sampler.period(), 8)
+        self._sampler.adapt({'d': 'NNE'})
+        self.assertEqual(self._sampler.period(), 2)
+
+    def testBadBounds(self):
+        '''Test we reject silly period bounds.'''
+        with self.assertRaises(ValueError):
+            self._sampler.setAdaptive({'v': 1}, 10, 5)
+        with self.assertRaises(ValueError):
+            self._sampler.setAdaptive({'v': 1}, 1, 5, factor=1)
+
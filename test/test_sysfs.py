@@ -0,0 +1,78 @@
+# Tests of procfs and sysfs samplers
+#
+# Copyright (C) 2023 Simon Dobson
+#
+# This file is part of whether, a modular IoT weather station
+#
+# whether is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# whether is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with whether. If not, see <http://www.gnu.org/licenses/gpl.html>.
+
+import os
+import re
+import unittest
+from tempfile import TemporaryDirectory
+from whether import RingBuffer, SysfsSampler, Host
+
+
+class SysfsSamplerTest(unittest.TestCase):
+
+    NUMBER = re.compile(rb'^value (\d+)$', re.M)
+
+    def setUp(self):
+        self._dir = TemporaryDirectory()
+        self._fn = os.path.join(self._dir.name, 'metric')
+        self._sampler = SysfsSampler('test', RingBuffer(10), 1)
+
+    def tearDown(self):
+        self._sampler.close()
+        self._dir.cleanup()
+
+    def write(self, contents):
+        with open(self._fn, 'w') as fh:
+            fh.write(contents)
+
+    def testMissing(self):
+        '''Test missing files read as None.'''
+        self.assertFalse(self._sampler.openFile(self._fn))
+        self.assertIsNone(self._sampler.readFile(self._fn))
+        self.assertIsNone(self._sampler.matchFile(self._fn, self.NUMBER))
+
+    def testRereads(self):
+        '''Test we see the current contents of the file on each read.'''
+        self.write('value 1\n')
+        self.assertTrue(self._sampler.openFile(self._fn))
+        self.assertEqual(int(self._sampler.matchFile(self._fn, self.NUMBER).group(1)), 1)
+
+        # rewrite in place, so the open descriptor sees the change
+        with open(self._fn, 'r+') as fh:
+            fh.write('value 2\n')
+        self.assertEqual(int(self._sampler.matchFile(self._fn, self.NUMBER).group(1)), 2)
+
+    def testGrowBuffer(self):
+        '''Test we read files larger than the buffer.'''
+        n = SysfsSampler.BUFFER_SIZE * 3
+        self.write(('x' * n) + '\nvalue 42\n')
+        self.assertEqual(len(self._sampler.readFile(self._fn)), n + 10)
+        self.assertEqual(int(self._sampler.matchFile(self._fn, self.NUMBER).group(1)), 42)
+
+    @unittest.skipUnless(os.path.isfile(Host.LOAD_FILE), "No /proc/loadavg")
+    def testHost(self):
+        '''Test we can sample the host we're running on.'''
+        h = Host('host', RingBuffer(10))
+        try:
+            ev = h.sample()
+            self.assertGreaterEqual(ev[Host.LOAD], 0)
+            self.assertGreater(ev[Host.MEMORY_AVAILABLE], 0)
+            self.assertGreater(ev[Host.DISK_FREE_PERCENTAGE], 0)
+        finally:
+            h.close()
@@ -0,0 +1,107 @@
+# Tests of tracing and loop monitoring
+#
+# Copyright (C) 2023 Simon Dobson
+#
+# This file is part of whether, a modular IoT weather station
+#
+# whether is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# whether is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with whether. If not, see <http://www.gnu.org/licenses/gpl.html>.
+
+import unittest
+import asyncio
+import time
+import json
+from whether import RingBuffer, Sampler, Tracer, tracer, LoopMonitor
+
+
+class Thermometer(Sampler):
+
+    TEMPERATURE = "temp"
+
+    def sample(self):
+        return {self.TEMPERATURE: 20}
+
+
+class TracingTest(unittest.TestCase):
+
+    def tearDown(self):
+        tracer.disable()
+        tracer.clear()
+
+    def testDisabled(self):
+        '''Test nothing is recorded while disabled.'''
+        tr = Tracer()
+        self.assertIsNone(tr.begin())
+        tr.end(tr.begin(), "a", "b")
+        with tr.span("a", "b"):
+            pass
+        self.assertEqual(len(tr), 0)
+
+    def testSpans(self):
+        '''Test spans are recorded and exported.'''
+        tr = Tracer()
+        tr.enable()
+        t = tr.begin()
+        tr.end(t, "first", "x")
+        with tr.span("second", "y", dict(n=1)):
+            pass
+        evs = json.loads(json.dumps(tr.toChrome()))['traceEvents']
+
+        # one metadata event naming each category's row, and one per span
+        self.assertEqual([ev['ph'] for ev in evs], ["M", "X", "M", "X"])
+        self.assertEqual(evs[0]['args']['name'], "x")
+        self.assertEqual(evs[1]['name'], "first")
+        self.assertEqual(evs[3]['args'], dict(n=1))
+        self.assertNotEqual(evs[1]['tid'], evs[3]['tid'])
+
+    def testBounded(self):
+        '''Test the oldest spans are discarded.'''
+        tr = Tracer(size=3)
+        tr.enable()
+        for i in range(5):
+            tr.end(tr.begin(), str(i), "x")
+        names = [ev['name'] for ev in tr.toChrome()['traceEvents'] if ev['ph'] == "X"]
+        self.assertEqual(names, ["2", "3", "4"])
+
+    def testSensorSpans(self):
+        '''Test sensors trace their samples and pushes.'''
+        tracer.enable()
+        th = Thermometer("th-traced", RingBuffer(10))
+        th.takeSample()
+        spans = [(ev['name'], ev['cat']) for ev in tracer.toChrome()['traceEvents'] if ev['ph'] == "X"]
+        self.assertEqual(spans, [("sample", "th-traced"), ("push", "th-traced")])
+
+    def testLoopStall(self):
+        '''Test the loop monitor sees a blocked loop.'''
+        tracer.enable()
+
+        async def main():
+            lm = LoopMonitor(interval=0.01, threshold=0.05)
+            t = asyncio.create_task(lm.run())
+            await asyncio.sleep(0.05)
+
+            # block the loop
+            time.sleep(0.15)
+            await asyncio.sleep(0.05)
+            t.cancel()
+            return lm
+
+        lm = asyncio.run(main())
+        self.assertGreater(lm.maxLag(), 0.1)
+        stalls = [ev for ev in tracer.toChrome()['traceEvents'] if ev['name'] == "stall"]
+        self.assertEqual(len(stalls), 1)
+        self.assertGreater(stalls[0]['args']['lag'], 0.1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,281 @@
+# Tests of the time-series store
+#
+# Copyright (C) 2023 Simon Dobson
+#
+# This file is part of whether, a modular IoT weather station
+#
+# whether is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# whether is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with whether. If not, see <http://www.gnu.org/licenses/gpl.html>.
+
+import unittest
+import os
+import errno
+import asyncio
+from tempfile import TemporaryDirectory
+from whether import RingBuffer, Sampler, eventClass
+from whether.tsstore import TimeSeriesStore
+from whether.compression import GorillaCodec
+
+
+class Vane(Sampler):
+
+    DIRECTION = "winddir"
+    SPEED = "windspeed"
+    EVENT = eventClass("VaneEvent", [Sampler.TIMESTAMP, Sampler.ID, DIRECTION, SPEED],
+                       {Sampler.TIMESTAMP: 'd',
+                        DIRECTION: '3s',
+                        SPEED: 'f'})
+
+    def __init__(self, id, ring):
+        super().__init__(id, ring, 0.01)
+        self._n = 0
+
+    def sampleInto(self, ev):
+        ev[self.DIRECTION] = "N"
+        ev[self.SPEED] = 1.0
+        return True
+
+    def pushAt(self, n):
+        for _ in range(n):
+            self._n += 1
+            ev = self.EVENT()
+            ev[self.TIMESTAMP] = 1000.0 + self._n
+            ev[self.DIRECTION] = "N" if self._n % 2 else "SSW"
+            if self._n % 5 != 0:
+                ev[self.SPEED] = self._n / 2
+            self.pushEvent(ev)
+
+
+class Thermometer(Sampler):
+
+    TEMPERATURE = "temperature"
+
+    def __init__(self, id, ring):
+        super().__init__(id, ring, 0.01)
+        self._n = 0
+
+    def sampleInto(self, ev):
+        self._n += 1
+        ev[self.TEMPERATURE] = 20.0 + self._n / 4
+        return True
+
+
+class TimeSeriesStoreTest(unittest.TestCase):
+
+    def setUp(self):
+        self._dir = TemporaryDirectory()
+        self._vane = Vane("wd", RingBuffer(4))
+        self._stores = []
+
+    def tearDown(self):
+        for st in self._stores:
+            st.close()
+        self._dir.cleanup()
+
+    def store(self, sensors, **kwds):
+        st = TimeSeriesStore(self._dir.name, sensors, **kwds)
+        self._stores.append(st)
+        return st
+
+    def segments(self, id):
+        return sorted([fn for fn in os.listdir(os.path.join(self._dir.name, id))
+                       if fn.endswith(TimeSeriesStore.SEGMENT_SUFFIX)])
+
+    def testRoundTrip(self):
+        '''Test events are stored and read back, with missing values as None.'''
+        st = self.store([self._vane])
+        self._vane.pushAt(10)
+        self.assertEqual(st.pending(), 10)
+        self.assertEqual(st.read("wd"), dict())
+        st.flush()
+        self.assertEqual(st.pending(), 0)
+        cols = st.read("wd")
+        self.assertEqual(cols[Vane.TIMESTAMP], [1000.0 + i for i in range(1, 11)])
+        self.assertEqual(cols[Vane.DIRECTION], ["N", "SSW"] * 5)
+        self.assertEqual(cols[Vane.SPEED][:4], [0.5, 1.0, 1.5, 2.0])
+        self.assertIsNone(cols[Vane.SPEED][4])
+        self.assertNotIn(Vane.ID, cols)
+        self.assertEqual(st.sensors(), ["wd"])
+
+    def testCompressed(self):
+        '''Test compressed blocks read back the same, survive a restart, and are smaller.'''
+        st = self.store([self._vane], codec=GorillaCodec(), maxAge=1e12)
+        for _ in range(4):
+            self._vane.pushAt(50)
+            st.flush()
+        cols = st.read("wd", 1010, 1020)
+        self.assertEqual(cols[Vane.TIMESTAMP], [1000.0 + i for i in range(10, 20)])
+        self.assertEqual(cols[Vane.DIRECTION], ["SSW", "N"] * 5)
+        self.assertIsNone(cols[Vane.SPEED][5])
+        st.compact()
+        st.close()
+        compressed = sum([os.path.getsize(os.path.join(self._dir.name, "wd", fn))
+                          for fn in self.segments("wd")])
+
+        st = self.store([])
+        self.assertEqual(st.read("wd", 1010, 1020), cols)
+        self.assertLess(compressed, 200 * 15 // 2)
+
+    def testUntypedEvents(self):
+        '''Test a sensor without typed events takes its layout from its first event.'''
+        th = Thermometer("th", RingBuffer(4))
+        st = self.store([th])
+        for _ in range(3):
+            th.takeSample()
+        st.flush()
+        self.assertEqual(st.read("th")[Thermometer.TEMPERATURE], [20.25, 20.5, 20.75])
+
+    def testTimeRange(self):
+        '''Test reading a time range only returns the events in it.'''
+        st = self.store([self._vane])
+        for _ in range(5):
+            self._vane.pushAt(10)
+            st.flush()
+        cols = st.read("wd", 1015, 1032)
+        self.assertEqual(cols[Vane.TIMESTAMP], [1000.0 + i for i in range(15, 32)])
+        self.assertEqual(st.read("wd", 2000), dict())
+
+    def testSegments(self):
+        '''Test new segments are started when they fill, and ranges read across them.'''
+        st = self.store([self._vane], segmentSize=200)
+        for _ in range(10):
+            self._vane.pushAt(5)
+            st.flush()
+        self.assertGreater(len(self.segments("wd")), 1)
+        self.assertEqual(st.read("wd", 1010, 1040)[Vane.TIMESTAMP],
+                         [1000.0 + i for i in range(10, 40)])
+
+    def testRecovery(self):
+        '''Test a restarted store finds its data, dropping a torn block and rebuilding a bad index.'''
+        st = self.store([self._vane])
+        for _ in range(3):
+            self._vane.pushAt(10)
+            st.flush()
+        st.close()
+        fn = os.path.join(self._dir.name, "wd", self.segments("wd")[0])
+        with open(fn, 'ab') as fh:
+            fh.write(b"torn")
+        os.remove(fn[:-len(TimeSeriesStore.SEGMENT_SUFFIX)] + TimeSeriesStore.INDEX_SUFFIX)
+
+        st = self.store([])
+        cols = st.read("wd")
+        self.assertEqual(len(cols[Vane.TIMESTAMP]), 30)
+
+    def testMaxPending(self):
+        '''Test events are discarded when too many are waiting to be written.'''
+        st = self.store([self._vane], maxPending=5)
+        self._vane.pushAt(10)
+        self.assertEqual(st.pending(), 5)
+
+    def testCompaction(self):
+        '''Test closed segments' blocks are merged.'''
+        st = self.store([self._vane], segmentSize=400, blockRows=100,
+                        maxAge=1e12)
+        for _ in range(20):
+            self._vane.pushAt(2)
+            st.flush()
+        segs = self.segments("wd")
+        self.assertGreater(len(segs), 1)
+        before = st.read("wd")
+        st.compact()
+        self.assertEqual(st.read("wd"), before)
+        for s in st._segments["wd"][:-1]:
+            self.assertEqual(s[5], 1)
+
+    def testRetention(self):
+        '''Test the oldest segments are deleted when the store is full.'''
+        st = self.store([self._vane], segmentSize=200, maxBytes=600,
+                        maxAge=1e12)
+        for _ in range(20):
+            self._vane.pushAt(5)
+            st.flush()
+        st.compact()
+        ts = st.read("wd")[Vane.TIMESTAMP]
+        self.assertLess(len(ts), 100)
+        self.assertEqual(ts[-1], 1100.0)
+        self.assertLessEqual(sum([os.path.getsize(os.path.join(self._dir.name, "wd", fn))
+                                  for fn in self.segments("wd")]), 600)
+
+    def testAge(self):
+        '''Test segments holding only old data are deleted, except the one being written.'''
+        st = self.store([self._vane], segmentSize=200)
+        for _ in range(10):
+            self._vane.pushAt(5)
+            st.flush()
+        st.compact()
+        self.assertEqual(len(self.segments("wd")), 1)
+        self.assertEqual(st.read("wd")[Vane.TIMESTAMP][-1], 1050.0)
+
+    def testRun(self):
+        '''Test events are written in the background.'''
+        st = self.store([self._vane], period=0.05)
+
+        async def main():
+            ts = [asyncio.create_task(self._vane.run()),
+                  asyncio.create_task(st.run())]
+            await asyncio.sleep(0.12)
+            for t in ts:
+                t.cancel()
+            await asyncio.gather(*ts, return_exceptions=True)
+
+        asyncio.run(main())
+        self.assertEqual(st.pending(), 0)
+        self.assertGreater(len(st.read("wd")[Vane.TIMESTAMP]), 0)
+
+    def testWriteError(self):
+        '''Test a batch that can't be written is dropped, and writing resumes in a new segment.'''
+        st = self.store([self._vane], maxAge=1e12)
+        self._vane.pushAt(3)
+        st.flush()
+
+        class Full:
+            def write(self, data):
+                raise OSError(errno.ENOSPC, "No space left on device")
+
+            def close(self):
+                pass
+
+        st._closeFiles("wd")
+        st._fds["wd"] = (Full(), Full())
+        self._vane.pushAt(4)
+        st.flush()
+        self.assertEqual(st.pending(), 0)
+        self._vane.pushAt(5)
+        st.flush()
+        self.assertEqual(len(self.segments("wd")), 2)
+        ts = st.read("wd")[Vane.TIMESTAMP]
+        self.assertEqual(ts, [1000.0 + i for i in list(range(1, 4)) + list(range(8, 13))])
+
+    def testRunSurvivesErrors(self):
+        '''Test the store keeps running when the disk fails.'''
+        st = self.store([self._vane], period=0.02, compactPeriod=0)
+
+        def broken():
+            raise OSError(errno.EROFS, "Read-only file system")
+
+        st.compact = broken
+
+        async def main():
+            t = asyncio.create_task(st.run())
+            self._vane.pushAt(2)
+            await asyncio.sleep(0.1)
+            self.assertFalse(t.done())
+            t.cancel()
+            await asyncio.gather(t, return_exceptions=True)
+
+        asyncio.run(main())
+        self.assertEqual(len(st.read("wd")[Vane.TIMESTAMP]), 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
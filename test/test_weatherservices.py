@@ -0,0 +1,159 @@
+# Tests of web service reporters
+#
+# Copyright (C) 2023 Simon Dobson
+#
+# This file is part of whether, a modular IoT weather station
+#
+# whether is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# whether is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with whether. If not, see <http://www.gnu.org/licenses/gpl.html>.
+
+import unittest
+import asyncio
+import json
+from test.fakehttp import FakeHTTPServer
+from whether import RingBuffer, Sampler, FanOut, WeatherUnderground, OpenWeatherMap
+
+
+class Thermometer(Sampler):
+
+    TEMPERATURE = "temp"
+
+    def sample(self):
+        return {self.TEMPERATURE: 20}
+
+
+class WeatherServicesTest(unittest.TestCase):
+
+    def setUp(self):
+        self._server = FakeHTTPServer()
+        self._url = self._server.start()
+
+    def tearDown(self):
+        self._server.stop()
+
+    def upload(self, sink, payloads):
+        '''Submit payloads to a sink and wait for the uploads.
+
+        :param sink: the sink
+        :param payloads: the payloads
+        :returns: a list of upload results'''
+        async def main():
+            rcs = []
+            for p in payloads:
+                sink.submit(p)
+                if sink.uploading():
+                    rcs.append(await sink._uploading)
+            return rcs
+        try:
+            return asyncio.run(asyncio.wait_for(main(), 5))
+        finally:
+            sink.close()
+
+    def testWeatherUnderground(self):
+        '''Test we upload in imperial units.'''
+        wu = WeatherUnderground("station", "key", url=self._url)
+        rcs = self.upload(wu, [dict(temperature=20, wind_speed=1, wind_dir='N', wind_dir_deg=0)])
+        self.assertEqual(rcs, [True])
+        (method, _, params, _, _) = self._server.requests[0]
+        self.assertEqual(method, "GET")
+        self.assertEqual(params['ID'], ["station"])
+        self.assertEqual(params['tempf'], ["68.0"])
+        self.assertEqual(params['windspeedmph'], ["2.24"])
+        self.assertEqual(params['winddir'], ["0"])
+        self.assertNotIn('humidity', params)
+
+    def testOpenWeatherMap(self):
+        '''Test we upload a JSON measurement.'''
+        self._server.default = (204, b"")
+        ow = OpenWeatherMap("station", "key", url=self._url)
+        rcs = self.upload(ow, [dict(temperature=20, humidity=50)])
+        self.assertEqual(rcs, [True])
+        (method, _, params, body, _) = self._server.requests[0]
+        self.assertEqual(method, "POST")
+        self.assertEqual(params['appid'], ["key"])
+        m = json.loads(body)[0]
+        self.assertEqual(m['station_id'], "station")
+        self.assertEqual(m['temperature'], 20)
+        self.assertEqual(m['humidity'], 50)
+
+    def testKeepAlive(self):
+        '''Test uploads re-use the same connection.'''
+        wu = WeatherUnderground("station", "key", url=self._url, minInterval=0)
+        rcs = self.upload(wu, [dict(temperature=20), dict(temperature=21)])
+        self.assertEqual(rcs, [True, True])
+        ports = [r[4] for r in self._server.requests]
+        self.assertEqual(ports[0], ports[1])
+
+    def testRetry(self):
+        '''Test we retry server errors.'''
+        self._server.responses = [(503, b""), (500, b"")]
+        wu = WeatherUnderground("station", "key", url=self._url, backoff=0.01)
+        rcs = self.upload(wu, [dict(temperature=20)])
+        self.assertEqual(rcs, [True])
+        self.assertEqual(len(self._server.requests), 3)
+
+    def testGiveUp(self):
+        '''Test we give up after the retries.'''
+        self._server.default = (503, b"")
+        wu = WeatherUnderground("station", "key", url=self._url, retries=2, backoff=0.01)
+        rcs = self.upload(wu, [dict(temperature=20)])
+        self.assertEqual(rcs, [False])
+        self.assertEqual(len(self._server.requests), 3)
+
+    def testNoRetryRejected(self):
+        '''Test we don't retry uploads the service rejects.'''
+        self._server.default = (401, b"unauthorized")
+        wu = WeatherUnderground("station", "key", url=self._url, backoff=0.01)
+        rcs = self.upload(wu, [dict(temperature=20)])
+        self.assertEqual(rcs, [False])
+        self.assertEqual(len(self._server.requests), 1)
+
+    def testRateLimit(self):
+        '''Test uploads too close together are skipped.'''
+        wu = WeatherUnderground("station", "key", url=self._url, minInterval=60)
+        rcs = self.upload(wu, [dict(temperature=20), dict(temperature=21)])
+        self.assertEqual(rcs, [True])
+        self.assertEqual(len(self._server.requests), 1)
+
+    def testSlowSink(self):
+        '''Test a slow sink doesn't delay the others.'''
+        slow = FakeHTTPServer()
+        slowUrl = slow.start()
+        slow.delay = 0.5
+        th = Thermometer("th", RingBuffer(10), 0.01)
+
+        async def main():
+            sinks = [WeatherUnderground("slow", "key", url=slowUrl),
+                     WeatherUnderground("fast", "key", url=self._url)]
+            fo = FanOut({FanOut.TEMPERATURE: th}, sinks, period=0.05)
+            tasks = [asyncio.create_task(th.run()),
+                     asyncio.create_task(fo.run())]
+            await asyncio.sleep(0.2)
+            n = len(self._server.requests)
+            for t in tasks:
+                t.cancel()
+            await asyncio.gather(*[s._uploading for s in sinks], return_exceptions=True)
+            for s in sinks:
+                s.close()
+            return n
+
+        try:
+            n = asyncio.run(asyncio.wait_for(main(), 5))
+        finally:
+            slow.stop()
+        self.assertEqual(n, 1)
+        self.assertEqual(self._server.requests[0][2]['tempf'], ["68.0"])
+
+
+if __name__ == '__main__':
+    unittest.main()
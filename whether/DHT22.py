@@ -17,31 +17,137 @@
 # You should have received a copy of the GNU General Public License
 # along with whether. If not, see <http://www.gnu.org/licenses/gpl.html>.
 
-import asyncio
-from whether import Sampler
+import time
+from whether import Sampler, eventClass, logger
 import adafruit_dht
 
 
 class DHT22(Sampler):
     '''Driver for a DHT22 temperature and humidity sensor.
 
+    The DHT22 mustn't be read more often than every couple of seconds,
+    and reads fail quite often. The driver paces its reads, so that
+    any sample requested within the minimum interval of the last read
+    is served from the last good reading. A failed read is retried
+    (at the minimum interval) until the retry budget runs out, after
+    which the last good reading is served instead. Every event is
+    tagged with the age of its reading, which is zero for a fresh
+    reading.
+
+    Only fresh readings count as successes for the sensor's circuit
+    breaker, and each retry budget that runs out counts as a failure,
+    so a dead sensor opens its breaker even while the cache hides it.
+
     :param id: sensor identifier
     :param pin: the data pin
     :param ring: the ring buffer
     :param period: the sampling perdiod in seconds
+    :param minInterval: (optional) the minimum time between reads (defaults to 2s)
+    :param budget: (optional) the time allowed for retrying a failed read (defaults to the period)
+    :param maxAge: (optional) the oldest cached reading that will be served (defaults to 5m)
     '''
 
     TEMPERATURE = "temp"   #: Event tag fopr temperature in degrees Celsius.
     HUMIDITY = "hum"       #: Event tag for relative humidity in percent.
+    AGE = "age"            #: Event tag for the age of the reading in seconds.
 
-    def __init__(self, id, pin, ring, period = 1):
+    #: Event class.
+    EVENT = eventClass("DHT22Event",
+                       [Sampler.TIMESTAMP, Sampler.ID, TEMPERATURE, HUMIDITY, AGE],
+                       {Sampler.TIMESTAMP: 'd', TEMPERATURE: 'f', HUMIDITY: 'f', AGE: 'f'})
+
+    def __init__(self, id, pin, ring, period = 1,
+                 minInterval = 2, budget = None, maxAge = 300):
         super().__init__(id, ring, period)
         self._pin = pin
         self._dht = adafruit_dht.DHT22(pin)
 
-    def sample(self):
+        # pacing and retries
+        self._minInterval = minInterval
+        self._budget = period if budget is None else budget
+        self._maxAge = maxAge
+        self._lastRead = None
+        self._retryUntil = None
+        self._fresh = False
+
+        # last good reading
+        self._temperature = None
+        self._humidity = None
+        self._readAt = None
+
+    def cached(self, now, ev):
+        '''Fill in an event from the last good reading, if there is
+        one and it isn't too old.
+
+        :param now: the current (monotonic) time
+        :param ev: the event
+        :returns: True if the event was filled in'''
+        if self._readAt is None:
+            return False
+        age = now - self._readAt
+        if self._maxAge is not None and age > self._maxAge:
+            return False
+        ev[self.TEMPERATURE] = self._temperature
+        ev[self.HUMIDITY] = self._humidity
+        ev[self.AGE] = age
+        return True
+
+    def delay(self):
+        '''Return the time to wait before the next sample, which
+        is shortened to the minimum interval while retrying.
+
+        :returns: the delay in seconds'''
+        if self._retryUntil is not None:
+            # a little longer than the minimum, so the sensor is ready
+            return 1.1 * self._minInterval
+        return self.period()
+
+    def succeeded(self):
+        '''Record that a sample succeeded, but only if it came from
+        a fresh reading: a cached one says nothing about the sensor.'''
+        if self._fresh:
+            super().succeeded()
+
+    def sampleInto(self, ev):
         '''Take a sample from the sensor.
 
-        :returns: a dict'''
-        return {self.TEMPERATURE: self._dht.temperature,
-                self.HUMIDITY: self._dht.humidity}
+        :param ev: the event
+        :returns: True if the event was filled in'''
+        now = time.monotonic()
+
+        # serve from the cache if we read too recently
+        if self._lastRead is not None and now - self._lastRead < self._minInterval:
+            return self.cached(now, ev)
+
+        # try to read
+        self._lastRead = now
+        self._fresh = False
+        try:
+            t = self._dht.temperature
+            h = self._dht.humidity
+            if t is None or h is None:
+                raise RuntimeError("No reading from DHT22")
+        except RuntimeError as err:
+            # start the retry budget on the first failure
+            if self._retryUntil is None:
+                self._retryUntil = now + self._budget
+            if now < self._retryUntil:
+                logger.debug('{id}: {e} (retrying)'.format(id=self.id(),
+                                                          e=err))
+                return False
+
+            # out of retries, so fall back to the cache if we can
+            self._retryUntil = None
+            if not self.cached(now, ev):
+                raise
+            self.failed(err)
+            return True
+
+        # got a good reading
+        self._retryUntil = None
+        self._fresh = True
+        self._temperature, self._humidity, self._readAt = t, h, now
+        ev[self.TEMPERATURE] = t
+        ev[self.HUMIDITY] = h
+        ev[self.AGE] = 0
+        return True
@@ -15,24 +15,97 @@
 # You should have received a copy of the GNU General Public License
 # along with whether. If not, see <http://www.gnu.org/licenses/gpl.html>.
 
-# Logging
+from importlib import import_module
+
+# Logging, registering our logger so that getLogger() finds it
 import adafruit_logging as logging
-logger = logging.getLogger("whether")
+from .logsink import LazyLogger, BatchedHandler
+logger = logging.logger_cache.setdefault("whether", LazyLogger("whether"))
 
 # Utilities
 from .ringbuffer import RingBuffer
 from .utils import angleForDirection, modalTagValue, meanTagValue, maxTagValue
+from .breaker import CircuitBreaker
+from .events import Event, eventClass
+from .metrics import Metrics, metrics
+from .tracing import Tracer, tracer, LoopMonitor
+
+# Everything else is imported when first used, so that tools and tests
+# that only need the utilities don't pull in the hardware and network
+# libraries (or fail on hosts that don't have them). Each entry maps a
+# name to the module that defines it.
+_LAZY = {
+    # Calibration
+    'DirectionTable': '.calibration',
+    'loadDirectionTable': '.calibration',
+
+    # Sensor types
+    'Sampler': '.sensortypes',
+    'Counter': '.sensortypes',
+    'MCP3008Bus': '.mcp3008',
+    'AnalogueSampler': '.mcp3008',
+    'SysfsSampler': '.sysfs',
+
+    # Sensor drivers
+    'DHT22': '.DHT22',
+    'Anemometer': '.anemometer',
+    'WindDirection': '.winddirection',
+    'Raingauge': '.raingauge',
+    'PiJuice': '.pijuice',
+    'RPi': '.rpi',
+    'Host': '.host',
+    'PowerPolicy': '.powerpolicy',
+
+    # Payload encodings
+    'JSONCodec': '.payloads',
+    'CBORCodec': '.payloads',
+    'MessagePackCodec': '.payloads',
+    'StructSchema': '.payloads',
+    'StructCodec': '.payloads',
+    'decodePayload': '.payloads',
+    'GorillaCodec': '.compression',
+
+    # Reporters
+    'Reporter': '.reporter',
+    'FanOut': '.reporter',
+    'Deadband': '.deadband',
+    'MQTTConnection': '.mqtt',
+    'Outbox': '.outbox',
+    'HomeAssistant': '.homeassistant',
+    'RawStream': '.rawstream',
+    'decodeBatch': '.rawstream',
+    'HTTPSink': '.weatherservices',
+    'WeatherUnderground': '.weatherservices',
+    'OpenWeatherMap': '.weatherservices',
+
+    # Storage
+    'TimeSeriesStore': '.tsstore',
+
+    # Diagnostics
+    'DiagnosticsServer': '.diagnostics',
+}
+
+# Only the eagerly-imported names are exported by a wildcard import,
+# which would otherwise import every driver and fail without the hardware
+__all__ = ['logger', 'LazyLogger', 'BatchedHandler',
+           'RingBuffer',
+           'angleForDirection', 'modalTagValue', 'meanTagValue', 'maxTagValue',
+           'CircuitBreaker',
+           'Event', 'eventClass',
+           'Metrics', 'metrics',
+           'Tracer', 'tracer', 'LoopMonitor']
+
+
+def __getattr__(name):
+    if name in _LAZY:
+        v = getattr(import_module(_LAZY[name], __name__), name)
 
-# Sensor types
-from .sensortypes import Sampler, Counter
+        # cache the value, which also replaces any submodule of the
+        # same name that the import bound to the package
+        globals()[name] = v
+        return v
+    raise AttributeError("module {m} has no attribute {n}".format(m=__name__, n=name))
 
-# Sensor drivers
-from .DHT22 import DHT22
-from .anemometer import Anemometer
-from .winddirection import WindDirection
-from .raingauge import Raingauge
-from .pijuice import PiJuice
-from .rpi import RPi
 
-# Reporters
-from .homeassistant import HomeAssistant
+def __dir__():
+    return sorted(set(globals().keys()) | set(_LAZY.keys()))
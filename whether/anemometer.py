@@ -17,7 +17,7 @@
 # You should have received a copy of the GNU General Public License
 # along with whether. If not, see <http://www.gnu.org/licenses/gpl.html>.
 
-from whether import Counter
+from whether import Counter, eventClass
 
 
 class Anemometer(Counter):
@@ -32,6 +32,11 @@ class Anemometer(Counter):
 
     WINDSPEED = "windspeed"                 #: Event tag for windspeed in m/s.
 
+    #: Event class.
+    EVENT = eventClass("AnemometerEvent",
+                       [Counter.TIMESTAMP, Counter.ID, WINDSPEED],
+                       {Counter.TIMESTAMP: 'd', WINDSPEED: 'f'})
+
     # One rotation per second indicates a windpseed of 2.4km/h
     SPEEDPERROTATION = 2400 / (60 * 60)    #: Windspeed in m/s corresponding to one rotation/s.
 
@@ -46,10 +51,11 @@ class Anemometer(Counter):
         :returns: the windspeed'''
         return (self.SPEEDPERROTATION * n) / dt
 
-    def sample(self):
+    def sampleInto(self, ev):
         '''Convert the count into a windspeed event.
 
-        :returns: a dict'''
+        :param ev: the event
+        :returns: True'''
         c = self.count()
-        s = self.speed(c, self.period())
-        return {self.WINDSPEED: s}
+        ev[self.WINDSPEED] = self.speed(c, self.period())
+        return True
@@ -0,0 +1,157 @@
+# Circuit breakers for failing sensors
+#
+# Copyright (C) 2023 Simon Dobson
+#
+# This file is part of whether, a modular IoT weather station
+#
+# whether is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# whether is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with whether. If not, see <http://www.gnu.org/licenses/gpl.html>.
+
+import time
+from whether import logger
+
+
+class CircuitBreaker:
+    '''A circuit breaker for a sensor.
+
+    A breaker starts closed, with every sample attempted. After a given
+    number of consecutive failures it opens, and samples are skipped.
+    Once a back-off time has elapsed the sensor is probed (the breaker
+    is half-open), with samples attempted until one either succeeds
+    or fails: on success the breaker closes again, and on failure it
+    re-opens with the back-off doubled, up to a maximum. Absent or broken hardware therefore
+    costs one probe every few minutes rather than an error every
+    period.
+
+    Changes of state are logged, and published as health events to
+    any listeners and, if the breaker has one, to a ring buffer.
+
+    :param id: the id of the sensor being protected
+    :param failures: (optional) consecutive failures needed to open (defaults to 5)
+    :param backoff: (optional) the initial back-off in seconds (defaults to 10s)
+    :param maxBackoff: (optional) the maximum back-off in seconds (defaults to 10m)
+    :param ring: (optional) a ring buffer to receive health events
+    '''
+
+    CLOSED = "ok"            #: State when the sensor is working.
+    OPEN = "failed"          #: State when the sensor has failed.
+    HALF_OPEN = "probing"    #: State when the sensor is being probed.
+
+    STATE = "health"         #: Event tag for the breaker state.
+    FAILURES = "failures"    #: Event tag for the number of consecutive failures.
+    TIMESTAMP = "time"       #: Event tag for timestamp, in Unix epoch seconds.
+    ID = "id"                #: Event tag for the sensor id.
+
+
+    def __init__(self, id, failures = 5, backoff = 10, maxBackoff = 600, ring = None):
+        if failures < 1:
+            raise ValueError("Breaker must need at least one failure to open")
+        self._id = id
+        self._threshold = failures
+        self._initialBackoff = backoff
+        self._maxBackoff = maxBackoff
+        self._ring = ring
+        self._listeners = []
+
+        self._state = self.CLOSED
+        self._failures = 0
+        self._backoff = backoff
+        self._probeAt = None
+
+    def id(self):
+        '''Return the id of the sensor being protected.
+
+        :returns: the id'''
+        return self._id
+
+    def addListener(self, f):
+        '''Add a function to be called with every health event. The
+        function is called with the breaker and the event.
+
+        :param f: the function'''
+        self._listeners.append(f)
+
+    def state(self):
+        '''Return the breaker's state.
+
+        :returns: the state'''
+        return self._state
+
+    def failures(self):
+        '''Return the number of consecutive failures.
+
+        :returns: the number of failures'''
+        return self._failures
+
+    def backoff(self):
+        '''Return the current back-off.
+
+        :returns: the back-off in seconds'''
+        return self._backoff
+
+    def _changeState(self, s):
+        '''Change state, logging and publishing the change.
+
+        :param s: the new state'''
+        self._state = s
+        if s == self.OPEN:
+            logger.warning("{id}: failed {n} times, next probe in {b}s".format(id=self._id,
+                                                                              n=self._failures,
+                                                                              b=self._backoff))
+        elif s == self.CLOSED:
+            logger.info("{id}: working again".format(id=self._id))
+        ev = {self.STATE: s,
+              self.FAILURES: self._failures,
+              self.ID: self._id,
+              self.TIMESTAMP: time.time()}
+        if self._ring is not None:
+            self._ring.push(ev)
+        for f in self._listeners:
+            f(self, ev)
+
+    def allow(self, now):
+        '''Test whether a sample should be attempted.
+
+        :param now: the current (monotonic) time
+        :returns: True if the sample should go ahead'''
+        if self._state == self.CLOSED:
+            return True
+        elif self._state == self.OPEN and now >= self._probeAt:
+            self._changeState(self.HALF_OPEN)
+            return True
+        elif self._state == self.HALF_OPEN:
+            # still probing, as the last attempt was inconclusive
+            return True
+        else:
+            return False
+
+    def success(self):
+        '''Record a successful sample.'''
+        self._failures = 0
+        if self._state != self.CLOSED:
+            self._backoff = self._initialBackoff
+            self._changeState(self.CLOSED)
+
+    def failure(self, now):
+        '''Record a failed sample.
+
+        :param now: the current (monotonic) time'''
+        self._failures += 1
+        if self._state == self.HALF_OPEN:
+            # probe failed, back off further
+            self._backoff = min(2 * self._backoff, self._maxBackoff)
+            self._probeAt = now + self._backoff
+            self._changeState(self.OPEN)
+        elif self._state == self.CLOSED and self._failures >= self._threshold:
+            self._probeAt = now + self._backoff
+            self._changeState(self.OPEN)
@@ -0,0 +1,118 @@
+# Wind direction calibration tables
+#
+# Copyright (C) 2023 Simon Dobson
+#
+# This file is part of whether, a modular IoT weather station
+#
+# whether is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# whether is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with whether. If not, see <http://www.gnu.org/licenses/gpl.html>.
+
+import json
+from array import array
+from whether.filters import majority
+
+
+class DirectionTable:
+    '''A pre-computed lookup table from raw ADC readings to directions.
+
+    The table is built from a calibration mapping direction names
+    to the raw (16-bit) readings taken with the vane pointing that way.
+    Every possible ADC code is mapped in advance to the nearest
+    calibration point, so a lookup is a single array index
+    regardless of how many points the vane has.
+
+    :param cal: dict mapping directions to raw readings
+    :param bits: (optional) the resolution of the ADC (defaults to 10 bits)
+    '''
+
+    def __init__(self, cal, bits = 10):
+        if len(cal) == 0:
+            raise ValueError("Empty calibration")
+        if len(cal) > 256:
+            raise ValueError("Too many calibration points")
+        self._calibration = dict(cal)
+        self._bits = bits
+        self._shift = 16 - bits
+
+        # sort the points by reading
+        points = sorted(cal.items(), key=lambda p: p[1])
+        self._directions = tuple([d for (d, _) in points])
+
+        # the boundaries between points lie midway between readings
+        bounds = [(points[i][1] + points[i + 1][1]) / 2 for i in range(len(points) - 1)]
+
+        # map every code to the index of its nearest point
+        self._lut = array('B', bytes(1 << bits))
+        i = 0
+        for c in range(len(self._lut)):
+            v = c << self._shift
+            while i < len(bounds) and v > bounds[i]:
+                i += 1
+            self._lut[c] = i
+
+    def calibration(self):
+        '''Return the calibration the table was built from.
+
+        :returns: a dict mapping directions to raw readings'''
+        return self._calibration
+
+    def directions(self):
+        '''Return the directions in the table, in order of increasing
+        raw reading.
+
+        :returns: a tuple of directions'''
+        return self._directions
+
+    def index(self, r):
+        '''Return the index of the direction nearest a raw reading.
+
+        :param r: the raw reading
+        :returns: an index into :meth:`directions`'''
+        return self._lut[r >> self._shift]
+
+    def direction(self, r):
+        '''Return the direction nearest a raw reading.
+
+        :param r: the raw reading
+        :returns: the direction'''
+        return self._directions[self._lut[r >> self._shift]]
+
+    def vote(self, block):
+        '''Return the index of the direction seen most often in
+        a block of raw readings.
+
+        :param block: an array of unsigned 16-bit readings
+        :returns: an index into :meth:`directions`'''
+        return majority(block, self._lut, self._shift, len(self._directions))
+
+    def save(self, fn, **kwds):
+        '''Save the calibration to a JSON file. Any other keyword
+        arguments are saved alongside the calibration points.
+
+        :param fn: the file name'''
+        d = dict(kwds)
+        d['directions'] = self._calibration
+        d['bits'] = self._bits
+        with open(fn, 'w') as fh:
+            json.dump(d, fh, indent=3)
+
+
+def loadDirectionTable(fn):
+    '''Load a direction table from a JSON calibration file
+    written by :meth:`DirectionTable.save`.
+
+    :param fn: the file name
+    :returns: the direction table'''
+    with open(fn) as fh:
+        d = json.load(fh)
+    return DirectionTable(d['directions'], d.get('bits', 10))
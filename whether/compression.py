@@ -0,0 +1,469 @@
+# Compression of columns of time series
+#
+# Copyright (C) 2023 Simon Dobson
+#
+# This file is part of whether, a modular IoT weather station
+#
+# whether is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# whether is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with whether. If not, see <http://www.gnu.org/licenses/gpl.html>.
+
+import struct
+
+
+# Pre-built structs for moving floats to and from their bits
+_F32 = struct.Struct('<f')
+_F64 = struct.Struct('<d')
+_U64 = struct.Struct('<Q')
+_U64BE = struct.Struct('>Q')
+
+# The bit pattern stored for missing values in float columns
+_NAN = _U64.unpack(_F64.pack(float('nan')))[0]
+
+
+class _BitWriter:
+    '''Accumulate values of arbitrary bit widths into bytes.'''
+
+    def __init__(self):
+        self._out = bytearray()
+        self._acc = 0
+        self._n = 0
+
+    def write(self, v, n):
+        '''Write the low bits of a value.
+
+        :param v: the value
+        :param n: the number of bits'''
+        self._acc = (self._acc << n) | (v & ((1 << n) - 1))
+        self._n += n
+        if self._n >= 64:
+            self._n -= 64
+            self._out += _U64BE.pack(self._acc >> self._n)
+            self._acc &= (1 << self._n) - 1
+
+    def bytes(self):
+        '''Return the bits written, padded with zeros to a whole byte.
+
+        :returns: bytes'''
+        out = bytearray(self._out)
+        if self._n > 0:
+            pad = -self._n % 8
+            out += (self._acc << pad).to_bytes((self._n + pad) // 8, 'big')
+        return bytes(out)
+
+
+class _BitReader:
+    '''Read values of arbitrary bit widths from bytes.'''
+
+    def __init__(self, data):
+        self._data = data
+        self._i = 0
+        self._acc = 0
+        self._n = 0
+
+    def read(self, n):
+        '''Read a value.
+
+        :param n: the number of bits
+        :returns: the value'''
+        while self._n < n:
+            self._acc = (self._acc << 8) | self._data[self._i]
+            self._i += 1
+            self._n += 8
+        self._n -= n
+        v = self._acc >> self._n
+        self._acc &= (1 << self._n) - 1
+        return v
+
+
+def _writeVarint(n, out):
+    '''Append an unsigned integer in LEB128.
+
+    :param n: the integer
+    :param out: the bytearray'''
+    while n >= 0x80:
+        out.append((n & 0x7f) | 0x80)
+        n >>= 7
+    out.append(n)
+
+
+def _readVarint(data, i):
+    '''Read an unsigned integer in LEB128.
+
+    :param data: the bytes
+    :param i: the index
+    :returns: a pair of the integer and the index after it'''
+    n = 0
+    shift = 0
+    while True:
+        b = data[i]
+        i += 1
+        n |= (b & 0x7f) << shift
+        if b < 0x80:
+            return (n, i)
+        shift += 7
+
+
+def _zigzag(n):
+    '''Map a signed integer to an unsigned one, small magnitudes first.'''
+    return (n << 1) if n >= 0 else ((-n << 1) - 1)
+
+
+def _unzigzag(n):
+    '''Invert :func:`_zigzag`.'''
+    return (n >> 1) if (n & 1) == 0 else -((n + 1) >> 1)
+
+
+# Buckets for delta-of-delta timestamps: prefix, prefix bits, value bits
+_DOD_BUCKETS = [(0b10, 2, 7), (0b110, 3, 9), (0b1110, 4, 12)]
+
+
+class GorillaCodec:
+    '''Compress columns of time series, in the style of Facebook's
+    Gorilla database.
+
+    A block of columns, being a dict mapping tags to equal-length
+    lists of values, is encoded column by column using the encoding
+    that suits each column:
+
+    - timestamps are quantised to a resolution and stored as the
+      differences between successive intervals (delta-of-delta), which
+      for regular sampling are mostly zero and take a single bit;
+    - floats are stored as the XOR of each value with the previous
+      one, which for slowly-changing readings has long runs of leading
+      and trailing zero bits that needn't be stored;
+    - integers are stored as variable-length differences; and
+    - strings, such as wind directions or power tiers, are stored as
+      a dictionary of the distinct values, with each value stored as a
+      single bit when it's the same as the previous one and otherwise
+      as an index into the dictionary.
+
+    Missing values are allowed in all but timestamp columns, which
+    fall back to being stored as floats if they have any. Columns can
+    be given :mod:`struct` format codes: a column with the "f" code has
+    its values rounded to 32 bits first, so that the noise in their
+    low bits isn't stored.
+
+    Blocks are self-contained, and can be streamed to and from a file
+    one at a time using :meth:`writeBlock` and :meth:`readBlocks`.
+
+    :param timestamp: (optional) the tag of the timestamp column (defaults to "time")
+    :param resolution: (optional) the resolution of timestamps in seconds (defaults to 1ms)
+    '''
+
+    NAME = "gorilla"     #: Name of the codec.
+
+    # Column encodings
+    TIMESTAMPS = 0
+    FLOATS = 1
+    INTEGERS = 2
+    STRINGS = 3
+
+
+    def __init__(self, timestamp = "time", resolution = 0.001):
+        self._timestamp = timestamp
+        self._resolution = resolution
+
+    # ---------- Column encodings ----------
+
+    def _encodeTimestamps(self, col, out):
+        '''Encode timestamps as deltas-of-deltas.'''
+        out += _F64.pack(self._resolution)
+        qs = [round(t / self._resolution) for t in col]
+        bw = _BitWriter()
+        bw.write(qs[0], 64)
+        prev = qs[0]
+        delta = 0
+        for q in qs[1:]:
+            d = q - prev
+            dod = d - delta
+            prev, delta = q, d
+            if dod == 0:
+                bw.write(0, 1)
+                continue
+            for (prefix, pn, vn) in _DOD_BUCKETS:
+                lim = 1 << (vn - 1)
+                if -lim < dod <= lim:
+                    bw.write(prefix, pn)
+                    bw.write(dod + lim - 1, vn)
+                    break
+            else:
+                bw.write(0b1111, 4)
+                bw.write(dod, 64)
+        out += bw.bytes()
+
+    def _decodeTimestamps(self, data, n):
+        '''Decode timestamps.'''
+        scale = 1 / _F64.unpack_from(data)[0]
+        br = _BitReader(memoryview(data)[_F64.size:])
+        q = br.read(64)
+        if q >= 1 << 63:
+            q -= 1 << 64
+        ts = [q / scale]
+        delta = 0
+        for _ in range(n - 1):
+            if br.read(1) == 0:
+                dod = 0
+            else:
+                for (_, _, vn) in _DOD_BUCKETS:
+                    if br.read(1) == 0:
+                        dod = br.read(vn) - (1 << (vn - 1)) + 1
+                        break
+                else:
+                    dod = br.read(64)
+                    if dod >= 1 << 63:
+                        dod -= 1 << 64
+            delta += dod
+            q += delta
+            ts.append(q / scale)
+        return ts
+
+    def _encodeFloats(self, col, out, single):
+        '''Encode floats by XORing each with its predecessor.'''
+        bits = []
+        for v in col:
+            if v is None:
+                bits.append(_NAN)
+            else:
+                if single:
+                    v = _F32.unpack(_F32.pack(v))[0]
+                bits.append(_U64.unpack(_F64.pack(v))[0])
+
+        bw = _BitWriter()
+        bw.write(bits[0], 64)
+        prev = bits[0]
+        lead, trail = 65, 0     # no window yet
+        for b in bits[1:]:
+            x = b ^ prev
+            prev = b
+            if x == 0:
+                bw.write(0, 1)
+                continue
+            l = min(64 - x.bit_length(), 31)
+            t = (x & -x).bit_length() - 1
+            if l >= lead and t >= trail:
+                # fits in the previous window of meaningful bits
+                bw.write(0b10, 2)
+                bw.write(x >> trail, 64 - lead - trail)
+            else:
+                lead, trail = l, t
+                sig = 64 - l - t
+                bw.write(0b11, 2)
+                bw.write(l, 5)
+                bw.write(sig & 0x3f, 6)     # 64 stored as 0
+                bw.write(x >> t, sig)
+        out += bw.bytes()
+
+    def _decodeFloats(self, data, n):
+        '''Decode floats.'''
+        br = _BitReader(data)
+        b = br.read(64)
+        bits = [b]
+        lead, trail = 0, 0
+        for _ in range(n - 1):
+            if br.read(1) == 1:
+                if br.read(1) == 1:
+                    lead = br.read(5)
+                    sig = br.read(6) or 64
+                    trail = 64 - lead - sig
+                b ^= br.read(64 - lead - trail) << trail
+            bits.append(b)
+        vs = []
+        for b in bits:
+            v = _F64.unpack(_U64.pack(b))[0]
+            vs.append(None if v != v else v)
+        return vs
+
+    def _encodeIntegers(self, col, out):
+        '''Encode integers as variable-length differences.'''
+        prev = 0
+        for v in col:
+            _writeVarint(_zigzag(v - prev), out)
+            prev = v
+
+    def _decodeIntegers(self, data, n):
+        '''Decode integers.'''
+        vs = []
+        i = 0
+        v = 0
+        for _ in range(n):
+            (d, i) = _readVarint(data, i)
+            v += _unzigzag(d)
+            vs.append(v)
+        return vs
+
+    def _encodeStrings(self, col, out):
+        '''Encode strings as a dictionary and runs.'''
+        codes = dict()
+        for v in col:
+            if v not in codes:
+                codes[v] = len(codes)
+        _writeVarint(len(codes), out)
+        for v in codes.keys():
+            if v is None:
+                out.append(0)
+            else:
+                bs = v.encode()
+                _writeVarint(len(bs) + 1, out)
+                out += bs
+
+        width = max((len(codes) - 1).bit_length(), 1)
+        bw = _BitWriter()
+        prev = object()
+        for v in col:
+            if v == prev:
+                bw.write(0, 1)
+            else:
+                bw.write(1, 1)
+                bw.write(codes[v], width)
+                prev = v
+        out += bw.bytes()
+
+    def _decodeStrings(self, data, n):
+        '''Decode strings.'''
+        (k, i) = _readVarint(data, 0)
+        values = []
+        for _ in range(k):
+            (m, i) = _readVarint(data, i)
+            if m == 0:
+                values.append(None)
+            else:
+                values.append(bytes(data[i:i + m - 1]).decode())
+                i += m - 1
+
+        width = max((k - 1).bit_length(), 1)
+        br = _BitReader(memoryview(data)[i:])
+        vs = []
+        v = None
+        for _ in range(n):
+            if br.read(1) == 1:
+                v = values[br.read(width)]
+            vs.append(v)
+        return vs
+
+    def _encoding(self, tag, col):
+        '''Choose the encoding for a column.
+
+        :param tag: the tag
+        :param col: the values
+        :returns: the encoding'''
+        if any([isinstance(v, str) for v in col]):
+            return self.STRINGS
+        if tag == self._timestamp and None not in col:
+            return self.TIMESTAMPS
+        if all([isinstance(v, int) and not isinstance(v, bool) for v in col]):
+            return self.INTEGERS
+        return self.FLOATS
+
+    # ---------- Blocks ----------
+
+    def encode(self, cols, formats = None):
+        '''Encode a block of columns.
+
+        :param cols: a dict mapping tags to lists of values, all of the same length
+        :param formats: (optional) a dict mapping tags to :mod:`struct` format codes
+        :returns: bytes'''
+        formats = dict() if formats is None else formats
+        n = len(next(iter(cols.values()))) if len(cols) > 0 else 0
+        out = bytearray()
+        _writeVarint(n, out)
+        _writeVarint(len(cols), out)
+        for (t, col) in cols.items():
+            if len(col) != n:
+                raise ValueError("Column {t} has {m} values, not {n}".format(t=t, m=len(col), n=n))
+            bs = t.encode()
+            _writeVarint(len(bs), out)
+            out += bs
+            e = self._encoding(t, col)
+            out.append(e)
+            data = bytearray()
+            if n > 0:
+                if e == self.TIMESTAMPS:
+                    self._encodeTimestamps(col, data)
+                elif e == self.FLOATS:
+                    self._encodeFloats(col, data, formats.get(t) == 'f')
+                elif e == self.INTEGERS:
+                    self._encodeIntegers(col, data)
+                else:
+                    self._encodeStrings(col, data)
+            _writeVarint(len(data), out)
+            out += data
+        return bytes(out)
+
+    def decode(self, data):
+        '''Decode a block of columns.
+
+        :param data: bytes
+        :returns: a dict mapping tags to lists of values'''
+        data = memoryview(data)
+        (n, i) = _readVarint(data, 0)
+        (k, i) = _readVarint(data, i)
+        cols = dict()
+        for _ in range(k):
+            (m, i) = _readVarint(data, i)
+            t = bytes(data[i:i + m]).decode()
+            i += m
+            e = data[i]
+            (m, i) = _readVarint(data, i + 1)
+            d = data[i:i + m]
+            i += m
+            if n == 0:
+                cols[t] = []
+            elif e == self.TIMESTAMPS:
+                cols[t] = self._decodeTimestamps(d, n)
+            elif e == self.FLOATS:
+                cols[t] = self._decodeFloats(d, n)
+            elif e == self.INTEGERS:
+                cols[t] = self._decodeIntegers(d, n)
+            elif e == self.STRINGS:
+                cols[t] = self._decodeStrings(d, n)
+            else:
+                raise ValueError("Unknown column encoding {e}".format(e=e))
+        return cols
+
+    def writeBlock(self, fh, cols, formats = None):
+        '''Encode a block of columns and write it to a file,
+        preceded by its length.
+
+        :param fh: the file, open for writing bytes
+        :param cols: a dict mapping tags to lists of values
+        :param formats: (optional) a dict mapping tags to format codes
+        :returns: the number of bytes written'''
+        data = self.encode(cols, formats)
+        head = bytearray()
+        _writeVarint(len(data), head)
+        fh.write(head)
+        fh.write(data)
+        return len(head) + len(data)
+
+    def readBlocks(self, fh):
+        '''Read blocks written by :meth:`writeBlock` from a file,
+        one at a time. A truncated block at the end of the file
+        is ignored.
+
+        :param fh: the file, open for reading bytes
+        :returns: a generator of dicts mapping tags to lists of values'''
+        while True:
+            n = 0
+            shift = 0
+            while True:
+                b = fh.read(1)
+                if len(b) == 0:
+                    return
+                n |= (b[0] & 0x7f) << shift
+                if b[0] < 0x80:
+                    break
+                shift += 7
+            data = fh.read(n)
+            if len(data) < n:
+                return
+            yield self.decode(data)
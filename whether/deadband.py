@@ -0,0 +1,64 @@
+# Report-by-exception deadbands
+#
+# Copyright (C) 2023 Simon Dobson
+#
+# This file is part of whether, a modular IoT weather station
+#
+# whether is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# whether is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with whether. If not, see <http://www.gnu.org/licenses/gpl.html>.
+
+
+class Deadband:
+    '''A deadband and heartbeat for a reported value.
+
+    A value is due to be reported when it has moved by more than the
+    threshold since it was last reported, or when it hasn't been
+    reported for the maximum silence interval, so receivers know
+    that the station is still alive. Non-numeric values are due
+    whenever they change.
+
+    :param threshold: (optional) the change needed to report (defaults to 0, any change)
+    :param maxSilence: (optional) the maximum time between reports in seconds (defaults to 15m)
+    '''
+
+    def __init__(self, threshold = 0, maxSilence = 15 * 60):
+        self._threshold = threshold
+        self._maxSilence = maxSilence
+        self._last = None
+        self._at = None
+
+    def last(self):
+        '''Return the value last reported.
+
+        :returns: the value, or None'''
+        return self._last
+
+    def due(self, v, now):
+        '''Test whether a value should be reported.
+
+        :param v: the value
+        :param now: the current (monotonic) time
+        :returns: True if the value should be reported'''
+        if self._at is None or now - self._at >= self._maxSilence:
+            return True
+        if isinstance(v, (int, float)) and isinstance(self._last, (int, float)):
+            return abs(v - self._last) > self._threshold
+        return v != self._last
+
+    def reported(self, v, now):
+        '''Record that a value has been reported.
+
+        :param v: the value
+        :param now: the current (monotonic) time'''
+        self._last = v
+        self._at = now
@@ -0,0 +1,136 @@
+# Local HTTP endpoint for diagnostics
+#
+# Copyright (C) 2023 Simon Dobson
+#
+# This file is part of whether, a modular IoT weather station
+#
+# whether is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# whether is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with whether. If not, see <http://www.gnu.org/licenses/gpl.html>.
+
+import json
+import asyncio
+from whether import logger
+from whether.metrics import metrics
+from whether.tracing import tracer
+
+
+class DiagnosticsServer:
+    '''A minimal HTTP server for reading the station's diagnostics.
+
+    The server runs on the event loop and answers GET requests for a
+    set of routes, each served by a function returning a content type
+    and a body. It serves the station's metrics on :attr:`METRICS`
+    in Prometheus text format, for scraping, and the station's trace
+    on :attr:`TRACE` in Chrome's trace-event format. Each request is
+    answered and the connection closed, which is all a scraper needs.
+
+    The server binds to the local host by default, as the diagnostics
+    aren't protected in any way. The default port is chosen to stay
+    clear of node_exporter's 9100, which is often running on the same
+    machine. If the port can't be bound the station carries on
+    without its diagnostics.
+
+    :param host: (optional) the address to listen on (defaults to the local host)
+    :param port: (optional) the port to listen on (defaults to :attr:`PORT`)
+    :param registry: (optional) the metrics registry (defaults to the station's)
+    '''
+
+    METRICS = "/metrics"    #: Route for the metrics.
+    TRACE = "/trace"        #: Route for the trace.
+    PORT = 9877             #: Default port.
+
+
+    def __init__(self, host = "127.0.0.1", port = PORT, registry = None):
+        self._host = host
+        self._port = port
+        self._server = None
+        self._routes = dict()
+
+        registry = metrics if registry is None else registry
+        self.addRoute(self.METRICS, lambda: (registry.CONTENT_TYPE, registry.render().encode()))
+        self.addRoute(self.TRACE, lambda: ("application/json", json.dumps(tracer.toChrome()).encode()))
+
+    def addRoute(self, path, f):
+        '''Add a route. The function is called with no arguments for
+        each request for the path.
+
+        :param path: the path
+        :param f: a function returning a (content type, body bytes) pair'''
+        self._routes[path] = f
+
+    def port(self):
+        '''Return the port the server is listening on, which is
+        only known for port 0 once the server has started.
+
+        :returns: the port'''
+        if self._server is not None:
+            return self._server.sockets[0].getsockname()[1]
+        return self._port
+
+    async def start(self):
+        '''Start the server.
+
+        :returns: True if the server started, False if it couldn't listen'''
+        try:
+            self._server = await asyncio.start_server(self._serve, self._host, self._port)
+        except OSError as e:
+            logger.warning("No diagnostics, can't listen on port {p}: {e}".format(p=self._port, e=e))
+            return False
+        logger.info("Diagnostics on port {p}".format(p=self.port()))
+        return True
+
+    async def stop(self):
+        '''Stop the server.'''
+        if self._server is None:
+            return
+        self._server.close()
+        await self._server.wait_closed()
+        self._server = None
+
+    def _response(self, status, reason, ct, body):
+        '''Build a response.
+
+        :param status: the status code
+        :param reason: the reason phrase
+        :param ct: the content type
+        :param body: the body bytes
+        :returns: the response bytes'''
+        head = "HTTP/1.1 {s} {r}\r\nContent-Type: {c}\r\nContent-Length: {n}\r\nConnection: close\r\n\r\n".format(s=status, r=reason, c=ct, n=len(body))
+        return head.encode() + body
+
+    async def _serve(self, reader, writer):
+        '''Answer a request.'''
+        try:
+            line = await reader.readline()
+            while (await reader.readline()) not in [b'\r\n', b'\n', b'']:
+                # skip the headers
+                pass
+            parts = line.decode(errors='replace').split()
+            if len(parts) < 2 or parts[0] != "GET":
+                writer.write(self._response(405, "Method Not Allowed", "text/plain", b""))
+            else:
+                f = self._routes.get(parts[1].split('?')[0])
+                if f is None:
+                    writer.write(self._response(404, "Not Found", "text/plain", b""))
+                else:
+                    (ct, body) = f()
+                    writer.write(self._response(200, "OK", ct, body))
+            await writer.drain()
+        except Exception as e:
+            logger.error("Diagnostics request failed: {e}".format(e=e))
+        finally:
+            writer.close()
+
+    async def run(self):
+        if await self.start():
+            await self._server.serve_forever()
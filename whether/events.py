@@ -0,0 +1,233 @@
+# Typed event records
+#
+# Copyright (C) 2023 Simon Dobson
+#
+# This file is part of whether, a modular IoT weather station
+#
+# whether is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# whether is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with whether. If not, see <http://www.gnu.org/licenses/gpl.html>.
+
+import json
+import struct
+
+
+def _jsonValue(v):
+    '''Encode a single value as JSON.
+
+    :param v: the value
+    :returns: a string'''
+    if v is None:
+        return 'null'
+    elif v is True:
+        return 'true'
+    elif v is False:
+        return 'false'
+    elif isinstance(v, (int, float)):
+        if v != v:
+            # NaN isn't legal JSON
+            return 'null'
+        return repr(v)
+    else:
+        return json.dumps(v)
+
+
+def _slotName(tag):
+    '''Turn an event tag into a legal slot name.
+
+    :param tag: the tag
+    :returns: the slot name'''
+    s = ''.join([c if c.isalnum() else '_' for c in tag])
+    return '_' + s
+
+
+class Event:
+    '''Base class for typed event records.
+
+    Typed events have a fixed set of tags, stored in slots rather than
+    in a dict, and are created by :func:`eventClass`. They still behave
+    like dicts for reading and writing the values of their tags, so
+    code written for dict events works unchanged. Each class also has
+    serialisers to JSON and to a fixed binary layout that are built
+    when the class is created, rather than every time an event is
+    serialised.
+    '''
+
+    __slots__ = ()
+
+    _TAGS = ()             # tags, in order
+    _SLOTS = dict()        # map from tags to slot names
+    _JSON = '{}'           # JSON template
+    _BINARY = None         # struct for the binary layout
+    _BINARY_TAGS = ()      # tags in the binary layout, in order
+    _STRINGS = ()          # flags for binary fields that are strings
+    _FORMATS = ()          # formats of the binary fields
+
+    def tags(self):
+        '''Return the tags this event can hold.
+
+        :returns: a tuple of tags'''
+        return self._TAGS
+
+    @classmethod
+    def formats(cls):
+        '''Return the binary formats of the tags in the binary layout.
+
+        :returns: a dict mapping tags to :mod:`struct` format codes, in layout order'''
+        return dict(zip(cls._BINARY_TAGS, cls._FORMATS))
+
+    def __getitem__(self, tag):
+        try:
+            return getattr(self, self._SLOTS[tag])
+        except AttributeError:
+            raise KeyError(tag)
+
+    def __setitem__(self, tag, v):
+        setattr(self, self._SLOTS[tag], v)
+
+    def __contains__(self, tag):
+        return tag in self._SLOTS and hasattr(self, self._SLOTS[tag])
+
+    def get(self, tag, default = None):
+        '''Return the value of a tag, or a default if it's not set.
+
+        :param tag: the tag
+        :param default: (optional) the default (defaults to None)
+        :returns: the value'''
+        if tag in self._SLOTS:
+            return getattr(self, self._SLOTS[tag], default)
+        return default
+
+    def keys(self):
+        '''Return the tags that have values.
+
+        :returns: a list of tags'''
+        return [t for t in self._TAGS if hasattr(self, self._SLOTS[t])]
+
+    def values(self):
+        '''Return the values that have been set.
+
+        :returns: a list of values'''
+        return [self[t] for t in self.keys()]
+
+    def items(self):
+        '''Return the tag-value pairs that have been set.
+
+        :returns: a list of pairs'''
+        return [(t, self[t]) for t in self.keys()]
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def __len__(self):
+        return len(self.keys())
+
+    def update(self, d):
+        '''Set the values of several tags.
+
+        :param d: a dict (or event) of tags and values'''
+        for (t, v) in d.items():
+            self[t] = v
+
+    def toDict(self):
+        '''Return the event as a dict.
+
+        :returns: a dict'''
+        return dict(self.items())
+
+    def __eq__(self, other):
+        if isinstance(other, Event):
+            other = other.toDict()
+        return self.toDict() == other
+
+    def __repr__(self):
+        return '{n}({d})'.format(n=type(self).__name__,
+                                 d=self.toDict())
+
+    def toJSON(self):
+        '''Serialise the event as JSON. Tags without values are
+        serialised as null.
+
+        :returns: a string'''
+        return self._JSON % tuple([_jsonValue(self.get(t)) for t in self._TAGS])
+
+    def toBinary(self):
+        '''Serialise the event in its binary layout. Numeric tags
+        without values are encoded as NaN.
+
+        :returns: bytes'''
+        if self._BINARY is None:
+            raise ValueError("No binary layout for {n}".format(n=type(self).__name__))
+        vs = []
+        for i in range(len(self._BINARY_TAGS)):
+            v = self.get(self._BINARY_TAGS[i])
+            if self._STRINGS[i]:
+                v = b'' if v is None else v.encode()
+            elif v is None:
+                v = float('nan')
+            vs.append(v)
+        return self._BINARY.pack(*vs)
+
+    def fromBinary(self, data):
+        '''Fill in the event from its binary layout, as produced by
+        :meth:`toBinary`. NaNs are decoded as None.
+
+        :param data: the bytes
+        :returns: the event'''
+        if self._BINARY is None:
+            raise ValueError("No binary layout for {n}".format(n=type(self).__name__))
+        vs = self._BINARY.unpack(data)
+        for i in range(len(self._BINARY_TAGS)):
+            v = vs[i]
+            if self._STRINGS[i]:
+                v = v.rstrip(b'\0').decode()
+            elif v != v:
+                v = None
+            self[self._BINARY_TAGS[i]] = v
+        return self
+
+
+def eventClass(name, tags, formats = None):
+    '''Create a typed event class.
+
+    The binary layout is described by a dict mapping tags to
+    :mod:`struct` format codes: only these tags are included in the
+    layout, in the order given. Strings use the "s" code with a length,
+    and are truncated or padded to fit.
+
+    :param name: the class name
+    :param tags: the tags
+    :param formats: (optional) the binary formats of tags
+    :returns: the new class'''
+    tags = tuple(tags)
+    slots = dict()
+    for t in tags:
+        slots[t] = _slotName(t)
+    if len(set(slots.values())) < len(tags):
+        raise ValueError("Tags must be distinct")
+
+    attrs = dict(__slots__=tuple(slots.values()),
+                 _TAGS=tags,
+                 _SLOTS=slots,
+                 _JSON='{' + ','.join([json.dumps(t).replace('%', '%%') + ':%s' for t in tags]) + '}')
+
+    if formats is not None:
+        for t in formats.keys():
+            if t not in slots:
+                raise ValueError(f"No tag {t} for binary format")
+        bts = tuple(formats.keys())
+        attrs['_BINARY_TAGS'] = bts
+        attrs['_BINARY'] = struct.Struct('<' + ''.join([formats[t] for t in bts]))
+        attrs['_STRINGS'] = tuple([formats[t].endswith('s') for t in bts])
+        attrs['_FORMATS'] = tuple([formats[t] for t in bts])
+
+    return type(name, (Event,), attrs)
@@ -0,0 +1,66 @@
+# Decimation filters for oversampled analogue channels
+#
+# Copyright (C) 2023 Simon Dobson
+#
+# This file is part of whether, a modular IoT weather station
+#
+# whether is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# whether is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with whether. If not, see <http://www.gnu.org/licenses/gpl.html>.
+
+# NumPy is optional: we use it to process blocks when it's available
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+def boxcar(block):
+    '''Decimate a block of readings to a single reading by
+    averaging them (a boxcar filter).
+
+    :param block: an array of unsigned 16-bit readings
+    :returns: the mean reading, as an integer'''
+    n = len(block)
+    if n == 0:
+        raise ValueError("Can't decimate an empty block")
+    if numpy is not None:
+        return int(numpy.frombuffer(block, dtype=numpy.uint16).mean())
+    else:
+        return sum(block) // n
+
+
+def majority(block, lut, shift, n):
+    '''Decimate a block of readings by majority vote. Each reading is
+    first classified through a lookup table, and the most common
+    class wins. Ties go to the lower class.
+
+    :param block: an array of unsigned 16-bit readings
+    :param lut: an array of unsigned bytes mapping codes to classes
+    :param shift: the shift that turns a reading into a code
+    :param n: the number of classes
+    :returns: the winning class'''
+    if len(block) == 0:
+        raise ValueError("Can't decimate an empty block")
+    if numpy is not None:
+        codes = numpy.frombuffer(block, dtype=numpy.uint16) >> shift
+        classes = numpy.frombuffer(lut, dtype=numpy.uint8)[codes]
+        return int(numpy.bincount(classes, minlength=n).argmax())
+    else:
+        counts = [0] * n
+        for r in block:
+            counts[lut[r >> shift]] += 1
+        best = 0
+        for i in range(1, n):
+            if counts[i] > counts[best]:
+                best = i
+        return best
@@ -20,13 +20,16 @@
 #import socketpool
 #import adafruit_requests as requests
 import json
+import time
 import asyncio
-import requests
-import paho.mqtt.client as mqtt
-from whether import angleForDirection, modalTagValue, meanTagValue, maxTagValue, logger
+from whether import logger
+from whether.reporter import Reporter
+from whether.mqtt import MQTTConnection
+from whether.payloads import JSONCodec
+from whether.deadband import Deadband
 
 
-class HomeAssistant:
+class HomeAssistant(Reporter):
     '''Reporter for uploading data to a Home Assistant server over MQTT.
 
     :param server: the MQTT server
@@ -35,228 +38,340 @@ class HomeAssistant:
     :param topic: topic to publish data to
     :param sensors: dict mapping keys to sensors
     :param period: (optional) reporting period in seconds (defaults to 60s)
+    :param port: (optional) the MQTT server port (defaults to 1883)
+    :param timeout: (optional) time allowed for connecting in seconds (defaults to 10s)
+    :param backoff: (optional) initial delay between connection attempts in seconds (defaults to 5s)
+    :param maxBackoff: (optional) maximum delay between connection attempts in seconds (defaults to 5m)
+    :param outbox: (optional) an :class:`Outbox` to hold payloads until they're acknowledged
+    :param codec: (optional) the payload encoding, which must be JSON (the default)
+    :param perField: (optional) publish fields by exception on their own topics (defaults to False)
+    :param deadbands: (optional) dict mapping fields to thresholds, overriding :attr:`DEADBANDS`
+    :param heartbeat: (optional) maximum time between publishing a field in seconds (defaults to 15m)
+
+    The reporter connects to the server in the background when it starts
+    running, over a :class:`MQTTConnection` that reconnects with
+    increasing delays if the server is slow or absent. Sensors therefore don't
+    wait for the server. Payloads are published at QoS 1, and those
+    that fall due while disconnected are queued (up to a limit) and
+    sent on reconnection. If the reporter has an outbox, payloads are
+    instead written to it before being published, and any backlog is
+    replayed from it on reconnection, so they also survive restarts
+    and longer outages.
+
+    The reporter can also be one of the sinks of a :class:`FanOut`,
+    in which case it still needs its sensors to know which discovery
+    messages to issue, but doesn't build payloads itself.
+
+    The discovery messages tell Home Assistant to read fields from
+    the state topic as JSON, so the reporter refuses other codecs:
+    consumers wanting a more compact encoding should be fed by a
+    separate reporter or a :class:`FanOut`.
+
+    The discovery messages are built once from :attr:`ENTITIES` and
+    published retained, so the server keeps them for Home Assistant.
+    On connection the reporter only republishes those the server
+    doesn't hold, or holds in a different form. They're all
+    republished whenever Home Assistant announces that it's come
+    online on :attr:`STATUS_TOPIC`, since it may have lost them.
+
+    Alternatively the reporter can publish each field of the payload
+    on its own topic, and only when it has moved by more than its
+    deadband or when the heartbeat interval has passed since it was
+    last published. Fields are published retained, as plain values,
+    so Home Assistant always has the last value. On calm days most
+    periods then publish little or nothing. Field messages are
+    not kept in the outbox, as only the latest value matters.
+
+    The health of sensors protected by a :class:`CircuitBreaker` can
+    be published too, as an entity per sensor whose state is the
+    breaker's state, published retained whenever it changes.
     '''
 
-    # Sensor type keys
-    TEMPERATURE = "t"        #: Temperature sensor.
-    HUMIDITY = "h"           #: Humidity sensor
-    WINDSPEED = "ws"         #: Windspeed sensor.
-    WINDDIRECTION = "wd"     #: Wind direction sensor.
-    RAININTENSITY = "r"      #: Rain gauge.
-    BATTERY = "b"            #: Battery.
-    CPU = 'c'                #: CPU.
+    #: Default deadbands for fields when publishing by exception.
+    DEADBANDS = dict(temperature=0.2,
+                     humidity=1,
+                     wind_speed=0.5,
+                     wind_speed_gust=0.5,
+                     wind_dir=0,
+                     wind_dir_deg=0,
+                     rainfall=0.1,
+                     battery_charge=1,
+                     battery_temp=0.5,
+                     battery_voltage=20,
+                     battery_current=20,
+                     cpu_temp=1,
+                     cpu_wifi=3,
+                     power_tier=0)
+
+    #: Entities for each sensor type, as (object id, payload field,
+    #: configuration) triples. The unique id and state topic are added
+    #: when the discovery messages are built.
+    ENTITIES = {
+        Reporter.TEMPERATURE: [("temperature", "temperature",
+                                dict(name="Temperature", device_class="temperature",
+                                     unit_of_measurement="°C"))],
+        Reporter.HUMIDITY: [("humidity", "humidity",
+                             dict(name="Humidity", device_class="humidity",
+                                  unit_of_measurement="%"))],
+        Reporter.WINDSPEED: [("windspeed", "wind_speed",
+                              dict(name="Wind speed", device_class="wind_speed",
+                                   unit_of_measurement="m/s")),
+                             ("windgust", "wind_speed_gust",
+                              dict(name="Wind speed gust", device_class="wind_speed",
+                                   unit_of_measurement="m/s"))],
+        # no device_class entries to capture generic information
+        Reporter.WINDDIRECTION: [("winddir", "wind_dir",
+                                  dict(name="Wind direction (cardinal)")),
+                                 ("winddeg", "wind_dir_deg",
+                                  dict(name="Wind direction (degrees)",
+                                       unit_of_measurement="°"))],
+        Reporter.RAININTENSITY: [("rainfall", "rainfall",
+                                  dict(name="Rainfall", device_class="precipitation_intensity",
+                                       unit_of_measurement="mm/h"))],
+        Reporter.BATTERY: [("battery", "battery_charge",
+                            dict(name="Battery", device_class="battery",
+                                 unit_of_measurement="%")),
+                           ("batterytemp", "battery_temp",
+                            dict(name="Battery temperature", device_class="temperature",
+                                 unit_of_measurement="C")),
+                           ("batteryvoltage", "battery_voltage",
+                            dict(name="Battery voltage", device_class="voltage",
+                                 unit_of_measurement="mV")),
+                           ("batterycurrent", "battery_current",
+                            dict(name="Battery current", device_class="current",
+                                 unit_of_measurement="mA"))],
+        Reporter.CPU: [("cputemp", "cpu_temp",
+                        dict(name="CPU temperature", device_class="temperature",
+                             unit_of_measurement="C")),
+                       ("cpuwifi", "cpu_wifi",
+                        dict(name="Wifi signal strength"))],
+        Reporter.POWER: [("powertier", "power_tier",
+                          dict(name="Power tier"))]}
+
+    DISCOVERY_PREFIX = "homeassistant"          #: Topic prefix for discovery messages.
+    STATUS_TOPIC = "homeassistant/status"       #: Topic for Home Assistant's status.
+    STATUS_ONLINE = b"online"                   #: Status payload when Home Assistant starts.
+    DISCOVERY_WAIT = 2                          #: Time to wait for retained discovery messages in seconds.
 
 
     def __init__(self, server, username, password, topic,
-                 sensors, period = 60):
-        super().__init__()
+                 sensors, period = 60, port = 1883,
+                 timeout = 10, backoff = 5, maxBackoff = 300,
+                 outbox = None, codec = None,
+                 perField = False, deadbands = None, heartbeat = 15 * 60):
         self._server = server
         self._username = username
         self._password = password
         self._topic = topic
-        self._sensors = sensors
-        self._period = period
-        self._payload = []
-
-        # connect to MQTT
-        self._mqttClient()
-
-        # build the component callback list
-        self._makePayloadConstructor()
+        self._discovery = []
+        self._breakers = []
+        self._connecting = None
+        self._checking = None
+        self._outbox = outbox
+        if codec is None:
+            codec = JSONCodec()
+        elif not isinstance(codec, JSONCodec):
+            raise ValueError("Home Assistant needs JSON payloads, not {c}".format(c=type(codec).__name__))
+        self._codec = codec
+
+        # deadbands for publishing fields by exception
+        self._deadbands = None
+        self._heartbeat = heartbeat
+        if perField:
+            ts = dict(self.DEADBANDS)
+            if deadbands is not None:
+                ts.update(deadbands)
+            self._deadbands = dict()
+            for (f, t) in ts.items():
+                self._deadbands[f] = Deadband(t, heartbeat)
+
+        # the connection to the server
+        self._mqtt = MQTTConnection(server, username, password, port=port,
+                                    timeout=timeout, backoff=backoff, maxBackoff=maxBackoff)
+        self._mqtt.addConnectCallback(self.checkDiscovery)
+        self._mqtt.addConnectCallback(self.publishHealth)
+        self._mqtt.subscribe(self.STATUS_TOPIC, self.status)
+        if outbox is not None:
+            self._mqtt.addConnectCallback(self.replay)
+
+        # build the component callback list and discovery messages
+        super().__init__(sensors, period)
 
     def _makePayloadConstructor(self):
         '''Create the sensor components.
 
         This installs the event handlers for the sensors we have
-        installed, and issues MQTT discovery messages for them.'''
-        if self.TEMPERATURE in self._sensors:
-            self._payload.append((self._sensors[self.TEMPERATURE], self.temperature))
-            self._client.publish("homeassistant/sensor/temperature/config",
-                                 json.dumps(dict(name="Temperature",
-                                                 unique_id="whether-temperature",
-                                                 device_class="temperature",
-                                                 unit_of_measurement="°C",
-                                                 value_template="{{ value_json.temperature }}",
-                                                 state_topic=self._topic)))
-
-        if self.HUMIDITY in self._sensors:
-            self._payload.append((self._sensors[self.HUMIDITY], self.humidity))
-            self._client.publish("homeassistant/sensor/humidity/config",
-                                 json.dumps(dict(name="Humidity",
-                                                 unique_id="whether-humidity",
-                                                 device_class="humidity",
-                                                 unit_of_measurement="%",
-                                                 value_template="{{ value_json.humidity }}",
-                                                 state_topic=self._topic)))
-
-        if self.WINDSPEED in self._sensors:
-            self._payload.append((self._sensors[self.WINDSPEED], self.windspeed))
-            self._client.publish("homeassistant/sensor/windspeed/config",
-                                 json.dumps(dict(name="Wind speed",
-                                                 unique_id="whether-windspeed",
-                                                 device_class="wind_speed",
-                                                 unit_of_measurement="m/s",
-                                                 value_template="{{ value_json.wind_speed }}",
-                                                 state_topic=self._topic)))
-            self._client.publish("homeassistant/sensor/windgust/config",
-                                 json.dumps(dict(name="Wind speed gust",
-                                                 unique_id="whether-windgust",
-                                                 device_class="wind_speed",
-                                                 unit_of_measurement="m/s",
-                                                 value_template="{{ value_json.wind_speed_gust }}",
-                                                 state_topic=self._topic)))
-
-        if self.WINDDIRECTION in self._sensors:
-            self._payload.append((self._sensors[self.WINDDIRECTION], self.windDirection))
-
-            # no device_class entries to capture generic information
-            self._client.publish("homeassistant/sensor/winddir/config",
-                                 json.dumps(dict(name="Wind direction (cardinal)",
-                                                 unique_id="whether-winddir",
-                                                 value_template="{{ value_json.wind_dir }}",
-                                                 state_topic=self._topic)))
-            self._client.publish("homeassistant/sensor/winddeg/config",
-                                 json.dumps(dict(name="Wind direction (degrees)",
-                                                 unique_id="whether-winddeg",
-                                                 unit_of_measurement="°",
-                                                 value_template="{{ value_json.wind_dir_deg }}",
-                                                 state_topic=self._topic)))
-
-        if self.RAININTENSITY in self._sensors:
-            self._payload.append((self._sensors[self.RAININTENSITY], self.rainfall))
-            self._client.publish("homeassistant/sensor/rainfall/config",
-                                 json.dumps(dict(name="Rainfall",
-                                                 unique_id="whether-rainfall",
-                                                 device_class="precipitation_intensity",
-                                                 unit_of_measurement="mm/h",
-                                                 value_template="{{ value_json.rainfall }}",
-                                                 state_topic=self._topic)))
-        if self.BATTERY in self._sensors:
-            self._payload.append((self._sensors[self.BATTERY], self.battery))
-            self._client.publish("homeassistant/sensor/battery/config",
-                                 json.dumps(dict(name="Battery",
-                                                 unique_id="whether-battery",
-                                                 device_class="battery",
-                                                 unit_of_measurement="%",
-                                                 value_template="{{ value_json.battery_charge }}",
-                                                 state_topic=self._topic)))
-            self._client.publish("homeassistant/sensor/batterytemp/config",
-                                 json.dumps(dict(name="Battery temperature",
-                                                 unique_id="whether-batterytemp",
-                                                 device_class="temperature",
-                                                 unit_of_measurement="C",
-                                                 value_template="{{ value_json.battery_temp }}",
-                                                 state_topic=self._topic)))
-            self._client.publish("homeassistant/sensor/batteryvoltage/config",
-                                 json.dumps(dict(name="Battery voltage",
-                                                 unique_id="whether-batteryvoltage",
-                                                 device_class="voltage",
-                                                 unit_of_measurement="mV",
-                                                 value_template="{{ value_json.battery_voltage }}",
-                                                 state_topic=self._topic)))
-            self._client.publish("homeassistant/sensor/batterycurrent/config",
-                                 json.dumps(dict(name="Battery current",
-                                                 unique_id="whether-batterycurrent",
-                                                 device_class="current",
-                                                 unit_of_measurement="mA",
-                                                 value_template="{{ value_json.battery_current }}",
-                                                 state_topic=self._topic)))
-
-        if self.CPU in self._sensors:
-            self._payload.append((self._sensors[self.CPU], self.cpu))
-            self._client.publish("homeassistant/sensor/cputemp/config",
-                                 json.dumps(dict(name="CPU temperature",
-                                                 unique_id="whether-cputemp",
-                                                 device_class="temperature",
-                                                 unit_of_measurement="C",
-                                                 value_template="{{ value_json.cpu_temp }}",
-                                                 state_topic=self._topic)))
-            self._client.publish("homeassistant/sensor/cpuwifi/config",
-                                 json.dumps(dict(name="Wifi signal strength",
-                                                 unique_id="whether-cpuwifi",
-                                                 value_template="{{ value_json.cpu_wifi }}",
-                                                 state_topic=self._topic)))
-
-    def _mqttClient(self):
-        '''Connect to the MQTT server.'''
-        self._client = mqtt.Client()
-        self._client.username_pw_set(username=self._username,
-                                     password=self._password)
-        logger.debug(f"MQTT {self._server}, username {self._username}, password {self._password}")
-        self._client.connect(self._server, port=1883)
-
-    def period(self):
-        return self._period
-
-    def temperature(self, t, payload):
-        d = meanTagValue(t.events(), t.TEMPERATURE)
-        payload['temperature'] = d
-
-    def humidity(self, h, payload):
-        d = meanTagValue(h.events(), h.HUMIDITY)
-        payload['humidity'] = d
-
-    def windspeed(self, ws, payload):
-        d = meanTagValue(ws.events(), ws.WINDSPEED)
-        g = maxTagValue(ws.events(), ws.WINDSPEED)
-        payload['wind_speed'] = d
-        payload['wind_speed_gust'] = g
-
-    def windDirection(self, wd, payload):
-        d = modalTagValue(wd.events(), wd.DIRECTION)
-        payload['wind_dir'] = d
-        payload['wind_dir_deg'] = angleForDirection(d)
-
-    def rainfall(self, rg, payload):
-        d = meanTagValue(rg.events(), rg.RAININTENSITY)
-        payload['rainfall'] = d
-
-    def battery(self, rg, payload):
-        c = meanTagValue(rg.events(), rg.BATTERY_CHARGE_PERCENTAGE)
-        t = meanTagValue(rg.events(), rg.BATTERY_TEMPERATURE)
-        v = meanTagValue(rg.events(), rg.BATTERY_VOLTAGE)
-        a = meanTagValue(rg.events(), rg.BATTERY_CURRENT)
-        payload['battery_charge'] = c
-        payload['battery_temp'] = t
-        payload['battery_voltage'] = v
-        payload['battery_current'] = a
-
-    def cpu(self, rg, payload):
-        t = meanTagValue(rg.events(), rg.CPU_TEMPERATURE)
-        s = int(meanTagValue(rg.events(), rg.WIFI_SIGNAL_STRENGTH))
-        payload['cpu_temp'] = t
-        payload['cpu_wifi'] = s
-
-    def payload(self):
-        '''Create the payload for the upload.
-
-        :returns: a dict'''
-        payload = dict()
-        for (s, f) in self._payload:
-            f(s, payload)
-        return payload
-
-    def reset(self):
-        '''Discard events on component event queues.'''
-        for (s, _) in self._payload:
-            s.events().reset()
+        installed, and creates the MQTT discovery messages for them
+        from :attr:`ENTITIES`.'''
+        super()._makePayloadConstructor()
+        for (k, es) in self.ENTITIES.items():
+            if k in self._sensors:
+                for (id, field, config) in es:
+                    self._addDiscovery(id, field, **config)
+
+    def fieldTopic(self, field):
+        '''Return the topic for publishing a single field.
+
+        :param field: the payload field
+        :returns: the topic'''
+        return "{t}/{f}".format(t=self._topic, f=field)
+
+    def _addDiscovery(self, id, field, **config):
+        '''Add a discovery message for a payload field, taking its
+        value either from the state topic or from the field's own topic.
+        The message is encoded once, here, and the bytes re-used
+        whenever it's published.
+
+        :param id: the entity's object id
+        :param field: the payload field
+        :param config: the rest of the configuration'''
+        config = dict(config)
+        config['unique_id'] = "whether-{id}".format(id=id)
+        if self._deadbands is None:
+            config['value_template'] = "{{{{ value_json.{f} }}}}".format(f=field)
+            config['state_topic'] = self._topic
+        else:
+            config['state_topic'] = self.fieldTopic(field)
+        topic = "{p}/sensor/{id}/config".format(p=self.DISCOVERY_PREFIX, id=id)
+        self._discovery.append((topic, json.dumps(config).encode()))
+
+    def healthTopic(self, id):
+        '''Return the topic for publishing a sensor's health.
+
+        :param id: the sensor id
+        :returns: the topic'''
+        return "{t}/health/{id}".format(t=self._topic, id=id)
+
+    def addBreaker(self, breaker):
+        '''Publish the health of a sensor as its circuit breaker
+        changes state. This adds a discovery message for the sensor's
+        health, so should be called before the reporter starts.
+
+        :param breaker: the breaker'''
+        id = breaker.id()
+        topic = self.healthTopic(id)
+        config = dict(name="{id} health".format(id=id),
+                      unique_id="whether-{id}-health".format(id=id),
+                      state_topic=topic)
+        self._discovery.append(("{p}/sensor/{id}-health/config".format(p=self.DISCOVERY_PREFIX, id=id),
+                                json.dumps(config).encode()))
+        breaker.addListener(lambda b, ev: self._mqtt.publish(topic, ev[b.STATE], retain=True))
+        self._breakers.append(breaker)
+
+    def publishHealth(self):
+        '''Publish the health of all the sensors with breakers. This
+        is called on every connection.'''
+        for b in self._breakers:
+            self._mqtt.publish(self.healthTopic(b.id()), b.state(), retain=True)
+
+    def connection(self):
+        '''Return the connection to the MQTT server.
+
+        :returns: the connection'''
+        return self._mqtt
+
+    def connected(self):
+        '''Test whether we're connected to the server.
+
+        :returns: True if connected'''
+        return self._mqtt.connected()
+
+    def discovery(self):
+        '''Return the discovery messages.
+
+        :returns: a list of (topic, encoded configuration) pairs'''
+        return self._discovery
+
+    def discover(self):
+        '''Issue all the discovery messages, retained.'''
+        for (topic, config) in self._discovery:
+            self._mqtt.publish(topic, config, retain=True)
+        logger.info("MQTT published {n} discovery messages".format(n=len(self._discovery)))
+
+    def checkDiscovery(self):
+        '''Check the server's retained discovery messages in the
+        background. This is called on every connection.'''
+        self._checking = asyncio.create_task(self._checkDiscovery())
+
+    async def _checkDiscovery(self):
+        '''Republish any discovery messages that the server hasn't
+        retained, or whose retained copies differ from ours.
+
+        We subscribe to our discovery topics, collect the retained
+        messages the server sends back within :attr:`DISCOVERY_WAIT`,
+        and then unsubscribe again.'''
+        retained = dict()
+        def record(topic, payload, r):
+            if r:
+                retained[topic] = payload
+
+        for (topic, _) in self._discovery:
+            self._mqtt.subscribe(topic, record)
+        await asyncio.sleep(self.DISCOVERY_WAIT)
+        for (topic, _) in self._discovery:
+            self._mqtt.unsubscribe(topic)
+
+        n = 0
+        for (topic, config) in self._discovery:
+            if retained.get(topic) != config:
+                self._mqtt.publish(topic, config, retain=True)
+                n += 1
+        logger.info("MQTT republished {n} of {m} discovery messages".format(n=n, m=len(self._discovery)))
+
+    def status(self, topic, payload, retained):
+        '''Handle a status message from Home Assistant, re-issuing the
+        discovery messages when it comes online. Retained status
+        messages are ignored, as they don't mark a restart.
+
+        :param topic: the topic
+        :param payload: the payload
+        :param retained: True if the message was retained'''
+        if not retained and payload == self.STATUS_ONLINE:
+            logger.info("Home Assistant came online")
+            self.discover()
+
+    def replay(self):
+        '''Start replaying any backlog of payloads from the outbox.'''
+        self._outbox.startReplay(self._mqtt)
 
     def submit(self, payload):
         '''Submit the readings to the MQTT server.
 
         :param payload: the payload
         '''
-        logger.info(f"MQTT submitting {payload}")
-        self._client.publish(self._topic, json.dumps(payload))
-
-    async def run(self):
-        while True:
-            # wait for the next sample submission
-            await asyncio.sleep(self.period())
-
-            # send the data
-            payload = self.payload()
-            self.submit(payload)
-
-            # reset the event queues
-            self.reset()
+        if self._deadbands is not None:
+            self.submitFields(payload)
+            return
+
+        logger.info("MQTT submitting %s", payload)
+        data = self._codec.encode(payload)
+        if self._outbox is None:
+            self._mqtt.publish(self._topic, data)
+        else:
+            self._outbox.submit(self._mqtt, self._topic, data)
+
+    def submitFields(self, payload):
+        '''Submit the fields of the payload that have changed by
+        more than their deadbands, or whose heartbeats are due.
+        Fields without values are skipped, leaving their last values
+        retained on the server.
+
+        :param payload: the payload'''
+        now = time.monotonic()
+        n = 0
+        for (f, v) in payload.items():
+            if v is None:
+                continue
+            db = self._deadbands.get(f)
+            if db is None:
+                db = self._deadbands[f] = Deadband(0, self._heartbeat)
+            if db.due(v, now):
+                self._mqtt.publish(self.fieldTopic(f), str(v), retain=True)
+                db.reported(v, now)
+                n += 1
+        logger.info("MQTT submitted {n} of {m} fields".format(n=n, m=len(payload)))
+
+    def start(self):
+        '''Start connecting to the server in the background.'''
+        # keep a reference to the task
+        self._connecting = asyncio.create_task(self._mqtt.run())
@@ -0,0 +1,123 @@
+# Host metrics
+#
+# Copyright (C) 2023 Simon Dobson
+#
+# This file is part of whether, a modular IoT weather station
+#
+# whether is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# whether is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with whether. If not, see <http://www.gnu.org/licenses/gpl.html>.
+
+import os
+import re
+from whether import SysfsSampler, eventClass
+
+
+class Host(SysfsSampler):
+    '''Driver for the metrics of the Linux host the station runs on.
+
+    :param id: sensor identifier
+    :param ring: the ring buffer
+    :param period: the sampling perdiod in seconds
+    :param disk: (optional) a path on the filesystem to monitor (defaults to /)
+    '''
+
+    LOAD_FILE = "/proc/loadavg"                                             #: File for the load average.
+    MEMORY_FILE = "/proc/meminfo"                                           #: File for memory information.
+    CPU_FREQUENCY_FILE = "/sys/devices/system/cpu/cpu0/cpufreq/scaling_cur_freq"   #: File for the CPU clock.
+
+    LOAD = "load"                          #: Event tag for the one-minute load average.
+    MEMORY_AVAILABLE = "memavail"          #: Event tag for available memory in kB.
+    MEMORY_USED_PERCENTAGE = "memused"     #: Event tag for the percentage of memory in use.
+    CPU_FREQUENCY = "cpufreq"              #: Event tag for CPU clock frequency in MHz.
+    DISK_FREE_PERCENTAGE = "diskfree"      #: Event tag for the percentage of the disk that's free.
+
+    #: Event class.
+    EVENT = eventClass("HostEvent",
+                       [SysfsSampler.TIMESTAMP, SysfsSampler.ID,
+                        LOAD, MEMORY_AVAILABLE, MEMORY_USED_PERCENTAGE,
+                        CPU_FREQUENCY, DISK_FREE_PERCENTAGE],
+                       {SysfsSampler.TIMESTAMP: 'd',
+                        LOAD: 'f',
+                        MEMORY_AVAILABLE: 'd',
+                        MEMORY_USED_PERCENTAGE: 'f',
+                        CPU_FREQUENCY: 'f',
+                        DISK_FREE_PERCENTAGE: 'f'})
+
+    # Patterns for parsing the files
+    _LOAD = re.compile(rb'^(\d+\.\d+)')
+    _MEMORY_TOTAL = re.compile(rb'^MemTotal:\s+(\d+)', re.M)
+    _MEMORY_AVAILABLE = re.compile(rb'^MemAvailable:\s+(\d+)', re.M)
+    _FREQUENCY = re.compile(rb'^(\d+)')
+
+    def __init__(self, id, ring, period = 1, disk = "/"):
+        super().__init__(id, ring, period)
+        self._disk = disk
+        self.openFile(self.LOAD_FILE)
+        self.openFile(self.MEMORY_FILE)
+        self.openFile(self.CPU_FREQUENCY_FILE)
+
+    def sampleLoad(self):
+        '''Return the one-minute load average.
+
+        :returns: the load average'''
+        m = self.matchFile(self.LOAD_FILE, self._LOAD)
+        if m is not None:
+            return float(m.group(1))
+        return None
+
+    def sampleMemory(self):
+        '''Return the available memory and the percentage of
+        memory in use.
+
+        :returns: a pair of available memory in kB and percentage used'''
+        contents = self.readFile(self.MEMORY_FILE)
+        if contents is not None:
+            mt = self._MEMORY_TOTAL.search(contents)
+            ma = self._MEMORY_AVAILABLE.search(contents)
+            if mt is not None and ma is not None:
+                total = int(mt.group(1))
+                available = int(ma.group(1))
+                return (available, 100 * (total - available) / total)
+        return (None, None)
+
+    def sampleFrequency(self):
+        '''Return the current CPU clock frequency.
+
+        :returns: the frequency in MHz'''
+        m = self.matchFile(self.CPU_FREQUENCY_FILE, self._FREQUENCY)
+        if m is not None:
+            return int(m.group(1)) / 1000
+        return None
+
+    def sampleDisk(self):
+        '''Return the percentage of the disk that's free.
+
+        :returns: the free percentage'''
+        try:
+            st = os.statvfs(self._disk)
+        except OSError:
+            return None
+        if st.f_blocks == 0:
+            return None
+        return 100 * st.f_bavail / st.f_blocks
+
+    def sample(self):
+        '''Take a sample.
+
+        :returns: a dict'''
+        (ma, mu) = self.sampleMemory()
+        return {self.LOAD: self.sampleLoad(),
+                self.MEMORY_AVAILABLE: ma,
+                self.MEMORY_USED_PERCENTAGE: mu,
+                self.CPU_FREQUENCY: self.sampleFrequency(),
+                self.DISK_FREE_PERCENTAGE: self.sampleDisk()}
@@ -0,0 +1,225 @@
+# Lazy logging with a batched, asynchronous sink
+#
+# Copyright (C) 2023 Simon Dobson
+#
+# This file is part of whether, a modular IoT weather station
+#
+# whether is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# whether is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with whether. If not, see <http://www.gnu.org/licenses/gpl.html>.
+
+import sys
+import time
+import asyncio
+from collections import deque
+import adafruit_logging as logging
+
+
+def formatMessage(record):
+    '''Return the message of a record with its arguments filled in.
+
+    :param record: the record
+    :returns: the message'''
+    if record.args:
+        try:
+            return record.msg % record.args
+        except (TypeError, ValueError):
+            return "{m} {a}".format(m=record.msg, a=record.args)
+    return record.msg
+
+
+class LazyLogger(logging.Logger):
+    '''A logger that doesn't format messages that won't be logged.
+
+    The standard logger fills in a message's arguments before checking
+    its level, so even suppressed debug messages cost a formatting.
+    This logger checks the level first. Messages that are logged are
+    handed unformatted to :class:`BatchedHandler` handlers, which format
+    them later in the background; other handlers get them formatted
+    as usual.
+
+    Arguments are formatted after the call returns, so they mustn't be
+    changed afterwards: pass copies of anything, such as events in
+    pre-allocated slots, that's going to be re-used.
+
+    :param name: the logger name
+    :param level: (optional) the log level (defaults to WARNING)
+    '''
+
+    def __init__(self, name, level = logging.WARNING):
+        super().__init__(name, level)
+        self._lazy = False
+
+    def addHandler(self, hdlr):
+        super().addHandler(hdlr)
+        self._lazy = all([isinstance(h, BatchedHandler) for h in self._handlers])
+
+    def removeHandler(self, hdlr):
+        super().removeHandler(hdlr)
+        self._lazy = len(self._handlers) > 0 and all([isinstance(h, BatchedHandler) for h in self._handlers])
+
+    def _log(self, level, msg, *args):
+        if level < self._level:
+            return
+        record = logging.LogRecord(self.name, level, logging._level_for(level),
+                                   msg, time.monotonic(), args)
+        self.handle(record)
+
+    def handle(self, record):
+        if self._lazy:
+            for h in self._handlers:
+                if record.levelno >= h.level:
+                    h.emit(record)
+        else:
+            super().handle(record._replace(msg=formatMessage(record)))
+
+
+class BatchedHandler(logging.Handler):
+    '''A log handler that writes records in batches from a background task.
+
+    Emitting a record just appends it to a bounded queue: records
+    arriving when the queue is full are counted and discarded. Every
+    interval the queue is drained, the records formatted, and the lot
+    written in a single write from a thread, so that slow storage such
+    as an SD card doesn't stall the event loop.
+
+    Repeats within a batch, being the same message with the same
+    arguments, are rate-limited: the first few are written and the rest
+    are summarised by a single line giving their number.
+
+    If the log file can't be written (because the disk is full, say)
+    the batch goes to standard error instead, and the lines that
+    missed the file are counted. Logging never stops the station.
+
+    :param filename: (optional) the file to append to (defaults to standard error)
+    :param interval: (optional) the time between batches in seconds (defaults to 1s)
+    :param maxRecords: (optional) the maximum number of queued records (defaults to 1000)
+    :param maxRepeats: (optional) the number of repeats written before summarising (defaults to 1)
+    :param level: (optional) the handler's level (defaults to all records)
+    '''
+
+    def __init__(self, filename = None, interval = 1, maxRecords = 1000, maxRepeats = 1,
+                 level = logging.NOTSET):
+        super().__init__(level)
+        self._filename = filename
+        self._interval = interval
+        self._maxRecords = maxRecords
+        self._maxRepeats = maxRepeats
+        self._queue = deque()
+        self._overflow = 0
+        self._dropped = 0
+
+    def emit(self, record):
+        '''Queue a record.
+
+        :param record: the record'''
+        if len(self._queue) >= self._maxRecords:
+            self._overflow += 1
+        else:
+            self._queue.append(record)
+
+    def dropped(self):
+        '''Return the number of lines that couldn't be written to the log file.
+
+        :returns: the number of lines'''
+        return self._dropped
+
+    def pending(self):
+        '''Return the number of records waiting to be written.
+
+        :returns: the number of records'''
+        return len(self._queue)
+
+    def _line(self, record, msg):
+        '''Format a line of the log.
+
+        :param record: the record
+        :param msg: the message
+        :returns: the line'''
+        return "{t:<0.3f}: {l} - {m}".format(t=record.created, l=record.levelname, m=msg)
+
+    def batch(self):
+        '''Drain the queue into a batch of text, summarising repeats.
+
+        :returns: the text, which is empty if there was nothing queued'''
+        lines = []
+        repeats = dict()     # key -> [record, number of repeats]
+        while len(self._queue) > 0:
+            record = self._queue.popleft()
+            try:
+                key = (record.levelno, record.msg, record.args)
+                r = repeats.get(key)
+            except TypeError:
+                # unhashable arguments, so can't be summarised
+                key, r = None, None
+            if r is None:
+                if key is not None:
+                    repeats[key] = [record, 1]
+            else:
+                r[1] += 1
+                if r[1] > self._maxRepeats:
+                    continue
+            lines.append(self._line(record, formatMessage(record)))
+
+        # summarise the repeats we didn't write
+        for (record, n) in repeats.values():
+            if n > self._maxRepeats:
+                lines.append(self._line(record, "{m} (repeated {n} times)".format(m=formatMessage(record),
+                                                                                  n=n)))
+        if self._overflow > 0:
+            lines.append("{t:<0.3f}: WARNING - {n} log records discarded".format(t=time.monotonic(),
+                                                                                n=self._overflow))
+            self._overflow = 0
+
+        if len(lines) == 0:
+            return ""
+        return "\n".join(lines) + "\n"
+
+    def _write(self, text):
+        '''Write text to the log, falling back to standard error
+        if the log file can't be written.
+
+        :param text: the text'''
+        if self._filename is not None:
+            try:
+                with open(self._filename, 'a') as fh:
+                    fh.write(text)
+                return
+            except OSError as e:
+                self._dropped += text.count("\n")
+                text = "{t:<0.3f}: WARNING - Can't write log to {f} ({n} lines missed): {e}\n".format(t=time.monotonic(),
+                                                                                                      f=self._filename,
+                                                                                                      n=self._dropped,
+                                                                                                      e=e) + text
+        try:
+            sys.stderr.write(text)
+            sys.stderr.flush()
+        except (OSError, ValueError):
+            # nowhere left to log to
+            pass
+
+    def flush(self):
+        '''Write any queued records immediately.'''
+        text = self.batch()
+        if len(text) > 0:
+            self._write(text)
+
+    async def run(self):
+        try:
+            while True:
+                await asyncio.sleep(self._interval)
+                text = self.batch()
+                if len(text) > 0:
+                    await asyncio.to_thread(self._write, text)
+        finally:
+            # don't lose the last records
+            self.flush()
@@ -0,0 +1,317 @@
+# Shared MCP3008 analogue-to-digital converter
+#
+# Copyright (C) 2023 Simon Dobson
+#
+# This file is part of whether, a modular IoT weather station
+#
+# whether is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# whether is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with whether. If not, see <http://www.gnu.org/licenses/gpl.html>.
+
+import time
+import asyncio
+from array import array
+import board
+import busio
+import digitalio
+from adafruit_bus_device.spi_device import SPIDevice
+from whether import Sampler, logger
+from whether.filters import boxcar
+
+
+class MCP3008Bus:
+    '''A shared MCP3008 analogue-to-digital converter on an SPI bus.
+
+    The bus owns the SPI interface and the ADC, and any number of
+    :class:`AnalogueSampler` objects can register a channel with
+    it. When running, the bus sweeps the channels of the samplers
+    whose periods have elapsed once per tick, holding the bus lock
+    for the whole sweep so that the conversions happen in a single
+    burst of transactions, and then hands them the readings. A
+    sampler that's suspended, or whose circuit breaker is open, is
+    left out, and its channel isn't read unless another sampler
+    needs it.
+
+    Samplers can ask for a channel to be oversampled, in which case
+    the sweep takes a block of readings from it in a single burst
+    for the sampler to decimate.
+
+    Readings are reported in the same 16-bit range as
+    :class:`adafruit_mcp3xxx.analog_in.AnalogIn`, so calibrations
+    taken with that class remain valid.
+
+    :param cs: the chip select pin for the SPI device
+    :param tick: (optional) the sweep period in seconds (defaults to 1s)
+    :param spi: (optional) the SPI bus (defaults to SPI0)
+    :param baudrate: (optional) the SPI clock rate (defaults to 100kHz)
+    '''
+
+    CHANNELS = 8     #: Number of single-ended channels on the MCP3008.
+
+
+    def __init__(self, cs, tick = 1, spi = None, baudrate = 100000):
+        if spi is None:
+            spi = busio.SPI(clock=board.SCK, MISO=board.MISO, MOSI=board.MOSI)
+        self._spi = spi
+        self._tick = tick
+
+        # we drive chip select ourselves, so that we can take
+        # several conversions while holding the bus
+        self._cs = digitalio.DigitalInOut(cs)
+        self._cs.switch_to_output(value=True)
+        self._device = SPIDevice(spi, None, baudrate=baudrate)
+
+        # transfer buffers, re-used for every conversion
+        self._out = bytearray(3)
+        self._out[0] = 0x01
+        self._in = bytearray(3)
+
+        # registered channels, their latest readings, and
+        # blocks of readings for oversampled channels
+        self._channels = []
+        self._samplers = []
+        self._due = []
+        self._readings = array('H', [0] * self.CHANNELS)
+        self._blocks = dict()
+        self._sweeper = None
+
+    def tick(self):
+        '''Return the sweep period.
+
+        :returns: the period in seconds'''
+        return self._tick
+
+    def register(self, s):
+        '''Register a sampler with the bus. The sampler's
+        channel will be read as part of every sweep.
+
+        :param s: the sampler'''
+        ch = s.channel()
+        if ch < 0 or ch >= self.CHANNELS:
+            raise ValueError(f"No channel {ch} on MCP3008")
+        if ch not in self._channels:
+            self._channels.append(ch)
+        self._samplers.append(s)
+        self._due.append(0)
+
+        # allocate the largest block anyone wants for this channel
+        n = s.oversample()
+        if n > 1 and (ch not in self._blocks or len(self._blocks[ch]) < n):
+            self._blocks[ch] = array('H', [0] * n)
+
+    def channels(self):
+        '''Return the channels read in each sweep.
+
+        :returns: a list of channel numbers'''
+        return self._channels
+
+    def _convert(self, spi, ch):
+        '''Perform a single conversion. The bus must be held.
+
+        :param spi: the locked SPI bus
+        :param ch: the channel
+        :returns: the reading'''
+        self._out[1] = 0x80 | (ch << 4)
+        self._cs.value = False
+        spi.write_readinto(self._out, self._in)
+        self._cs.value = True
+        return (((self._in[1] & 0x03) << 8) | self._in[2]) << 6
+
+    def read(self, ch):
+        '''Read a single channel immediately.
+
+        :param ch: the channel
+        :returns: the reading'''
+        with self._device as spi:
+            r = self._convert(spi, ch)
+        self._readings[ch] = r
+        return r
+
+    def readBlock(self, ch):
+        '''Read a block of readings from an oversampled channel
+        immediately.
+
+        :param ch: the channel
+        :returns: the block of readings'''
+        block = self._blocks[ch]
+        with self._device as spi:
+            for i in range(len(block)):
+                block[i] = self._convert(spi, ch)
+        self._readings[ch] = block[-1]
+        return block
+
+    def sweep(self, channels = None):
+        '''Read channels in a single burst, taking a block of
+        readings from each oversampled channel.
+
+        :param channels: (optional) the channels to read (defaults to all those registered)'''
+        if channels is None:
+            channels = self._channels
+        with self._device as spi:
+            for ch in channels:
+                block = self._blocks.get(ch)
+                if block is None:
+                    self._readings[ch] = self._convert(spi, ch)
+                else:
+                    for i in range(len(block)):
+                        block[i] = self._convert(spi, ch)
+                    self._readings[ch] = block[-1]
+
+    def value(self, ch):
+        '''Return the value of a channel. If the bus is running its
+        sweep this is the reading from the latest sweep; otherwise the
+        channel is read directly.
+
+        :param ch: the channel
+        :returns: the reading'''
+        if self._sweeper is None:
+            return self.read(ch)
+        else:
+            return self._readings[ch]
+
+    def block(self, ch):
+        '''Return a block of readings from an oversampled channel.
+        If the bus is running its sweep this is the block from the
+        latest sweep; otherwise the block is read directly. The block
+        is re-used by subsequent reads.
+
+        :param ch: the channel
+        :returns: an array of readings'''
+        if self._sweeper is None:
+            return self.readBlock(ch)
+        else:
+            return self._blocks[ch]
+
+
+    # ---------- Coroutine interface ----------
+
+    async def sweeping(self):
+        '''Coroutine to sweep the channels every tick and pass
+        the readings on to the samplers.'''
+        while True:
+            now = time.monotonic()
+
+            # find the samplers that are due and willing, and their channels
+            ready = []
+            for i in range(len(self._samplers)):
+                if now >= self._due[i]:
+                    s = self._samplers[i]
+                    if s.attempt():
+                        ready.append(i)
+                    else:
+                        self._due[i] = now + s.delay()
+            wanted = [self._samplers[i].channel() for i in ready]
+            channels = [ch for ch in self._channels if ch in wanted]
+
+            if len(channels) > 0:
+                try:
+                    self.sweep(channels)
+                except Exception as err:
+                    logger.error("MCP3008 sweep: {e}".format(e=err))
+                else:
+                    for i in ready:
+                        s = self._samplers[i]
+                        s.takeSample()
+                        self._due[i] = now + s.delay()
+
+            # wait for the next tick
+            await asyncio.sleep(self._tick)
+
+    async def run(self):
+        '''Coroutine to run the bus. This can be awaited by any
+        number of samplers: the sweep is only started once.'''
+        if self._sweeper is None:
+            self._sweeper = asyncio.create_task(self.sweeping())
+        await asyncio.shield(self._sweeper)
+
+
+class AnalogueSampler(Sampler):
+    '''A sampler for a single channel of a shared :class:`MCP3008Bus`.
+
+    Sub-classes override :meth:`convert` to turn a raw reading into
+    the values of an event. Running the sampler runs the bus, which then drives
+    the sampler from its sweeps.
+
+    A sampler can oversample its channel, taking a block of readings
+    every period to reduce noise. By default the block is averaged
+    before conversion: sub-classes can override :meth:`convertBlock`
+    to decimate differently.
+
+    :param id: the sensor's id
+    :param adc: the ADC bus
+    :param ch: the ADC channel
+    :param ring: the ring buffer to receive events
+    :param period: the reporting period
+    :param oversample: (optional) readings to take per sample (defaults to 1)
+    '''
+
+    def __init__(self, id, adc, ch, ring, period = 1, oversample = 1):
+        super().__init__(id, ring, period)
+        if oversample < 1:
+            raise ValueError("Must take at least one reading per sample")
+        self._adc = adc
+        self._channel = ch
+        self._oversample = oversample
+        adc.register(self)
+
+    def adc(self):
+        '''Return the ADC bus this sampler reads from.
+
+        :returns: the bus'''
+        return self._adc
+
+    def channel(self):
+        '''Return the ADC channel this sampler reads.
+
+        :returns: the channel'''
+        return self._channel
+
+    def oversample(self):
+        '''Return the number of readings taken per sample.
+
+        :returns: the oversampling factor'''
+        return self._oversample
+
+    def convert(self, r, ev):
+        '''Convert a raw reading, filling in an event. This method
+        must be overridden by sub-classes.
+
+        :param r: the raw reading
+        :param ev: the event
+        :returns: True if the event was filled in'''
+        raise NotImplementedError("convert")
+
+    def convertBlock(self, block, ev):
+        '''Convert a block of raw readings, filling in an event. The
+        default averages the readings and converts the result.
+
+        :param block: an array of raw readings
+        :param ev: the event
+        :returns: True if the event was filled in'''
+        return self.convert(boxcar(block), ev)
+
+    def sampleInto(self, ev):
+        '''Take a sample from the channel.
+
+        :param ev: the event
+        :returns: True if the event was filled in'''
+        if self._oversample > 1:
+            return self.convertBlock(self._adc.block(self._channel), ev)
+        else:
+            return self.convert(self._adc.value(self._channel), ev)
+
+
+    # ---------- Coroutine interface ----------
+
+    async def run(self):
+        '''Coroutine to run the sampler, by running its bus.'''
+        await self._adc.run()
@@ -0,0 +1,237 @@
+# Internal metrics
+#
+# Copyright (C) 2023 Simon Dobson
+#
+# This file is part of whether, a modular IoT weather station
+#
+# whether is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# whether is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with whether. If not, see <http://www.gnu.org/licenses/gpl.html>.
+
+from bisect import bisect_left
+
+
+class CounterMetric:
+    '''A count that only goes up.
+
+    :param name: the metric name
+    :param labels: a tuple of (label, value) pairs
+    '''
+
+    TYPE = "counter"    #: Prometheus metric type.
+
+
+    def __init__(self, name, labels):
+        self._name = name
+        self._labels = labels
+        self.value = 0
+
+    def inc(self, n = 1):
+        '''Increment the counter.
+
+        :param n: (optional) the increment (defaults to 1)'''
+        self.value += n
+
+    def samples(self):
+        '''Return the samples to expose.
+
+        :returns: a list of (name, labels, value) triples'''
+        return [(self._name, self._labels, self.value)]
+
+
+class GaugeMetric:
+    '''A value that can go up and down. A gauge can instead be given
+    a function, which is called to read the value only when the
+    metrics are exposed.
+
+    :param name: the metric name
+    :param labels: a tuple of (label, value) pairs
+    :param f: (optional) a function returning the value
+    '''
+
+    TYPE = "gauge"      #: Prometheus metric type.
+
+
+    def __init__(self, name, labels, f = None):
+        self._name = name
+        self._labels = labels
+        self._f = f
+        self.value = 0
+
+    def set(self, v):
+        '''Set the gauge.
+
+        :param v: the value'''
+        self.value = v
+
+    def inc(self, n = 1):
+        '''Increment the gauge.
+
+        :param n: (optional) the increment (defaults to 1)'''
+        self.value += n
+
+    def dec(self, n = 1):
+        '''Decrement the gauge.
+
+        :param n: (optional) the decrement (defaults to 1)'''
+        self.value -= n
+
+    def samples(self):
+        '''Return the samples to expose.
+
+        :returns: a list of (name, labels, value) triples'''
+        v = self.value if self._f is None else self._f()
+        return [(self._name, self._labels, v)]
+
+
+class HistogramMetric:
+    '''A distribution of observations in fixed buckets.
+
+    Observations are counted in the first bucket whose upper
+    bound they don't exceed, and the buckets are only made
+    cumulative (as Prometheus expects) when they're exposed.
+
+    :param name: the metric name
+    :param labels: a tuple of (label, value) pairs
+    :param buckets: the sorted upper bounds of the buckets
+    '''
+
+    TYPE = "histogram"  #: Prometheus metric type.
+
+
+    def __init__(self, name, labels, buckets):
+        self._name = name
+        self._labels = labels
+        self._buckets = list(buckets)
+        self._counts = [0] * (len(self._buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, v):
+        '''Record an observation.
+
+        :param v: the value'''
+        self._counts[bisect_left(self._buckets, v)] += 1
+        self.sum += v
+        self.count += 1
+
+    def samples(self):
+        '''Return the samples to expose.
+
+        :returns: a list of (name, labels, value) triples'''
+        ss = []
+        n = 0
+        for (b, c) in zip(self._buckets + ["+Inf"], self._counts):
+            n += c
+            ss.append((self._name + "_bucket", self._labels + (("le", str(b)),), n))
+        ss.append((self._name + "_sum", self._labels, self.sum))
+        ss.append((self._name + "_count", self._labels, self.count))
+        return ss
+
+
+class Metrics:
+    '''A registry of metrics.
+
+    Metrics are created by name, optionally with labels, and asking
+    for the same name and labels again returns the same metric, so
+    code can look up its metrics once and then update them cheaply.
+    The registry can be rendered in the Prometheus text exposition
+    format.
+    '''
+
+    CONTENT_TYPE = "text/plain; version=0.0.4"     #: Content type of the rendered metrics.
+
+    #: Default histogram buckets, in seconds.
+    BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 5, 10)
+
+
+    def __init__(self):
+        self._families = dict()     # name -> (type, help, dict of labels -> metric)
+
+    def _metric(self, cls, name, help, labels, *args):
+        '''Find or create a metric.
+
+        :param cls: the metric class
+        :param name: the metric name
+        :param help: the help text
+        :param labels: a dict of labels, or None
+        :returns: the metric'''
+        ls = () if labels is None else tuple(sorted(labels.items()))
+        family = self._families.get(name)
+        if family is None:
+            family = self._families[name] = (cls.TYPE, help, dict())
+        elif family[0] != cls.TYPE:
+            raise ValueError("Metric {n} is already a {t}".format(n=name, t=family[0]))
+        m = family[2].get(ls)
+        if m is None:
+            m = family[2][ls] = cls(name, ls, *args)
+        return m
+
+    def counter(self, name, help, labels = None):
+        '''Return a counter.
+
+        :param name: the metric name
+        :param help: the help text
+        :param labels: (optional) a dict of labels
+        :returns: the counter'''
+        return self._metric(CounterMetric, name, help, labels)
+
+    def gauge(self, name, help, labels = None, f = None):
+        '''Return a gauge. Giving a function replaces any function
+        given previously for the same gauge.
+
+        :param name: the metric name
+        :param help: the help text
+        :param labels: (optional) a dict of labels
+        :param f: (optional) a function returning the gauge's value
+        :returns: the gauge'''
+        g = self._metric(GaugeMetric, name, help, labels)
+        if f is not None:
+            g._f = f
+        return g
+
+    def histogram(self, name, help, labels = None, buckets = None):
+        '''Return a histogram.
+
+        :param name: the metric name
+        :param help: the help text
+        :param labels: (optional) a dict of labels
+        :param buckets: (optional) the bucket upper bounds (defaults to :attr:`BUCKETS`)
+        :returns: the histogram'''
+        return self._metric(HistogramMetric, name, help, labels,
+                            self.BUCKETS if buckets is None else sorted(buckets))
+
+    def _escape(self, v):
+        '''Escape a label value.
+
+        :param v: the value
+        :returns: the escaped string'''
+        return str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+    def render(self):
+        '''Render all the metrics in Prometheus text format.
+
+        :returns: the text'''
+        lines = []
+        for (name, (t, help, ms)) in self._families.items():
+            lines.append("# HELP {n} {h}".format(n=name, h=help))
+            lines.append("# TYPE {n} {t}".format(n=name, t=t))
+            for m in ms.values():
+                for (n, ls, v) in m.samples():
+                    if len(ls) > 0:
+                        n += "{" + ",".join(['{k}="{v}"'.format(k=k, v=self._escape(v)) for (k, v) in ls]) + "}"
+                    lines.append("{n} {v}".format(n=n, v="NaN" if v is None else v))
+        return "\n".join(lines) + "\n"
+
+
+#: The station's metrics.
+metrics = Metrics()
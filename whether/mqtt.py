@@ -0,0 +1,283 @@
+# MQTT transport integrated with asyncio
+#
+# Copyright (C) 2023 Simon Dobson
+#
+# This file is part of whether, a modular IoT weather station
+#
+# whether is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# whether is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with whether. If not, see <http://www.gnu.org/licenses/gpl.html>.
+
+import time
+import asyncio
+import paho.mqtt.client as mqtt
+from whether import logger
+from whether.metrics import metrics
+from whether.tracing import tracer
+
+
+class MQTTConnection:
+    '''A connection to an MQTT server driven by the asyncio event loop.
+
+    The client's socket is watched by the event loop, which calls
+    the client to read when data arrives and to write when there are
+    packets queued, while a background task services keepalives.
+    Publishing therefore never blocks: messages are queued and sent
+    as the socket allows, with at most a given number of QoS 1
+    messages awaiting acknowledgement at once and a bound on the
+    number queued behind them.
+
+    The connection is maintained by :meth:`run`, which connects and
+    reconnects whenever the connection is lost, backing off between
+    failed attempts. Callbacks can be registered to be called whenever
+    a connection is made, for example to re-issue discovery messages.
+    Subscriptions are renewed on every connection.
+
+    :param server: the MQTT server
+    :param username: (optional) user name
+    :param password: (optional) password
+    :param port: (optional) the server port (defaults to 1883)
+    :param keepalive: (optional) keepalive interval in seconds (defaults to 60s)
+    :param inflight: (optional) maximum unacknowledged messages (defaults to 10)
+    :param queued: (optional) maximum messages waiting to be sent (defaults to 100)
+    :param timeout: (optional) time allowed for connecting in seconds (defaults to 10s)
+    :param backoff: (optional) initial delay between connection attempts in seconds (defaults to 5s)
+    :param maxBackoff: (optional) maximum delay between connection attempts in seconds (defaults to 5m)
+    '''
+
+    MISC_INTERVAL = 1     #: Interval for servicing keepalives, in seconds.
+
+
+    def __init__(self, server, username = None, password = None, port = 1883,
+                 keepalive = 60, inflight = 10, queued = 100,
+                 timeout = 10, backoff = 5, maxBackoff = 300):
+        self._server = server
+        self._port = port
+        self._keepalive = keepalive
+        self._timeout = timeout
+        self._backoff = backoff
+        self._maxBackoff = maxBackoff
+        self._connected = False
+        self._changed = None
+        self._loop = None
+        self._onConnect = []
+        self._acks = dict()
+        self._subscriptions = dict()
+
+        # metrics
+        labels = dict(server=server)
+        self._publishTime = metrics.histogram("whether_mqtt_publish_seconds",
+                                              "Time from publishing a message to its acknowledgement", labels)
+        self._publishDropped = metrics.counter("whether_mqtt_publish_dropped_total",
+                                               "Messages dropped without being sent", labels)
+        self._connections = metrics.counter("whether_mqtt_connections_total",
+                                            "Connections made to the server", labels)
+        metrics.gauge("whether_mqtt_connected", "Whether we're connected to the server", labels,
+                      f=lambda: 1 if self._connected else 0)
+
+        self._client = mqtt.Client(mqtt.CallbackAPIVersion.VERSION2)
+        if username is not None:
+            self._client.username_pw_set(username=username, password=password)
+        self._client.connect_timeout = timeout
+        self._client.max_inflight_messages_set(inflight)
+        self._client.max_queued_messages_set(queued)
+        self._client.on_connect = self._connect
+        self._client.on_disconnect = self._disconnect
+        self._client.on_publish = self._published
+        self._client.on_socket_open = self._socketOpen
+        self._client.on_socket_close = self._socketClose
+        self._client.on_socket_register_write = self._registerWrite
+        self._client.on_socket_unregister_write = self._unregisterWrite
+
+    def client(self):
+        '''Return the underlying paho client.
+
+        :returns: the client'''
+        return self._client
+
+    def connected(self):
+        '''Test whether we're connected to the server.
+
+        :returns: True if connected'''
+        return self._connected
+
+    def addConnectCallback(self, f):
+        '''Add a function to be called, with no arguments, every
+        time a connection is made.
+
+        :param f: the function'''
+        self._onConnect.append(f)
+
+    # ---------- Socket callbacks ----------
+
+    def _inLoop(self, f, *args):
+        '''Call a function in the event loop. The socket callbacks
+        may be called from the thread making the connection, in which
+        case they're handed over to the loop.
+
+        :param f: the function
+        :param args: the arguments'''
+        try:
+            running = asyncio.get_running_loop()
+        except RuntimeError:
+            running = None
+        if running is self._loop:
+            f(*args)
+        else:
+            self._loop.call_soon_threadsafe(f, *args)
+
+    def _socketOpen(self, client, userdata, sock):
+        self._inLoop(self._loop.add_reader, sock, client.loop_read)
+
+    def _socketClose(self, client, userdata, sock):
+        self._inLoop(self._loop.remove_reader, sock)
+        self._inLoop(self._loop.remove_writer, sock)
+
+    def _registerWrite(self, client, userdata, sock):
+        self._inLoop(self._loop.add_writer, sock, client.loop_write)
+
+    def _unregisterWrite(self, client, userdata, sock):
+        self._inLoop(self._loop.remove_writer, sock)
+
+    # ---------- Protocol callbacks ----------
+
+    def _connect(self, client, userdata, flags, reason, properties):
+        if reason.is_failure:
+            logger.warning("MQTT {s} refused connection: {r}".format(s=self._server,
+                                                                     r=reason))
+            self._connected = False
+        else:
+            self._connected = True
+            self._connections.inc()
+            for (topic, qos) in self._subscriptions.items():
+                self._client.subscribe(topic, qos)
+            for f in self._onConnect:
+                f()
+        self._changed.set()
+
+    def _disconnect(self, client, userdata, flags, reason, properties):
+        self._connected = False
+        self._changed.set()
+
+    def _published(self, client, userdata, mid, reason, properties):
+        ack = self._acks.pop(mid, None)
+        if ack is not None and not ack.done():
+            ack.set_result(mid)
+
+    # ---------- Subscribing ----------
+
+    def subscribe(self, topic, f, qos = 1):
+        '''Subscribe to a topic. The function is called with the topic,
+        the payload, and a flag that's True for messages that the server
+        retained from before we subscribed.
+
+        :param topic: the topic
+        :param f: the function
+        :param qos: (optional) the quality of service (defaults to 1)'''
+        self._subscriptions[topic] = qos
+        self._client.message_callback_add(topic,
+                                          lambda client, userdata, msg: f(msg.topic, msg.payload, msg.retain))
+        if self._connected:
+            self._client.subscribe(topic, qos)
+
+    def unsubscribe(self, topic):
+        '''Unsubscribe from a topic.
+
+        :param topic: the topic'''
+        if topic in self._subscriptions:
+            del self._subscriptions[topic]
+            self._client.message_callback_remove(topic)
+            if self._connected:
+                self._client.unsubscribe(topic)
+
+    # ---------- Publishing ----------
+
+    def publish(self, topic, payload, qos = 1, retain = False):
+        '''Publish a message. This returns immediately, with a future
+        that completes when the message has been acknowledged (for
+        QoS 1) or sent (for QoS 0). Messages published while
+        disconnected are queued and sent on reconnection.
+
+        :param topic: the topic
+        :param payload: the payload
+        :param qos: (optional) the quality of service (defaults to 1)
+        :param retain: (optional) whether the server should retain the message (defaults to False)
+        :returns: a future, or None if the message was dropped'''
+        span = tracer.begin()
+        info = self._client.publish(topic, payload, qos=qos, retain=retain)
+        tracer.end(span, "publish", "mqtt", dict(topic=topic))
+        if info.rc == mqtt.MQTT_ERR_QUEUE_SIZE:
+            logger.warning("MQTT queue full, dropping message to {t}".format(t=topic))
+            self._publishDropped.inc()
+            return None
+        elif qos == 0 and info.rc != mqtt.MQTT_ERR_SUCCESS:
+            # QoS 0 messages aren't queued while disconnected
+            self._publishDropped.inc()
+            return None
+        ack = asyncio.get_running_loop().create_future()
+        if info.rc == mqtt.MQTT_ERR_SUCCESS and info.is_published():
+            ack.set_result(info.mid)
+            self._publishTime.observe(0)
+        else:
+            self._acks[info.mid] = ack
+            t = time.monotonic()
+            ack.add_done_callback(lambda f: self._publishTime.observe(time.monotonic() - t) if not f.cancelled() else None)
+        return ack
+
+    # ---------- Connection management ----------
+
+    async def _misc(self):
+        '''Service keepalives and timeouts.'''
+        while True:
+            self._client.loop_misc()
+            await asyncio.sleep(self.MISC_INTERVAL)
+
+    async def connect(self):
+        '''Make a single attempt to connect.
+
+        :returns: True if we connected'''
+        self._changed.clear()
+        try:
+            # the socket connection blocks, so make it in a thread
+            await asyncio.to_thread(self._client.connect,
+                                    self._server, self._port, self._keepalive)
+            await asyncio.wait_for(self._changed.wait(), self._timeout)
+        except (OSError, asyncio.TimeoutError) as err:
+            logger.warning("MQTT can't connect to {s}: {e}".format(s=self._server,
+                                                                   e=str(err) or "timed out"))
+            self._client.disconnect()
+        return self._connected
+
+    async def run(self):
+        '''Maintain the connection, reconnecting when it's lost.'''
+        self._loop = asyncio.get_running_loop()
+        self._changed = asyncio.Event()
+        misc = asyncio.create_task(self._misc())
+        try:
+            backoff = self._backoff
+            while True:
+                if await self.connect():
+                    logger.info("MQTT connected to {s}".format(s=self._server))
+                    backoff = self._backoff
+
+                    # wait for the connection to drop
+                    while self._connected:
+                        self._changed.clear()
+                        await self._changed.wait()
+                    logger.warning("MQTT lost connection to {s}".format(s=self._server))
+
+                logger.info("MQTT reconnecting in {b}s".format(b=backoff))
+                await asyncio.sleep(backoff)
+                backoff = min(2 * backoff, self._maxBackoff)
+        finally:
+            misc.cancel()
+            self._client.disconnect()
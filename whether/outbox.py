@@ -0,0 +1,322 @@
+# Disk-backed store-and-forward queue
+#
+# Copyright (C) 2023 Simon Dobson
+#
+# This file is part of whether, a modular IoT weather station
+#
+# whether is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# whether is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with whether. If not, see <http://www.gnu.org/licenses/gpl.html>.
+
+import os
+import time
+import struct
+import asyncio
+from whether import logger
+
+
+class Outbox:
+    '''A disk-backed queue of messages waiting to be published.
+
+    Messages are appended to segment files in a directory, each
+    record carrying a sequence number, and are removed once the
+    server has acknowledged them. The sequence number below which
+    everything has been acknowledged is kept in a cursor file. Files
+    are only ever appended to, and the cursor is only rewritten when
+    a whole segment has been acknowledged and deleted, to limit wear
+    on SD cards. After a crash, messages acknowledged since the
+    cursor was last written are sent again.
+
+    Messages are published through an :class:`MQTTConnection`,
+    and acknowledged when the publish completes. Messages that
+    couldn't be sent, for example while disconnected, are replayed
+    oldest first by :meth:`replay`, in batches at a limited rate so
+    as not to swamp the connection after a long outage.
+
+    Retention is bounded by total size and by age: when either is
+    exceeded the oldest segments are discarded, whether or not their
+    messages have been sent.
+
+    :param directory: the directory for the segment files
+    :param segmentSize: (optional) size at which to start a new segment in bytes (defaults to 64kB)
+    :param maxBytes: (optional) maximum size of all segments in bytes (defaults to 16MB)
+    :param maxAge: (optional) maximum age of a segment in seconds (defaults to 7 days)
+    :param rate: (optional) maximum messages per second when replaying (defaults to 10)
+    :param batch: (optional) messages sent together when replaying (defaults to 10)
+    '''
+
+    SEGMENT_SUFFIX = ".seg"     #: Suffix for segment files.
+    CURSOR_FILE = "cursor"      #: File holding the acknowledged sequence number.
+
+    # Record header: sequence number, topic length, payload length
+    _HEADER = struct.Struct('<QHI')
+
+
+    def __init__(self, directory, segmentSize = 64 * 1024,
+                 maxBytes = 16 * 1024 * 1024, maxAge = 7 * 24 * 60 * 60,
+                 rate = 10, batch = 10):
+        self._directory = directory
+        self._segmentSize = segmentSize
+        self._maxBytes = maxBytes
+        self._maxAge = maxAge
+        self._rate = rate
+        self._batch = batch
+        self._segments = []       # [first sequence number, last sequence number, size]
+        self._acked = set()       # acknowledged sequence numbers beyond the cursor
+        self._inflight = set()    # sequence numbers being published
+        self._fd = None
+        self._replaying = None
+
+        os.makedirs(directory, exist_ok=True)
+        self._cursor = self._readCursor()
+        self._scan()
+        self.compact()
+
+    # ---------- Files ----------
+
+    def _segmentFile(self, first):
+        '''Return the file name of a segment.
+
+        :param first: the first sequence number in the segment
+        :returns: the file name'''
+        return os.path.join(self._directory, "{n:016d}{s}".format(n=first, s=self.SEGMENT_SUFFIX))
+
+    def _readCursor(self):
+        '''Read the cursor file.
+
+        :returns: the last acknowledged sequence number'''
+        try:
+            with open(os.path.join(self._directory, self.CURSOR_FILE)) as fh:
+                return int(fh.read())
+        except (OSError, ValueError):
+            return 0
+
+    def _writeCursor(self):
+        '''Write the cursor file atomically.'''
+        fn = os.path.join(self._directory, self.CURSOR_FILE)
+        with open(fn + ".tmp", 'w') as fh:
+            fh.write(str(self._cursor))
+        os.replace(fn + ".tmp", fn)
+
+    def _readSegment(self, fn):
+        '''Read the records in a segment. A truncated record at the
+        end of the file (from a crash mid-write) is ignored.
+
+        :param fn: the file name
+        :returns: a generator of (sequence number, topic, payload, end offset) tuples'''
+        with open(fn, 'rb') as fh:
+            data = fh.read()
+        i = 0
+        while i + self._HEADER.size <= len(data):
+            (seq, tl, pl) = self._HEADER.unpack_from(data, i)
+            j = i + self._HEADER.size + tl + pl
+            if j > len(data):
+                break
+            topic = data[i + self._HEADER.size:i + self._HEADER.size + tl].decode()
+            yield (seq, topic, data[j - pl:j], j)
+            i = j
+
+    def _scan(self):
+        '''Scan the directory for existing segments.'''
+        fns = sorted([fn for fn in os.listdir(self._directory) if fn.endswith(self.SEGMENT_SUFFIX)])
+        for fn in fns:
+            first = int(fn[:-len(self.SEGMENT_SUFFIX)])
+            last, size = first - 1, 0
+            for (seq, _, _, end) in self._readSegment(os.path.join(self._directory, fn)):
+                last, size = seq, end
+            self._segments.append([first, last, size])
+
+        # drop any partial record at the end of the last segment
+        if len(self._segments) > 0:
+            (first, _, size) = self._segments[-1]
+            with open(self._segmentFile(first), 'r+b') as fh:
+                fh.truncate(size)
+            self._next = max(self._segments[-1][1], self._cursor) + 1
+        else:
+            self._next = self._cursor + 1
+
+    # ---------- Queueing ----------
+
+    def append(self, topic, payload):
+        '''Append a message.
+
+        :param topic: the topic
+        :param payload: the payload, as a string or bytes
+        :returns: the message's sequence number'''
+        if isinstance(payload, str):
+            payload = payload.encode()
+        t = topic.encode()
+
+        # start a new segment if needed
+        if self._fd is None or self._segments[-1][2] >= self._segmentSize:
+            if self._fd is not None:
+                self._fd.close()
+            self._segments.append([self._next, self._next - 1, 0])
+            self._fd = open(self._segmentFile(self._next), 'ab')
+            self.compact()
+
+        seq = self._next
+        self._next += 1
+        self._fd.write(self._HEADER.pack(seq, len(t), len(payload)))
+        self._fd.write(t)
+        self._fd.write(payload)
+        self._fd.flush()
+        s = self._segments[-1]
+        s[1] = seq
+        s[2] += self._HEADER.size + len(t) + len(payload)
+        return seq
+
+    def ack(self, seq):
+        '''Acknowledge a message.
+
+        :param seq: the sequence number'''
+        self._inflight.discard(seq)
+        if seq <= self._cursor:
+            return
+        self._acked.add(seq)
+        while self._cursor + 1 in self._acked:
+            self._cursor += 1
+            self._acked.remove(self._cursor)
+        if len(self._segments) > 1 and self._segments[0][1] <= self._cursor:
+            self.compact()
+
+    def backlog(self):
+        '''Return the number of messages not yet acknowledged.
+
+        :returns: the number of messages'''
+        return self._next - 1 - self._cursor - len(self._acked)
+
+    def records(self):
+        '''Return the unacknowledged messages, oldest first.
+
+        :returns: a generator of (sequence number, topic, payload) triples'''
+        for (first, last, _) in list(self._segments):
+            if last <= self._cursor:
+                continue
+            try:
+                for (seq, topic, payload, _) in self._readSegment(self._segmentFile(first)):
+                    if seq > self._cursor and seq not in self._acked:
+                        yield (seq, topic, payload)
+            except FileNotFoundError:
+                # segment discarded while we were replaying
+                pass
+
+    def compact(self):
+        '''Delete segments that have been completely acknowledged,
+        and the oldest segments if the retention limits are exceeded.
+        The segment being written is never deleted.'''
+        changed = False
+        total = sum([s[2] for s in self._segments])
+        now = time.time()
+        while len(self._segments) > 1:
+            (first, last, size) = self._segments[0]
+            fn = self._segmentFile(first)
+            if last > self._cursor:
+                if total > self._maxBytes:
+                    reason = "outbox full"
+                elif now - os.stat(fn).st_mtime > self._maxAge:
+                    reason = "too old"
+                else:
+                    break
+                logger.warning("Discarding {n} unsent messages ({r})".format(n=last - self._cursor,
+                                                                            r=reason))
+                self._acked = set([seq for seq in self._acked if seq > last])
+                self._cursor = last
+            os.remove(fn)
+            self._segments.pop(0)
+            total -= size
+            changed = True
+        if changed:
+            self._writeCursor()
+
+    def close(self):
+        '''Close the outbox, recording what's been acknowledged.'''
+        if self._fd is not None:
+            self._fd.close()
+            self._fd = None
+        self._writeCursor()
+
+    # ---------- Publishing ----------
+
+    def send(self, conn, seq, topic, payload):
+        '''Publish a queued message, acknowledging it when the
+        publish completes.
+
+        :param conn: the connection
+        :param seq: the sequence number
+        :param topic: the topic
+        :param payload: the payload
+        :returns: True if the message was accepted for publishing'''
+        ack = conn.publish(topic, payload)
+        if ack is None:
+            return False
+        self._inflight.add(seq)
+        ack.add_done_callback(lambda f: self.ack(seq) if not f.cancelled() else None)
+        return True
+
+    def submit(self, conn, topic, payload):
+        '''Queue a message and publish it if we're connected and
+        there's no backlog being replayed.
+
+        :param conn: the connection
+        :param topic: the topic
+        :param payload: the payload
+        :returns: the sequence number'''
+        seq = self.append(topic, payload)
+        if conn.connected() and not self.replaying():
+            self.send(conn, seq, topic, payload)
+        return seq
+
+    def replaying(self):
+        '''Test whether the backlog is being replayed.
+
+        :returns: True if replaying'''
+        return self._replaying is not None and not self._replaying.done()
+
+    def startReplay(self, conn):
+        '''Start replaying the backlog in the background, if we're
+        not already.
+
+        :param conn: the connection'''
+        if not self.replaying():
+            self._replaying = asyncio.create_task(self.replay(conn))
+
+    async def replay(self, conn):
+        '''Publish the backlog, oldest first, in batches at a limited
+        rate. Messages that are already being published (and which
+        the connection will re-send itself) are skipped.
+
+        :param conn: the connection'''
+        n = 0
+        sent = 0
+        more = True
+        while more and conn.connected():
+            # keep making passes, to pick up messages queued while replaying
+            more = False
+            for (seq, topic, payload) in self.records():
+                if not conn.connected():
+                    break
+                if seq in self._inflight:
+                    continue
+                if not self.send(conn, seq, topic, payload):
+                    # connection's queue is full, so pause and try again
+                    await asyncio.sleep(self._batch / self._rate)
+                    more = True
+                    break
+                more = True
+                sent += 1
+                n += 1
+                if n == self._batch:
+                    n = 0
+                    await asyncio.sleep(self._batch / self._rate)
+        if sent > 0:
+            logger.info("Replayed {n} queued messages".format(n=sent))
@@ -0,0 +1,497 @@
+# Payload encodings for reporters
+#
+# Copyright (C) 2023 Simon Dobson
+#
+# This file is part of whether, a modular IoT weather station
+#
+# whether is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# whether is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with whether. If not, see <http://www.gnu.org/licenses/gpl.html>.
+
+import json
+import struct
+
+
+# Pre-built structs for encoding numbers
+_U8 = struct.Struct('>B')
+_U16 = struct.Struct('>H')
+_U32 = struct.Struct('>I')
+_U64 = struct.Struct('>Q')
+_I8 = struct.Struct('>b')
+_I16 = struct.Struct('>h')
+_I32 = struct.Struct('>i')
+_I64 = struct.Struct('>q')
+_F32 = struct.Struct('>f')
+_F64 = struct.Struct('>d')
+
+
+def _isFloat32(f):
+    '''Test whether a float can be represented exactly in 32 bits.
+
+    :param f: the float
+    :returns: True if the float survives a round-trip through 32 bits'''
+    try:
+        return _F32.unpack(_F32.pack(f))[0] == f or f != f
+    except OverflowError:
+        return False
+
+
+class JSONCodec:
+    '''Encode payloads as JSON, as Home Assistant expects.'''
+
+    NAME = "json"     #: Name of the codec.
+
+    def encode(self, payload):
+        '''Encode a payload.
+
+        :param payload: a dict
+        :returns: bytes'''
+        return json.dumps(payload, separators=(',', ':')).encode()
+
+    def decode(self, data):
+        '''Decode a payload.
+
+        :param data: bytes
+        :returns: a dict'''
+        return json.loads(data)
+
+
+class CBORCodec:
+    '''Encode payloads as CBOR (RFC 8949).
+
+    This handles the subset of CBOR needed for payloads: maps, arrays,
+    strings, byte strings, integers, floats, booleans and null. Floats
+    are encoded in 32 bits when that loses nothing, and 64 bits otherwise.
+    '''
+
+    NAME = "cbor"     #: Name of the codec.
+
+    def _head(self, major, n, out):
+        '''Encode the head of an item.'''
+        major <<= 5
+        if n < 24:
+            out.append(major | n)
+        elif n < 0x100:
+            out.append(major | 24)
+            out += _U8.pack(n)
+        elif n < 0x10000:
+            out.append(major | 25)
+            out += _U16.pack(n)
+        elif n < 0x100000000:
+            out.append(major | 26)
+            out += _U32.pack(n)
+        else:
+            out.append(major | 27)
+            out += _U64.pack(n)
+
+    def _encode(self, v, out):
+        '''Encode an item.'''
+        if v is None:
+            out.append(0xf6)
+        elif v is True:
+            out.append(0xf5)
+        elif v is False:
+            out.append(0xf4)
+        elif isinstance(v, int):
+            if v >= 0:
+                self._head(0, v, out)
+            else:
+                self._head(1, -1 - v, out)
+        elif isinstance(v, float):
+            if _isFloat32(v):
+                out.append(0xfa)
+                out += _F32.pack(v)
+            else:
+                out.append(0xfb)
+                out += _F64.pack(v)
+        elif isinstance(v, str):
+            bs = v.encode()
+            self._head(3, len(bs), out)
+            out += bs
+        elif isinstance(v, (bytes, bytearray)):
+            self._head(2, len(v), out)
+            out += v
+        elif isinstance(v, dict):
+            self._head(5, len(v), out)
+            for (k, e) in v.items():
+                self._encode(k, out)
+                self._encode(e, out)
+        elif isinstance(v, (list, tuple)):
+            self._head(4, len(v), out)
+            for e in v:
+                self._encode(e, out)
+        else:
+            raise TypeError("Can't encode {t} as CBOR".format(t=type(v).__name__))
+
+    def encode(self, payload):
+        '''Encode a payload.
+
+        :param payload: a dict
+        :returns: bytes'''
+        out = bytearray()
+        self._encode(payload, out)
+        return bytes(out)
+
+    def _decode(self, data, i):
+        '''Decode an item.
+
+        :returns: a pair of the item and the index after it'''
+        b = data[i]
+        major, info = b >> 5, b & 0x1f
+        i += 1
+        if major == 7:
+            if info == 20:
+                return (False, i)
+            elif info == 21:
+                return (True, i)
+            elif info == 22:
+                return (None, i)
+            elif info == 26:
+                return (_F32.unpack_from(data, i)[0], i + 4)
+            elif info == 27:
+                return (_F64.unpack_from(data, i)[0], i + 8)
+            raise ValueError("Unsupported CBOR simple value {n}".format(n=info))
+
+        if info < 24:
+            n = info
+        elif info == 24:
+            n = data[i]
+            i += 1
+        elif info == 25:
+            n = _U16.unpack_from(data, i)[0]
+            i += 2
+        elif info == 26:
+            n = _U32.unpack_from(data, i)[0]
+            i += 4
+        elif info == 27:
+            n = _U64.unpack_from(data, i)[0]
+            i += 8
+        else:
+            raise ValueError("Unsupported CBOR length {n}".format(n=info))
+
+        if major == 0:
+            return (n, i)
+        elif major == 1:
+            return (-1 - n, i)
+        elif major == 2:
+            return (bytes(data[i:i + n]), i + n)
+        elif major == 3:
+            return (bytes(data[i:i + n]).decode(), i + n)
+        elif major == 4:
+            vs = []
+            for _ in range(n):
+                (v, i) = self._decode(data, i)
+                vs.append(v)
+            return (vs, i)
+        elif major == 5:
+            d = dict()
+            for _ in range(n):
+                (k, i) = self._decode(data, i)
+                (d[k], i) = self._decode(data, i)
+            return (d, i)
+        raise ValueError("Unsupported CBOR type {n}".format(n=major))
+
+    def decode(self, data):
+        '''Decode a payload.
+
+        :param data: bytes
+        :returns: a dict'''
+        return self._decode(data, 0)[0]
+
+
+class MessagePackCodec:
+    '''Encode payloads as MessagePack.
+
+    This handles the subset of MessagePack needed for payloads: maps,
+    arrays, strings, binary, integers, floats, booleans and nil. Floats
+    are encoded in 32 bits when that loses nothing, and 64 bits otherwise.
+    '''
+
+    NAME = "msgpack"     #: Name of the codec.
+
+    def _sized(self, n, fix, fixMax, codes, out):
+        '''Encode the size of a string, binary, array or map.'''
+        if fix is not None and n <= fixMax:
+            out.append(fix | n)
+        elif codes[0] is not None and n < 0x100:
+            out.append(codes[0])
+            out += _U8.pack(n)
+        elif n < 0x10000:
+            out.append(codes[1])
+            out += _U16.pack(n)
+        else:
+            out.append(codes[2])
+            out += _U32.pack(n)
+
+    def _encode(self, v, out):
+        '''Encode an item.'''
+        if v is None:
+            out.append(0xc0)
+        elif v is True:
+            out.append(0xc3)
+        elif v is False:
+            out.append(0xc2)
+        elif isinstance(v, int):
+            if 0 <= v < 0x80:
+                out.append(v)
+            elif -32 <= v < 0:
+                out.append(v & 0xff)
+            elif v >= 0:
+                if v < 0x100:
+                    out.append(0xcc)
+                    out += _U8.pack(v)
+                elif v < 0x10000:
+                    out.append(0xcd)
+                    out += _U16.pack(v)
+                elif v < 0x100000000:
+                    out.append(0xce)
+                    out += _U32.pack(v)
+                else:
+                    out.append(0xcf)
+                    out += _U64.pack(v)
+            else:
+                if v >= -0x80:
+                    out.append(0xd0)
+                    out += _I8.pack(v)
+                elif v >= -0x8000:
+                    out.append(0xd1)
+                    out += _I16.pack(v)
+                elif v >= -0x80000000:
+                    out.append(0xd2)
+                    out += _I32.pack(v)
+                else:
+                    out.append(0xd3)
+                    out += _I64.pack(v)
+        elif isinstance(v, float):
+            if _isFloat32(v):
+                out.append(0xca)
+                out += _F32.pack(v)
+            else:
+                out.append(0xcb)
+                out += _F64.pack(v)
+        elif isinstance(v, str):
+            bs = v.encode()
+            self._sized(len(bs), 0xa0, 31, (0xd9, 0xda, 0xdb), out)
+            out += bs
+        elif isinstance(v, (bytes, bytearray)):
+            self._sized(len(v), None, 0, (0xc4, 0xc5, 0xc6), out)
+            out += v
+        elif isinstance(v, dict):
+            self._sized(len(v), 0x80, 15, (None, 0xde, 0xdf), out)
+            for (k, e) in v.items():
+                self._encode(k, out)
+                self._encode(e, out)
+        elif isinstance(v, (list, tuple)):
+            self._sized(len(v), 0x90, 15, (None, 0xdc, 0xdd), out)
+            for e in v:
+                self._encode(e, out)
+        else:
+            raise TypeError("Can't encode {t} as MessagePack".format(t=type(v).__name__))
+
+    def encode(self, payload):
+        '''Encode a payload.
+
+        :param payload: a dict
+        :returns: bytes'''
+        out = bytearray()
+        self._encode(payload, out)
+        return bytes(out)
+
+    # Decoding tables for fixed-size items: code -> (struct, size)
+    _NUMBERS = {0xca: _F32, 0xcb: _F64,
+                0xcc: _U8, 0xcd: _U16, 0xce: _U32, 0xcf: _U64,
+                0xd0: _I8, 0xd1: _I16, 0xd2: _I32, 0xd3: _I64}
+    _SIZES = {0xc4: _U8, 0xc5: _U16, 0xc6: _U32,
+              0xd9: _U8, 0xda: _U16, 0xdb: _U32,
+              0xdc: _U16, 0xdd: _U32,
+              0xde: _U16, 0xdf: _U32}
+
+    def _decode(self, data, i):
+        '''Decode an item.
+
+        :returns: a pair of the item and the index after it'''
+        b = data[i]
+        i += 1
+        if b < 0x80:
+            return (b, i)
+        elif b >= 0xe0:
+            return (b - 0x100, i)
+        elif b == 0xc0:
+            return (None, i)
+        elif b == 0xc2:
+            return (False, i)
+        elif b == 0xc3:
+            return (True, i)
+        elif b in self._NUMBERS:
+            s = self._NUMBERS[b]
+            return (s.unpack_from(data, i)[0], i + s.size)
+
+        # sized items
+        if b in self._SIZES:
+            s = self._SIZES[b]
+            n = s.unpack_from(data, i)[0]
+            i += s.size
+        else:
+            n = b & (0x1f if b >= 0xa0 else 0x0f)
+
+        if 0xa0 <= b <= 0xbf or 0xd9 <= b <= 0xdb:
+            return (bytes(data[i:i + n]).decode(), i + n)
+        elif 0xc4 <= b <= 0xc6:
+            return (bytes(data[i:i + n]), i + n)
+        elif 0x90 <= b <= 0x9f or b in (0xdc, 0xdd):
+            vs = []
+            for _ in range(n):
+                (v, i) = self._decode(data, i)
+                vs.append(v)
+            return (vs, i)
+        elif 0x80 <= b <= 0x8f or b in (0xde, 0xdf):
+            d = dict()
+            for _ in range(n):
+                (k, i) = self._decode(data, i)
+                (d[k], i) = self._decode(data, i)
+            return (d, i)
+        raise ValueError("Unsupported MessagePack type {b:#x}".format(b=b))
+
+    def decode(self, data):
+        '''Decode a payload.
+
+        :param data: bytes
+        :returns: a dict'''
+        return self._decode(data, 0)[0]
+
+
+class StructSchema:
+    '''A fixed layout for payloads, identified by a schema id.
+
+    The layout is given as a list of pairs of a payload key and a
+    :mod:`struct` format code. Strings use the "s" code with a length.
+    Missing numeric values are encoded as NaN, and decoded as None.
+
+    :param id: the schema id, from 0 to 255
+    :param fields: a list of (key, format) pairs
+    '''
+
+    def __init__(self, id, fields):
+        if not 0 <= id < 256:
+            raise ValueError("Schema ids must fit in a byte")
+        self._id = id
+        self._keys = [k for (k, _) in fields]
+        self._strings = [f.endswith('s') for (_, f) in fields]
+        self._struct = struct.Struct('<B' + ''.join([f for (_, f) in fields]))
+
+    def id(self):
+        '''Return the schema id.
+
+        :returns: the id'''
+        return self._id
+
+    def keys(self):
+        '''Return the payload keys in the layout.
+
+        :returns: a list of keys'''
+        return self._keys
+
+    def size(self):
+        '''Return the size of an encoded payload.
+
+        :returns: the size in bytes'''
+        return self._struct.size
+
+    def encode(self, payload):
+        '''Encode a payload.
+
+        :param payload: a dict
+        :returns: bytes'''
+        vs = [self._id]
+        for i in range(len(self._keys)):
+            v = payload.get(self._keys[i])
+            if self._strings[i]:
+                v = b'' if v is None else v.encode()
+            elif v is None:
+                v = float('nan')
+            vs.append(v)
+        return self._struct.pack(*vs)
+
+    def decode(self, data):
+        '''Decode a payload.
+
+        :param data: bytes
+        :returns: a dict'''
+        vs = self._struct.unpack(data)
+        payload = dict()
+        for i in range(len(self._keys)):
+            v = vs[i + 1]
+            if self._strings[i]:
+                v = v.rstrip(b'\0').decode()
+            elif v != v:
+                v = None
+            payload[self._keys[i]] = v
+        return payload
+
+
+class StructCodec:
+    '''Encode payloads in a fixed binary layout.
+
+    Payloads are encoded using a single schema, whose id is the first
+    byte of the encoding. Decoding looks up the schema from the id,
+    so a receiver given all the schemas in use can decode payloads
+    from any of them.
+
+    :param schema: the schema used for encoding
+    :param schemas: (optional) further schemas for decoding
+    '''
+
+    NAME = "struct"     #: Name of the codec.
+
+    def __init__(self, schema, schemas = None):
+        self._schema = schema
+        self._schemas = dict()
+        for s in [schema] + ([] if schemas is None else schemas):
+            self._schemas[s.id()] = s
+
+    def encode(self, payload):
+        '''Encode a payload.
+
+        :param payload: a dict
+        :returns: bytes'''
+        return self._schema.encode(payload)
+
+    def decode(self, data):
+        '''Decode a payload.
+
+        :param data: bytes
+        :returns: a dict'''
+        if data[0] not in self._schemas:
+            raise ValueError("Unknown schema {id}".format(id=data[0]))
+        return self._schemas[data[0]].decode(data)
+
+
+#: Codecs that need no configuration, by name.
+CODECS = {JSONCodec.NAME: JSONCodec,
+          CBORCodec.NAME: CBORCodec,
+          MessagePackCodec.NAME: MessagePackCodec}
+
+
+def decodePayload(data, codec = "json", schemas = None):
+    '''Decode a payload on the receiving side.
+
+    :param data: the payload bytes
+    :param codec: (optional) the codec name (defaults to "json")
+    :param schemas: (optional) the schemas for the "struct" codec
+    :returns: a dict'''
+    if codec == StructCodec.NAME:
+        if not schemas:
+            raise ValueError("The struct codec needs schemas to decode")
+        return StructCodec(schemas[0], schemas[1:]).decode(data)
+    elif codec in CODECS:
+        return CODECS[codec]().decode(data)
+    raise ValueError("Unknown codec {c}".format(c=codec))
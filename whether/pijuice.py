@@ -17,7 +17,7 @@
 # You should have received a copy of the GNU General Public License
 # along with whether. If not, see <http://www.gnu.org/licenses/gpl.html>.
 
-from whether import Sampler
+from whether import Sampler, eventClass
 import pijuice
 
 
@@ -35,6 +35,18 @@ class PiJuice(Sampler):
     BATTERY_VOLTAGE = "voltage"            #: Event tag for battery voltage in mV.
     BATTERY_CURRENT = "current"            #: Event tag for battery current in mA.
 
+    #: Event class.
+    EVENT = eventClass("PiJuiceEvent",
+                       [Sampler.TIMESTAMP, Sampler.ID,
+                        BATTERY_STATUS, BATTERY_CHARGE_PERCENTAGE,
+                        BATTERY_TEMPERATURE, BATTERY_VOLTAGE, BATTERY_CURRENT],
+                       {Sampler.TIMESTAMP: 'd',
+                        BATTERY_STATUS: '16s',
+                        BATTERY_CHARGE_PERCENTAGE: 'f',
+                        BATTERY_TEMPERATURE: 'f',
+                        BATTERY_VOLTAGE: 'f',
+                        BATTERY_CURRENT: 'f'})
+
 
     def __init__(self, id, ring, period = 1):
         super().__init__(id, ring, period)
@@ -0,0 +1,164 @@
+# Power policy driven by battery state
+#
+# Copyright (C) 2023 Simon Dobson
+#
+# This file is part of whether, a modular IoT weather station
+#
+# whether is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# whether is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with whether. If not, see <http://www.gnu.org/licenses/gpl.html>.
+
+from whether import Sampler, eventClass, logger
+
+
+class PowerPolicy(Sampler):
+    '''A power policy that trades throughput for runtime.
+
+    The policy watches the charge percentage reported by a battery
+    sensor (usually a :class:`PiJuice`) and selects a tier from a
+    table. Each tier is a tuple of a name, the minimum charge for the
+    tier, a scale factor applied to the periods of the sensors and
+    reporters under the policy's control, and a flag saying whether
+    non-essential sensors should be suspended. Tiers are ordered from
+    highest to lowest minimum charge, and the last tier should have a
+    minimum of zero.
+
+    To avoid flapping between tiers, moving up to a better tier
+    requires the charge to exceed the tier's minimum by a margin.
+
+    The policy listens to the battery sensor for its charge, rather
+    than reading the sensor's ring buffer, which a reporter may have
+    swapped out and left empty.
+
+    The policy is itself a sensor, reporting the active tier as an
+    event every period.
+
+    :param id: the policy's id
+    :param battery: the battery sensor
+    :param ring: the ring buffer to receive events
+    :param tiers: (optional) the tier table (defaults to :attr:`TIERS`)
+    :param sensors: (optional) sensors whose periods are scaled
+    :param reporters: (optional) reporters whose periods are scaled
+    :param optional: (optional) non-essential sensors that can be suspended
+    :param period: (optional) the period for checking the battery (defaults to 60s)
+    :param hysteresis: (optional) the margin for moving up a tier (defaults to 5%)
+    '''
+
+    TIER = "tier"        #: Event tag for the name of the active tier.
+    SCALE = "scale"      #: Event tag for the active period scale factor.
+    CHARGE = "charge"    #: Event tag for the battery charge that selected the tier.
+
+    #: Event class.
+    EVENT = eventClass("PowerPolicyEvent",
+                       [Sampler.TIMESTAMP, Sampler.ID, TIER, SCALE, CHARGE],
+                       {Sampler.TIMESTAMP: 'd', TIER: '8s', SCALE: 'f', CHARGE: 'f'})
+
+    #: Default tiers.
+    TIERS = [("normal", 50, 1, False),
+             ("saving", 25, 2, False),
+             ("critical", 0, 5, True)]
+
+
+    def __init__(self, id, battery, ring, tiers = None,
+                 sensors = None, reporters = None, optional = None,
+                 period = 60, hysteresis = 5):
+        super().__init__(id, ring, period)
+        self._battery = battery
+        self._tiers = self.TIERS if tiers is None else tiers
+        self._sensors = [] if sensors is None else sensors
+        self._reporters = [] if reporters is None else reporters
+        self._optional = [] if optional is None else optional
+        self._hysteresis = hysteresis
+        self._charge = None
+        self._latest = None
+        self._current = 0
+        battery.addListener(self.batteryEvent)
+
+        # check the tiers are in order
+        for i in range(1, len(self._tiers)):
+            if self._tiers[i][1] >= self._tiers[i - 1][1]:
+                raise ValueError("Tiers must have decreasing minimum charges")
+
+    def batteryEvent(self, s, ev):
+        '''Note the charge from a battery event. This is called
+        by the battery sensor for each event.
+
+        :param s: the battery sensor
+        :param ev: the event'''
+        charge = ev.get(s.BATTERY_CHARGE_PERCENTAGE)
+        if charge is not None:
+            self._latest = charge
+
+    def setReporters(self, reporters):
+        '''Set the reporters whose periods are scaled. This is
+        useful when the reporters themselves report on the policy.
+
+        :param reporters: the reporters'''
+        self._reporters = reporters
+        scale = self._tiers[self._current][2]
+        for r in reporters:
+            r.setScale(scale)
+
+    def tier(self):
+        '''Return the active tier.
+
+        :returns: the tier tuple'''
+        return self._tiers[self._current]
+
+    def tierFor(self, charge):
+        '''Return the index of the tier for the given charge, taking
+        account of the hysteresis for moving up from the active tier.
+
+        :param charge: the battery charge percentage
+        :returns: the tier index'''
+        for i in range(len(self._tiers)):
+            threshold = self._tiers[i][1]
+            if i < self._current:
+                threshold += self._hysteresis
+            if charge >= threshold:
+                return i
+        return len(self._tiers) - 1
+
+    def apply(self, i):
+        '''Apply a tier to the sensors and reporters.
+
+        :param i: the tier index'''
+        self._current = i
+        (name, _, scale, suspend) = self._tiers[i]
+        for s in self._sensors:
+            s.setScale(scale)
+        for r in self._reporters:
+            r.setScale(scale)
+        for s in self._optional:
+            if suspend:
+                s.suspend()
+            else:
+                s.resume()
+        logger.info("Power tier now {n} (charge {c}%, periods x{s})".format(n=name,
+                                                                          c=self._charge,
+                                                                          s=scale))
+
+    def sample(self):
+        '''Check the battery and change tier if needed.
+
+        :returns: a dict'''
+        charge = self._latest
+        if charge is not None:
+            self._charge = charge
+            i = self.tierFor(charge)
+            if i != self._current:
+                self.apply(i)
+
+        (name, _, scale, _) = self._tiers[self._current]
+        return {self.TIER: name,
+                self.SCALE: scale,
+                self.CHARGE: self._charge}
@@ -17,7 +17,7 @@
 # You should have received a copy of the GNU General Public License
 # along with whether. If not, see <http://www.gnu.org/licenses/gpl.html>.
 
-from whether import Counter
+from whether import Counter, eventClass
 
 
 class Raingauge(Counter):
@@ -32,6 +32,11 @@ class Raingauge(Counter):
 
     RAININTENSITY = "rainfall"                 #: Event tag for rain intensity in mm/h.
 
+    #: Event class.
+    EVENT = eventClass("RaingaugeEvent",
+                       [Counter.TIMESTAMP, Counter.ID, RAININTENSITY],
+                       {Counter.TIMESTAMP: 'd', RAININTENSITY: 'f'})
+
     # One tip represents 0.2794mm
     TIPRAINFALL = 0.2794 * (60 * 60)           #: Rainfall in mm/h corresponding to one tip/s.
 
@@ -46,10 +51,11 @@ class Raingauge(Counter):
         :returns: the rainfall intensity'''
         return (self.TIPRAINFALL * n) / dt
 
-    def sample(self):
+    def sampleInto(self, ev):
         '''Convert the count into rainfall intensityevent.
 
-        :returns: a dict'''
+        :param ev: the event
+        :returns: True'''
         c = self.count()
-        r = self.rainfall(c, self.period())
-        return {self.RAININTENSITY: r}
+        ev[self.RAININTENSITY] = self.rainfall(c, self.period())
+        return True
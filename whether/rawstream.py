@@ -0,0 +1,169 @@
+# Batched raw event streams
+#
+# Copyright (C) 2023 Simon Dobson
+#
+# This file is part of whether, a modular IoT weather station
+#
+# whether is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# whether is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with whether. If not, see <http://www.gnu.org/licenses/gpl.html>.
+
+import zlib
+import asyncio
+from whether import logger
+from whether.payloads import MessagePackCodec, decodePayload
+from whether.compression import GorillaCodec
+
+
+class RawStream:
+    '''Reporter for publishing every event from a set of sensors.
+
+    Rather than summarising, the stream listens to its sensors and
+    collects every event they push into columns, one list per sensor
+    per tag, so that repeated keys aren't sent and similar values sit
+    together. A batch is published, encoded and compressed, every
+    period or when it holds a given number of events, whichever comes
+    first. This gives full-resolution data at a fraction of the message
+    rate of publishing every event.
+
+    Each batch is a dict with a sequence number (:attr:`SEQUENCE`),
+    which increases by one per batch so that receivers can detect
+    lost batches, and a dict mapping sensor ids to their columns
+    (:attr:`SENSORS`). Events missing a tag have None in that
+    tag's column. Batches can be decoded with :func:`decodeBatch`.
+
+    For long batches, each sensor's columns can instead be compressed
+    with a :class:`GorillaCodec`, which stores regular timestamps and
+    slowly-changing readings in a few bits each. The compressed columns
+    are bytes, so need a codec that can carry them, such as
+    MessagePack or CBOR.
+
+    :param conn: the :class:`MQTTConnection` to publish over
+    :param topic: the topic to publish to
+    :param sensors: the sensors
+    :param period: (optional) the maximum time between batches in seconds (defaults to 10s)
+    :param maxEvents: (optional) the maximum events in a batch (defaults to 100)
+    :param codec: (optional) the codec for batches (defaults to MessagePack)
+    :param level: (optional) the compression level (defaults to 6)
+    :param columns: (optional) the codec for each sensor's columns (defaults to none)
+    '''
+
+    SEQUENCE = "seq"        #: Batch key for the sequence number.
+    SENSORS = "sensors"     #: Batch key for the sensors' columns.
+
+
+    def __init__(self, conn, topic, sensors, period = 10, maxEvents = 100,
+                 codec = None, level = 6, columns = None):
+        self._conn = conn
+        self._topic = topic
+        self._period = period
+        self._scale = 1
+        self._maxEvents = maxEvents
+        self._codec = MessagePackCodec() if codec is None else codec
+        self._level = level
+        self._columnCodec = columns
+        self._seq = 0
+        self._columns = dict()
+        self._counts = dict()
+        self._events = 0
+
+        for s in sensors:
+            s.addListener(self.record)
+
+    def period(self):
+        '''Return the maximum period between batches. This is the
+        period set for the stream multiplied by its scale.
+
+        :returns: the period in seconds'''
+        return self._period * self._scale
+
+    def setScale(self, scale):
+        '''Scale the period, for example to save power.
+
+        :param scale: the scale factor'''
+        self._scale = scale
+
+    def sequence(self):
+        '''Return the sequence number of the next batch.
+
+        :returns: the sequence number'''
+        return self._seq
+
+    def record(self, s, ev):
+        '''Record an event in the batch. This is called by the
+        sensors for each event.
+
+        :param s: the sensor
+        :param ev: the event'''
+        id = s.id()
+        cols = self._columns.get(id)
+        if cols is None:
+            cols = self._columns[id] = dict()
+            self._counts[id] = 0
+        n = self._counts[id]
+
+        # add columns for new tags
+        for t in ev.keys():
+            if t != s.ID and t not in cols:
+                cols[t] = [None] * n
+        for (t, c) in cols.items():
+            c.append(ev.get(t))
+        self._counts[id] = n + 1
+
+        self._events += 1
+        if self._events >= self._maxEvents:
+            self.flush()
+
+    def batch(self):
+        '''Return the current batch.
+
+        :returns: a dict'''
+        if self._columnCodec is None:
+            sensors = self._columns
+        else:
+            sensors = dict([(id, self._columnCodec.encode(cols)) for (id, cols) in self._columns.items()])
+        return {self.SEQUENCE: self._seq,
+                self.SENSORS: sensors}
+
+    def flush(self):
+        '''Publish the current batch, if it isn't empty, and start
+        a new one.'''
+        if self._events == 0:
+            return
+        data = zlib.compress(self._codec.encode(self.batch()), self._level)
+        logger.debug("Stream batch %s of %s events, %s bytes", self._seq, self._events, len(data))
+        self._conn.publish(self._topic, data)
+        self._seq += 1
+        self._columns = dict()
+        self._counts = dict()
+        self._events = 0
+
+    async def run(self):
+        while True:
+            await asyncio.sleep(self.period())
+            self.flush()
+
+
+def decodeBatch(data, codec = "msgpack", schemas = None):
+    '''Decode a batch published by a :class:`RawStream`. Compressed
+    columns are decompressed.
+
+    :param data: the payload bytes
+    :param codec: (optional) the codec name (defaults to "msgpack")
+    :param schemas: (optional) the schemas for the "struct" codec
+    :returns: the batch'''
+    b = decodePayload(zlib.decompress(data), codec, schemas)
+    sensors = b.get(RawStream.SENSORS, dict())
+    for (id, cols) in sensors.items():
+        if isinstance(cols, bytes):
+            sensors[id] = GorillaCodec().decode(cols)
+    return b
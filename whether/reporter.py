@@ -0,0 +1,261 @@
+# Base class for reporters
+#
+# Copyright (C) 2023 Simon Dobson
+#
+# This file is part of whether, a modular IoT weather station
+#
+# whether is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# whether is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with whether. If not, see <http://www.gnu.org/licenses/gpl.html>.
+
+import asyncio
+from whether import RingBuffer, angleForDirection, modalTagValue, meanTagValue, maxTagValue, logger
+from whether.tracing import tracer
+
+
+class Reporter:
+    '''Base class for reporters that summarise their sensors periodically.
+
+    Every period the reporter swaps each sensor's ring buffer for an
+    empty spare, builds a payload summarising the events in the
+    detached rings, and submits it. The detached rings then become
+    the spares for the next period. Sensors keep reporting throughout,
+    so no events are lost between summarising and emptying the rings,
+    and nothing is copied.
+    The payload is a dict of fields in SI units (with wind direction
+    both as a cardinal point and in degrees). Sub-classes override
+    :meth:`submit` to send the payload somewhere.
+
+    Submitting must not block, so that one slow service can't hold
+    up the others: anything that takes time should be done in a task.
+
+    :param sensors: dict mapping keys to sensors
+    :param period: (optional) reporting period in seconds (defaults to 60s)
+    '''
+
+    # Sensor type keys
+    TEMPERATURE = "t"        #: Temperature sensor.
+    HUMIDITY = "h"           #: Humidity sensor
+    WINDSPEED = "ws"         #: Windspeed sensor.
+    WINDDIRECTION = "wd"     #: Wind direction sensor.
+    RAININTENSITY = "r"      #: Rain gauge.
+    BATTERY = "b"            #: Battery.
+    CPU = 'c'                #: CPU.
+    POWER = 'p'              #: Power policy.
+
+
+    def __init__(self, sensors, period = 60):
+        super().__init__()
+        self._sensors = sensors
+        self._period = period
+        self._scale = 1
+        self._payload = []
+
+        # build the component callback list
+        self._makePayloadConstructor()
+
+    def _makePayloadConstructor(self):
+        '''Install the event handlers for the sensors we have.'''
+        handlers = {self.TEMPERATURE: self.temperature,
+                    self.HUMIDITY: self.humidity,
+                    self.WINDSPEED: self.windspeed,
+                    self.WINDDIRECTION: self.windDirection,
+                    self.RAININTENSITY: self.rainfall,
+                    self.BATTERY: self.battery,
+                    self.CPU: self.cpu,
+                    self.POWER: self.power}
+        for (k, f) in handlers.items():
+            if k in self._sensors:
+                self._payload.append((self._sensors[k], f))
+
+        # a spare ring for each sensor (which may appear under several keys)
+        self._spares = dict()
+        for (s, _) in self._payload:
+            if s not in self._spares:
+                self._spares[s] = RingBuffer(s.events().size())
+
+    def name(self):
+        '''Return the name of the reporter, for logging and tracing.
+
+        :returns: the name'''
+        return type(self).__name__
+
+    def sensors(self):
+        '''Return the sensors.
+
+        :returns: dict mapping keys to sensors'''
+        return self._sensors
+
+    def period(self):
+        '''Return the reporting period. This is the period set for
+        the reporter multiplied by its scale.
+
+        :returns: the period in seconds'''
+        return self._period * self._scale
+
+    def setScale(self, scale):
+        '''Scale the reporting period, for example to save power.
+        This takes effect from the next period.
+
+        :param scale: the scale factor'''
+        self._scale = scale
+
+    # ---------- Payload construction ----------
+
+    def temperature(self, t, evs, payload):
+        d = meanTagValue(evs, t.TEMPERATURE)
+        payload['temperature'] = d
+
+    def humidity(self, h, evs, payload):
+        d = meanTagValue(evs, h.HUMIDITY)
+        payload['humidity'] = d
+
+    def windspeed(self, ws, evs, payload):
+        d = meanTagValue(evs, ws.WINDSPEED)
+        g = maxTagValue(evs, ws.WINDSPEED)
+        payload['wind_speed'] = d
+        payload['wind_speed_gust'] = g
+
+    def windDirection(self, wd, evs, payload):
+        d = modalTagValue(evs, wd.DIRECTION)
+        payload['wind_dir'] = d
+        payload['wind_dir_deg'] = None if d is None else angleForDirection(d)
+
+    def rainfall(self, rg, evs, payload):
+        d = meanTagValue(evs, rg.RAININTENSITY)
+        payload['rainfall'] = d
+
+    def battery(self, rg, evs, payload):
+        c = meanTagValue(evs, rg.BATTERY_CHARGE_PERCENTAGE)
+        t = meanTagValue(evs, rg.BATTERY_TEMPERATURE)
+        v = meanTagValue(evs, rg.BATTERY_VOLTAGE)
+        a = meanTagValue(evs, rg.BATTERY_CURRENT)
+        payload['battery_charge'] = c
+        payload['battery_temp'] = t
+        payload['battery_voltage'] = v
+        payload['battery_current'] = a
+
+    def cpu(self, rg, evs, payload):
+        t = meanTagValue(evs, rg.CPU_TEMPERATURE, None)
+        s = meanTagValue(evs, rg.WIFI_SIGNAL_STRENGTH, None)
+        if s is not None:
+            s = int(s)
+        payload['cpu_temp'] = t
+        payload['cpu_wifi'] = s
+
+    def power(self, pp, evs, payload):
+        d = modalTagValue(evs, pp.TIER)
+        payload['power_tier'] = d
+
+    def payload(self, rings = None):
+        '''Create the payload for the upload.
+
+        :param rings: (optional) dict mapping sensors to rings (defaults to their current rings)
+        :returns: a dict'''
+        payload = dict()
+        for (s, f) in self._payload:
+            evs = s.events() if rings is None else rings[s]
+            f(s, evs, payload)
+        return payload
+
+    def swapRings(self):
+        '''Swap each sensor's ring for its spare.
+
+        :returns: a dict mapping sensors to their detached rings'''
+        return {s: s.swapRing(spare) for (s, spare) in self._spares.items()}
+
+    def recycle(self, rings):
+        '''Keep detached rings as the spares for the next swap.
+
+        :param rings: a dict mapping sensors to rings'''
+        self._spares = rings
+
+    def reset(self):
+        '''Discard events on component event queues.'''
+        for s in self._spares.keys():
+            s.events().reset()
+
+    # ---------- Reporting ----------
+
+    def submit(self, payload):
+        '''Submit a payload. This must be overridden by sub-classes.
+
+        :param payload: the payload'''
+        raise NotImplementedError("submit")
+
+    def start(self):
+        '''Start any background work the reporter needs, such as
+        connecting to a server. This is called once, when the
+        reporter starts running. The default does nothing.'''
+        pass
+
+    async def run(self):
+        self.start()
+
+        while True:
+            # wait for the next sample submission
+            await asyncio.sleep(self.period())
+
+            # detach the sensors' rings and send the data, not
+            # letting a failure stop later periods being reported
+            rings = self.swapRings()
+            try:
+                with tracer.span("aggregate", self.name()):
+                    payload = self.payload(rings)
+                with tracer.span("submit", self.name()):
+                    self.submit(payload)
+            except Exception as e:
+                logger.error("{n}: reporting failed: {e}".format(n=self.name(), e=e))
+
+            # re-use the detached rings next time
+            self.recycle(rings)
+
+
+class FanOut(Reporter):
+    '''A reporter that submits the same payload to several others.
+
+    The payload is computed once per period from the fan-out's own
+    sensors and handed to each of the sinks, which don't need sensors
+    or to be run themselves. Since submitting doesn't block, a slow
+    sink doesn't delay the others.
+
+    :param sensors: dict mapping keys to sensors
+    :param sinks: the reporters to submit to
+    :param period: (optional) reporting period in seconds (defaults to 60s)
+    '''
+
+    def __init__(self, sensors, sinks, period = 60):
+        super().__init__(sensors, period)
+        self._sinks = list(sinks)
+
+    def sinks(self):
+        '''Return the sinks.
+
+        :returns: a list of reporters'''
+        return self._sinks
+
+    def start(self):
+        '''Start all the sinks.'''
+        for s in self._sinks:
+            s.start()
+
+    def submit(self, payload):
+        '''Submit the payload to all the sinks. An exception from
+        one sink doesn't stop the others being submitted to.
+
+        :param payload: the payload'''
+        for s in self._sinks:
+            try:
+                with tracer.span("submit", s.name()):
+                    s.submit(payload)
+            except Exception as e:
+                logger.error("{s}: submit failed: {e}".format(s=s.name(), e=e))
@@ -29,11 +29,13 @@ class RingBuffer:
     elements, oldest first.
     '''
 
-    def __init__(self, n):
+    def __init__(self, n, name = None):
         '''Create an empty ring buffer of size n.
 
-        :param n: the length of the ring buffer'''
+        :param n: the length of the ring buffer
+        :param name: (optional) a name for the ring, used when logging'''
         self._len = n + 1             # size + the marker
+        self._name = name
         self._write = 0
         self._read = 0
 
@@ -41,6 +43,18 @@ class RingBuffer:
         # that this sets up initial menory that won't then be expanded
         self._buf = [ self ] * self._len
 
+    def name(self):
+        '''Return the ring's name.
+
+        :returns: the name, or None'''
+        return self._name
+
+    def setName(self, name):
+        '''Set the ring's name.
+
+        :param name: the name'''
+        self._name = name
+
     def size(self):
         '''Return the maximum number of elements in the ring.
 
@@ -66,6 +80,28 @@ class RingBuffer:
         :returns: True if the buffer is empty'''
         return (self._read == self._write)
 
+    def fill(self, factory):
+        '''Pre-allocate the buffer's free slots with objects created
+        by the given factory. The sensor pushing events into the ring
+        can then :meth:`claim` the next slot and fill it in place,
+        rather than allocating a new event for every push.
+
+        :param factory: a function returning a new slot object'''
+        for i in range(self._len):
+            if self._buf[i] is self:
+                self._buf[i] = factory()
+
+    def claim(self):
+        '''Return the object in the slot that the next push will
+        write to, for the caller to fill in and then push. This is
+        None if the slots haven't been pre-allocated with :meth:`fill`.
+
+        :returns: the slot object or None'''
+        v = self._buf[self._write]
+        if v is self:
+            return None
+        return v
+
     def full(self):
         '''Test is the buffer is full. Pushing to a full buffer will
         overwrite the oldest element.
@@ -79,7 +115,9 @@ class RingBuffer:
         This operationm will result in data loss if the ring is full: the
         oldest element will be dropped. This is logged as an info-level
         event: *not* as an error, since this behaviour is part of the
-        purpose of using ring buffers in the first place.
+        purpose of using ring buffers in the first place. The message
+        is the same for every drop from a ring, so a batched log
+        handler can summarise them.
 
         :param v: the value to push'''
         self._buf[self._write] = v
@@ -87,7 +125,7 @@ class RingBuffer:
         if self._read == self._write:
             # the buffer is full, so drop the oldest element
             # so that the next read will read the next oldest
-            logger.info("Dropped item {v} from ring buffer".format(v=self._buf[self._write]))
+            logger.info("Dropped item from ring buffer %s", self._name)
             self._read = (self._read + 1) % self._len
 
     def pop(self):
@@ -114,6 +152,15 @@ class RingBuffer:
             v = self._buf[n]
             return v
 
+    def last(self):
+        '''Return the most recently pushed element without popping it.
+        Return None if the buffer is empty.
+
+        :returns: the latest value'''
+        if self.empty():
+            return None
+        return self._buf[(self._write - 1) % self._len]
+
 
     # ---------- Iterator interface ----------
 
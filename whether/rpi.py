@@ -17,15 +17,14 @@
 # You should have received a copy of the GNU General Public License
 # along with whether. If not, see <http://www.gnu.org/licenses/gpl.html>.
 
-import os
 import re
-from whether import Sampler
+from whether import SysfsSampler, eventClass
 
 # Approach to temperature taken from
 # https://www.pragmaticlinux.com/2020/06/check-the-raspberry-pi-cpu-temperature/
 
 
-class RPi(Sampler):
+class RPi(SysfsSampler):
     '''Driver for thr Raspberry Pi's onboard sensors.
 
     :param id: sensor identifier
@@ -39,18 +38,30 @@ class RPi(Sampler):
     CPU_TEMPERATURE = "temperature"                              #: Event tag for CPU temperature.
     WIFI_SIGNAL_STRENGTH = "rssi"                                #: Event tag for wifi signal strength.
 
+    #: Event class.
+    EVENT = eventClass("RPiEvent",
+                       [SysfsSampler.TIMESTAMP, SysfsSampler.ID,
+                        CPU_TEMPERATURE, WIFI_SIGNAL_STRENGTH],
+                       {SysfsSampler.TIMESTAMP: 'd',
+                        CPU_TEMPERATURE: 'f',
+                        WIFI_SIGNAL_STRENGTH: 'f'})
+
+    # Patterns for parsing the files
+    _TEMPERATURE = re.compile(rb'^(\d+)\s*$')
+    _WIFI = re.compile(rb'^\s*\S+:\s+\S+\s+(-?\d+)', re.M)
+
     def __init__(self, id, ring, period = 1):
         super().__init__(id, ring, period)
+        self.openFile(self.THERMAL_ZONE_FILE)
+        self.openFile(self.WIFI_FILE)
 
     def sampleTemperature(self):
         '''Return the current CPU temperature.
 
         :returns: the CPU temperature in C'''
-        if os.path.isfile(self.THERMAL_ZONE_FILE):
-            with open(self.THERMAL_ZONE_FILE) as fd:
-                line = fd.readline().strip()
-            if line.isdigit():
-                return float(line) / 1000
+        m = self.matchFile(self.THERMAL_ZONE_FILE, self._TEMPERATURE)
+        if m is not None:
+            return float(m.group(1)) / 1000
 
         # if we get here we can't read the temperature
         return None
@@ -60,16 +71,12 @@ class RPi(Sampler):
         this is a number between 0 and 70.
 
         :returns: the signal strength'''
-        if os.path.isfile(self.WIFI_FILE):
-            lines = []
-            with os.popen(f'cat {self.WIFI_FILE}') as f:
-                l = f.readlines()
-
-            # tokenise the last line
-            tks = re.split(r'\s+', l[-1])
-
-            # compute RSSI
-            rssi = int(float(tks[3]))
+        contents = self.readFile(self.WIFI_FILE)
+        if contents is not None:
+            # use the last interface listed
+            rssi = None
+            for m in self._WIFI.finditer(contents):
+                rssi = int(m.group(1))
             return rssi
 
         # if we get here we can't sample the wifi
@@ -20,7 +20,10 @@
 import time
 import asyncio
 import keypad
+from adafruit_logging import DEBUG
 from whether import logger
+from whether.metrics import metrics
+from whether.tracing import tracer
 
 
 class Sensor:
@@ -32,6 +35,17 @@ class Sensor:
     end of each period. (This doesn't have to happen, and some sensors
     may decide not to report if nothing has happened.)
 
+    To avoid allocating memory on every sample, a sensor pre-allocates
+    the slots of its ring buffer with events created by :meth:`newEvent`,
+    and fills each one in place using :meth:`sampleInto`. Sub-classes
+    should override either this method or :meth:`sample`: overriding
+    :meth:`sampleInto` avoids allocation.
+
+    Events are dicts by default. Drivers can instead set :attr:`EVENT`
+    to a typed event class created by :func:`eventClass` from their
+    tags, which holds the same values in slots and can serialise
+    itself without re-encoding its tags.
+
     :param id: a unique id
     :param ring: the ring buffer to receive events
     :param period: reporting period in seconds (defaults to 1s)
@@ -40,11 +54,30 @@ class Sensor:
     TIMESTAMP = "time"  #: Event tag for timestamp, in Unix epoch seconds.
     ID = "id"           #: Event tage for the sensor id.
 
+    EVENT = None        #: Typed event class, or None to use dicts.
+
 
     def __init__(self, id, ring, period = 1):
         self._id = id
         self._ring = ring
         self._period = period
+        self._scale = 1
+        self._suspended = False
+        self._breaker = None
+        self._listeners = []
+
+        # pre-allocate the events
+        ring.fill(self.newEvent)
+        if ring.name() is None:
+            ring.setName(id)
+
+        # look up the sensor's metrics
+        labels = dict(sensor=id)
+        self._sampleTime = metrics.histogram("whether_sample_seconds", "Time taken to take a sample", labels)
+        self._sampleErrors = metrics.counter("whether_sample_errors_total", "Samples that failed", labels)
+        self._drops = metrics.counter("whether_ring_drops_total", "Events dropped from full rings", labels)
+        metrics.gauge("whether_ring_fill", "Events in the sensor's ring", labels,
+                      f=lambda: len(self._ring))
 
     def id(self):
         '''Return the sensor's identifier.
@@ -59,24 +92,175 @@ class Sensor:
         :returns: the ring buffer'''
         return self._ring
 
+    def swapRing(self, spare):
+        '''Swap the sensor's ring buffer for a spare, returning the
+        ring the sensor was reporting to. The spare is emptied and its
+        slots pre-allocated before the swap, so the sensor carries on
+        reporting without missing an event, and the returned ring can
+        be read at leisure while the sensor writes to the spare.
+
+        :param spare: the spare ring buffer
+        :returns: the old ring buffer'''
+        spare.reset()
+        spare.fill(self.newEvent)
+        if spare.name() is None:
+            spare.setName(self._id)
+        ring = self._ring
+        self._ring = spare
+        return ring
+
     def period(self):
-        '''Return the sensor's sensing period.
+        '''Return the sensor's sensing period. This is the
+        period set for the sensor multiplied by its scale.
 
         :returns: a time in seconds'''
-        return self._period
+        return self._period * self._scale
 
-    def sample(self):
-        '''Take a sample, returning an event. This method must be
-        overridden by sub-classes.
+    def setPeriod(self, period):
+        '''Set the sensor's sensing period. This takes effect
+        from the next period.
+
+        :param period: the new period in seconds'''
+        self._period = period
+
+    def scale(self):
+        '''Return the factor the sensor's period is scaled by.
+
+        :returns: the scale factor'''
+        return self._scale
+
+    def setScale(self, scale):
+        '''Scale the sensor's period, for example to save power.
+        This takes effect from the next period.
+
+        :param scale: the scale factor'''
+        self._scale = scale
+
+    def suspend(self):
+        '''Suspend the sensor, so that it stops sampling.'''
+        self._suspended = True
 
-        :returns: a dict'''
-        raise NotImplementedError("sample")
+    def resume(self):
+        '''Resume a suspended sensor.'''
+        self._suspended = False
+
+    def suspended(self):
+        '''Test whether the sensor is suspended.
+
+        :returns: True if the sensor is suspended'''
+        return self._suspended
+
+    def newEvent(self):
+        '''Return a new, empty, event.
+
+        :returns: an event of the sensor's event class, or a dict'''
+        if self.EVENT is None:
+            return dict()
+        return self.EVENT()
+
+    def sample(self):
+        '''Take a sample, returning an event. Sub-classes must override
+        either this method or :meth:`sampleInto`.
+
+        :returns: a dict or None'''
+        if type(self).sampleInto is Sensor.sampleInto:
+            raise NotImplementedError("sample")
+        ev = self.newEvent()
+        if self.sampleInto(ev):
+            return ev
+        else:
+            return None
+
+    def sampleInto(self, ev):
+        '''Take a sample, filling in the values in the given event.
+        The default calls :meth:`sample` and copies the values.
+
+        :param ev: the event
+        :returns: True if the event was filled in'''
+        s = self.sample()
+        if s is None:
+            return False
+        ev.update(s)
+        return True
 
     def pushEvent(self, ev):
         '''Push an event to the sensor's ring buffer.
 
         :param ev: the event'''
+        t = tracer.begin()
+        if self._ring.full():
+            self._drops.inc()
         self._ring.push(ev)
+        for f in self._listeners:
+            try:
+                f(self, ev)
+            except Exception as err:
+                logger.error("{id}: listener failed: {e}".format(id=self._id,
+                                                                 e=err))
+        tracer.end(t, "push", self._id)
+
+    def addListener(self, f):
+        '''Add a function to be called with every event the sensor
+        pushes, as well as the event going to the ring buffer. The
+        function is called with the sensor and the event. Events
+        live in the ring's pre-allocated slots and will be
+        overwritten, so listeners should copy out any values
+        they need to keep. Errors raised by listeners are logged,
+        and aren't held against the sensor.
+
+        :param f: the function'''
+        self._listeners.append(f)
+
+    def removeListener(self, f):
+        '''Remove a listener.
+
+        :param f: the function'''
+        self._listeners.remove(f)
+
+
+    # ---------- Failure handling ----------
+
+    def setCircuitBreaker(self, breaker):
+        '''Protect the sensor with a circuit breaker, which
+        stops it being sampled while it's failing.
+
+        :param breaker: the breaker, or None to remove it'''
+        self._breaker = breaker
+
+    def circuitBreaker(self):
+        '''Return the sensor's circuit breaker, if any.
+
+        :returns: the breaker or None'''
+        return self._breaker
+
+    def attempt(self):
+        '''Test whether a sample should be attempted. This is
+        always True unless the sensor is suspended or a circuit
+        breaker says otherwise.
+
+        :returns: True if the sample should go ahead'''
+        if self._suspended:
+            return False
+        return self._breaker is None or self._breaker.allow(time.monotonic())
+
+    def succeeded(self):
+        '''Record that a sample succeeded.'''
+        if self._breaker is not None:
+            self._breaker.success()
+
+    def failed(self, err):
+        '''Record that a sample failed. The error is logged unless
+        a circuit breaker has already noted that the sensor is
+        failing.
+
+        :param err: the exception'''
+        self._sampleErrors.inc()
+        b = self._breaker
+        if b is None or b.state() == b.CLOSED:
+            logger.error("{id}: {e}".format(id=self.id(),
+                                            e=err))
+        if b is not None:
+            b.failure(time.monotonic())
 
 
     # ---------- Coroutine interface ----------
@@ -96,30 +280,157 @@ class Sampler(Sensor):
     def __init__(self, id, ring, period = 1):
         super().__init__(id, ring, period)
 
+        # adaptive sampling (off by default)
+        self._tolerances = None
+        self._lastValues = dict()
+
+
+    # ---------- Adaptive sampling ----------
+
+    def setAdaptive(self, tolerances, minPeriod = None, maxPeriod = None, factor = 2):
+        '''Put the sampler into adaptive mode.
+
+        In adaptive mode the sampling period is stretched by the given
+        factor for as long as successive readings stay within a
+        tolerance band, and shrunk back towards the minimum period in
+        proportion to how far they move outside it. Tolerances are
+        given per event tag: numeric values are compared against their
+        tolerance, while other values (such as cardinal points) are
+        counted as having changed whenever they differ.
+
+        :param tolerances: dict mapping event tags to tolerances
+        :param minPeriod: (optional) the shortest period (defaults to the current period)
+        :param maxPeriod: (optional) the longest period (defaults to ten times the shortest)
+        :param factor: (optional) the stretch factor (defaults to 2)'''
+        if minPeriod is None:
+            minPeriod = self.period()
+        if maxPeriod is None:
+            maxPeriod = 10 * minPeriod
+        if minPeriod <= 0 or maxPeriod < minPeriod:
+            raise ValueError("Adaptive period bounds must satisfy 0 < min <= max")
+        if factor <= 1:
+            raise ValueError("Adaptive stretch factor must be greater than 1")
+        self._tolerances = tolerances
+        self._minPeriod = minPeriod
+        self._maxPeriod = maxPeriod
+        self._factor = factor
+        self._lastValues.clear()
+        self.setPeriod(minPeriod)
+
+    def isAdaptive(self):
+        '''Test whether the sampler is in adaptive mode.
+
+        :returns: True if the period adapts to the readings'''
+        return self._tolerances is not None
+
+    def change(self, ev):
+        '''Compute how much an event has changed from the previous one,
+        relative to the tolerances. A value of 1 or less means that all
+        the readings stayed within their tolerance bands.
+
+        :param ev: the event
+        :returns: the largest change relative to its tolerance'''
+        worst = 0.0
+        for (tag, tolerance) in self._tolerances.items():
+            v = ev.get(tag)
+            if tag not in self._lastValues:
+                # first reading for this tag, nothing to compare against
+                self._lastValues[tag] = v
+                continue
+            last = self._lastValues[tag]
+            self._lastValues[tag] = v
+
+            if v == last:
+                continue
+            elif isinstance(v, (int, float)) and isinstance(last, (int, float)) and tolerance > 0:
+                worst = max(worst, abs(v - last) / tolerance)
+            else:
+                # non-numeric values (or a zero tolerance) change completely
+                worst = float('inf')
+        return worst
+
+    def adapt(self, ev):
+        '''Adapt the sampling period in the light of a new event. This
+        does nothing unless the sampler is in adaptive mode.
+
+        :param ev: the event'''
+        if self._tolerances is None:
+            return
+
+        r = self.change(ev)
+        if r <= 1:
+            # stable, so back off
+            p = min(self._period * self._factor, self._maxPeriod)
+        else:
+            # changing, so shrink the period in proportion to the rate
+            p = max(self._period / r, self._minPeriod)
+        if p != self._period:
+            logger.debug("Sensor %s period now %ss", self._id, p)
+            self.setPeriod(p)
+
+
+    # ---------- Sampling ----------
+
+    def delay(self):
+        '''Return the time to wait before taking the next sample.
+        The default is the sampling period: sub-classes can override
+        this to sample sooner (or later) when they need to.
+
+        :returns: the delay in seconds'''
+        return self.period()
+
+    def takeSample(self):
+        '''Take a sample and place the resulting event into the
+        sensor's ring buffer. Any errors are logged rather than
+        propagated. Nothing happens if the sensor's circuit breaker
+        is open, and the breaker only hears of a success when an
+        event is actually produced.'''
+        if not self.attempt():
+            return
+        try:
+            # construct the event, re-using the ring's slot if we can
+            ev = self._ring.claim()
+            if ev is None:
+                ev = self.newEvent()
+            t = time.monotonic()
+            span = tracer.begin()
+            sampled = self.sampleInto(ev)
+            tracer.end(span, "sample", self._id)
+            self._sampleTime.observe(time.monotonic() - t)
+        except Exception as err:
+            self.failed(err)
+            return
+        if not sampled:
+            return
+
+        ev[self.TIMESTAMP] = time.time()
+        ev[self.ID] = self._id
+
+        # push into the sensor's ring buffer
+        self.pushEvent(ev)
+        if logger.getEffectiveLevel() <= DEBUG:
+            logger.debug("Sensor %s pushed sample %s", self._id, dict(ev))
+
+        # adjust the sampling rate if we're adaptive
+        self.adapt(ev)
+        self.succeeded()
+
 
     # ---------- Coroutine interface ----------
 
     async def run(self):
         '''Coroutine to take a sample every period and place
         the data into the sensor's ring buffer.'''
+        # cache the bound methods we use every time round
+        takeSample = self.takeSample
+        delay = self.delay
+        sleep = asyncio.sleep
+
         while True:
-            try:
-                # construct the event
-                ev = self.sample()
-                if ev is not None:
-                    ev[self.TIMESTAMP] = time.time()
-                    ev[self.ID] = self.id()
-
-                    # push into the sensor's ring buffer
-                    self.pushEvent(ev)
-                    logger.debug('Sensor {id} pushed sample {ev}'.format(id=self.id(),
-                                                                         ev=ev))
-            except Exception as err:
-                logger.error("{id}: {e}".format(id=self.id(),
-                                                e=err))
+            takeSample()
 
             # wait for the next period
-            await asyncio.sleep(self.period())
+            await sleep(delay())
 
 
 class Counter(Sensor):
@@ -167,12 +478,13 @@ class Counter(Sensor):
         '''Called when an edge is seen. The default increments the counter.'''
         self._count += 1
 
-    def sample(self):
-        '''Create an event corresponding to the count.
+    def sampleInto(self, ev):
+        '''Fill in an event corresponding to the count.
 
-        :returns: a dict'''
-        ev = {self.COUNT: self.count()}
-        return ev
+        :param ev: the event
+        :returns: True'''
+        ev[self.COUNT] = self._count
+        return True
 
 
     # ---------- Coroutine interface ----------
@@ -193,20 +505,26 @@ class Counter(Sensor):
             # wait for the next sampling period
             await asyncio.sleep(self.period())
 
-            try:
-                # post the event
-                ev = self.sample()
-                if ev is not None:
-                    ev[self.TIMESTAMP] = time.time()
-                    ev[self.ID] = self.id()
-
-                    # push into the sensor's ring buffer
-                    self.pushEvent(ev)
-                    logger.debug('Sensor {id} pushed count {ev}'.format(id=self.id(),
-                                                                    ev=ev))
-            except Exception as err:
-                logger.error("{id}: {e}".format(id=self.id(),
-                                                e=err))
+            if self.attempt():
+                try:
+                    # post the event, re-using the ring's slot if we can
+                    ev = self._ring.claim()
+                    if ev is None:
+                        ev = self.newEvent()
+                    span = tracer.begin()
+                    sampled = self.sampleInto(ev)
+                    tracer.end(span, "sample", self._id)
+                    if sampled:
+                        ev[self.TIMESTAMP] = time.time()
+                        ev[self.ID] = self._id
+
+                        # push into the sensor's ring buffer
+                        self.pushEvent(ev)
+                        if logger.getEffectiveLevel() <= DEBUG:
+                            logger.debug("Sensor %s pushed count %s", self._id, dict(ev))
+                    self.succeeded()
+                except Exception as err:
+                    self.failed(err)
 
             # reset the counter
             self.reset()
@@ -0,0 +1,102 @@
+# Samplers for procfs and sysfs metrics
+#
+# Copyright (C) 2023 Simon Dobson
+#
+# This file is part of whether, a modular IoT weather station
+#
+# whether is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# whether is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with whether. If not, see <http://www.gnu.org/licenses/gpl.html>.
+
+from whether import Sampler, logger
+
+
+class SysfsSampler(Sampler):
+    '''A sampler for metrics exposed as files under /proc and /sys.
+
+    Files are opened once, when first requested, and kept open. Each
+    read seeks back to the start and reads the file's current contents
+    into a buffer that is shared across all the sampler's files, so
+    taking a sample doesn't create processes, re-open files, or
+    allocate new buffers. The contents can be matched against
+    pre-compiled byte patterns, whose groups can be passed directly
+    to :func:`int` or :func:`float`.
+
+    Files that don't exist (or can't be opened) are remembered as
+    missing, and reading them returns None.
+
+    :param id: sensor identifier
+    :param ring: the ring buffer
+    :param period: the sampling perdiod in seconds
+    '''
+
+    BUFFER_SIZE = 4096    #: Initial size of the read buffer in bytes.
+
+
+    def __init__(self, id, ring, period = 1):
+        super().__init__(id, ring, period)
+        self._files = dict()
+        self._buf = bytearray(self.BUFFER_SIZE)
+        self._view = memoryview(self._buf)
+
+    def openFile(self, fn):
+        '''Open a file for reading in subsequent samples.
+
+        :param fn: the file name
+        :returns: True if the file is available'''
+        if fn not in self._files:
+            try:
+                self._files[fn] = open(fn, 'rb', buffering=0)
+            except OSError as err:
+                logger.warning("{id}: can't open {fn}: {e}".format(id=self.id(),
+                                                                   fn=fn,
+                                                                   e=err))
+                self._files[fn] = None
+        return self._files[fn] is not None
+
+    def readFile(self, fn):
+        '''Read the current contents of a file. The contents are
+        returned as a view onto the sampler's buffer, and so are only
+        valid until the next read.
+
+        :param fn: the file name
+        :returns: a memoryview of the contents, or None'''
+        if not self.openFile(fn):
+            return None
+        fd = self._files[fn]
+        while True:
+            fd.seek(0)
+            n = fd.readinto(self._buf)
+            if n < len(self._buf):
+                return self._view[:n]
+
+            # the buffer was too small, so grow it and try again
+            self._buf = bytearray(2 * len(self._buf))
+            self._view = memoryview(self._buf)
+
+    def matchFile(self, fn, pattern):
+        '''Match a pre-compiled pattern against the contents of a file.
+
+        :param fn: the file name
+        :param pattern: a compiled byte pattern
+        :returns: the match object, or None'''
+        contents = self.readFile(fn)
+        if contents is None:
+            return None
+        return pattern.search(contents)
+
+    def close(self):
+        '''Close all the sampler's files.'''
+        for fd in self._files.values():
+            if fd is not None:
+                fd.close()
+        self._files.clear()
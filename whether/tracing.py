@@ -0,0 +1,205 @@
+# Tracing and event-loop monitoring
+#
+# Copyright (C) 2023 Simon Dobson
+#
+# This file is part of whether, a modular IoT weather station
+#
+# whether is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# whether is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with whether. If not, see <http://www.gnu.org/licenses/gpl.html>.
+
+import os
+import json
+import time
+import asyncio
+from collections import deque
+from contextlib import nullcontext
+from whether import logger
+from whether.metrics import metrics
+
+
+class Tracer:
+    '''A recorder of timed spans, for reading stalls off a timeline.
+
+    Code brackets the work it wants traced with :meth:`begin` and
+    :meth:`end`, or with a :meth:`span` context. Each span has a name
+    and a category, such as a sensor id, and spans in the same category
+    appear on the same row of the timeline. Spans are kept in a bounded
+    buffer, the oldest being discarded when it's full, and can be
+    exported in Chrome's trace-event format for loading into
+    ``chrome://tracing`` or Perfetto.
+
+    Tracing is disabled by default, when :meth:`begin` returns None and
+    the other methods do nothing, so that traced code costs little
+    more than a method call.
+
+    :param size: (optional) the maximum number of spans kept (defaults to 10000)
+    '''
+
+    def __init__(self, size = 10000):
+        self._spans = deque(maxlen=size)
+        self._enabled = False
+
+    def enabled(self):
+        '''Test whether tracing is enabled.
+
+        :returns: True if enabled'''
+        return self._enabled
+
+    def enable(self):
+        '''Start recording spans.'''
+        self._enabled = True
+
+    def disable(self):
+        '''Stop recording spans. Spans already recorded are kept.'''
+        self._enabled = False
+
+    def clear(self):
+        '''Discard all recorded spans.'''
+        self._spans.clear()
+
+    def __len__(self):
+        '''Return the number of spans recorded.
+
+        :returns: the number of spans'''
+        return len(self._spans)
+
+    def begin(self):
+        '''Begin a span.
+
+        :returns: the start time to pass to :meth:`end`, or None if tracing is disabled'''
+        if not self._enabled:
+            return None
+        return time.perf_counter()
+
+    def end(self, t, name, cat, args = None):
+        '''End a span.
+
+        :param t: the start time returned by :meth:`begin`
+        :param name: the span name
+        :param cat: the span category
+        :param args: (optional) a dict of extra information'''
+        if t is None:
+            return
+        self._spans.append((name, cat, t, time.perf_counter() - t, args))
+
+    def span(self, name, cat, args = None):
+        '''Return a context that records a span around its body.
+
+        :param name: the span name
+        :param cat: the span category
+        :param args: (optional) a dict of extra information
+        :returns: a context manager'''
+        if not self._enabled:
+            return nullcontext()
+        return _Span(self, name, cat, args)
+
+    def toChrome(self):
+        '''Return the spans in Chrome's trace-event format, with
+        each category as a named thread.
+
+        :returns: a dict ready to be dumped as JSON'''
+        pid = os.getpid()
+        tids = dict()
+        evs = []
+        for (name, cat, t, d, args) in list(self._spans):
+            tid = tids.get(cat)
+            if tid is None:
+                tid = tids[cat] = len(tids) + 1
+                evs.append(dict(name="thread_name", ph="M", pid=pid, tid=tid,
+                                args=dict(name=cat)))
+            ev = dict(name=name, cat=cat, ph="X", pid=pid, tid=tid,
+                      ts=round(t * 1e6, 1), dur=round(d * 1e6, 1))
+            if args is not None:
+                ev['args'] = args
+            evs.append(ev)
+        return dict(traceEvents=evs, displayTimeUnit="ms")
+
+    def dump(self, fn):
+        '''Write the spans to a file in Chrome's trace-event format.
+
+        :param fn: the file name'''
+        with open(fn, 'w') as fh:
+            json.dump(self.toChrome(), fh)
+
+
+class _Span:
+    '''A context recording a span.'''
+
+    def __init__(self, tracer, name, cat, args):
+        self._tracer = tracer
+        self._name = name
+        self._cat = cat
+        self._args = args
+
+    def __enter__(self):
+        self._t = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self._tracer.end(self._t, self._name, self._cat, self._args)
+        return False
+
+
+class LoopMonitor:
+    '''A watchdog for the event loop.
+
+    The monitor repeatedly sleeps for a short interval and measures
+    how late it wakes up. This lag is how long the loop was kept from
+    scheduling coroutines, typically by one of them blocking. Lags are
+    recorded in the ``whether_loop_lag_seconds`` histogram, and those
+    over a threshold are logged and, if tracing is enabled, added to
+    the station's trace as stalls, so the span that caused them can
+    be found next to them on the timeline.
+
+    :param interval: (optional) the interval between checks in seconds (defaults to 0.1s)
+    :param threshold: (optional) the lag counted as a stall in seconds (defaults to 0.1s)
+    '''
+
+    def __init__(self, interval = 0.1, threshold = 0.1):
+        self._interval = interval
+        self._threshold = threshold
+        self._lag = metrics.histogram("whether_loop_lag_seconds",
+                                      "Delay in the event loop scheduling a coroutine")
+        self._stalls = metrics.counter("whether_loop_stalls_total",
+                                       "Times the event loop was blocked for longer than the threshold")
+        self._max = 0
+
+    def maxLag(self):
+        '''Return the largest lag seen.
+
+        :returns: the lag in seconds'''
+        return self._max
+
+    def check(self, lag, at):
+        '''Record a lag.
+
+        :param lag: the lag in seconds
+        :param at: the (performance counter) time the loop was expected to wake up'''
+        self._lag.observe(lag)
+        if lag > self._max:
+            self._max = lag
+        if lag > self._threshold:
+            self._stalls.inc()
+            logger.warning("Event loop blocked for {l:.3f}s".format(l=lag))
+            if tracer.enabled():
+                tracer.end(at, "stall", "loop", dict(lag=lag))
+
+    async def run(self):
+        while True:
+            t = time.perf_counter() + self._interval
+            await asyncio.sleep(self._interval)
+            self.check(max(time.perf_counter() - t, 0), t)
+
+
+#: The station's tracer.
+tracer = Tracer()
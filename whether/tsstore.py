@@ -0,0 +1,669 @@
+# Embedded append-only store for raw events
+#
+# Copyright (C) 2023 Simon Dobson
+#
+# This file is part of whether, a modular IoT weather station
+#
+# whether is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# whether is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with whether. If not, see <http://www.gnu.org/licenses/gpl.html>.
+
+import os
+import json
+import time
+import struct
+import asyncio
+import threading
+from whether import logger
+from whether.metrics import metrics
+from whether.sensortypes import Sensor
+from whether.compression import GorillaCodec
+
+
+class TimeSeriesStore:
+    '''A local store of every event from a set of sensors.
+
+    The store listens to its sensors and collects the events they
+    push into columns in memory, one list per tag, which are written
+    to disk in a batch every period by a background thread, so that
+    sampling never waits for the disk. If the disk falls behind, new
+    events are counted and discarded once a sensor has a given number
+    waiting.
+
+    Each sensor has its own sub-directory of append-only segment
+    files. A segment starts with its layout, being the tags stored
+    and their :mod:`struct` format codes, taken from the sensor's
+    typed events where it has them and otherwise from the first event
+    it pushes. Each batch is appended as a block holding the events'
+    values column by column, each column fixed-width or, if the store
+    is given a :class:`GorillaCodec`, compressed. A new segment is
+    started when the current one reaches a given size.
+
+    Alongside each segment is a sparse index holding the time range
+    and offset of each block, so that a time-range read only loads the
+    blocks it needs. Blocks written every period are small, so closed
+    segments are compacted in the background, their blocks being
+    merged into larger ones. Retention is bounded by total size and
+    by age: when either is exceeded the oldest segments are deleted.
+
+    Errors writing to the disk (when it fills up, say) are logged and
+    counted, and the batch being written is discarded. The segment
+    being written is then closed, and the sensor's next batch starts a
+    new one, so that a partly-written block can't misplace the blocks
+    after it. The store keeps running regardless.
+
+    :param directory: the directory for the segment files
+    :param sensors: the sensors
+    :param period: (optional) the time between writes in seconds (defaults to 10s)
+    :param maxPending: (optional) maximum events waiting to be written per sensor (defaults to 10000)
+    :param segmentSize: (optional) size at which to start a new segment in bytes (defaults to 1MB)
+    :param blockRows: (optional) the number of events in a compacted block (defaults to 1024)
+    :param maxBytes: (optional) maximum size of all segments in bytes (defaults to 64MB)
+    :param maxAge: (optional) maximum age of the data in a segment in seconds (defaults to 30 days)
+    :param compactPeriod: (optional) the time between compactions in seconds (defaults to 1 hour)
+    :param codec: (optional) the codec used to compress blocks (defaults to fixed-width columns)
+    '''
+
+    SEGMENT_SUFFIX = ".seg"     #: Suffix for segment files.
+    INDEX_SUFFIX = ".idx"       #: Suffix for index files.
+    STRING_SIZE = 16            #: Width of string columns for sensors without typed events.
+
+    # Segment header: magic number, layout length, followed by the layout as JSON
+    _MAGIC = b"WTS1"
+    _MAGIC_COMPRESSED = b"WTSG"
+    _HEADER = struct.Struct('<4sH')
+
+    # Block header: events, length of the columns, first and last timestamp
+    _BLOCK = struct.Struct('<IIdd')
+
+    # Index entry: first and last timestamp, block offset, events
+    _INDEX = struct.Struct('<ddQI')
+
+
+    def __init__(self, directory, sensors, period = 10, maxPending = 10000,
+                 segmentSize = 1024 * 1024, blockRows = 1024,
+                 maxBytes = 64 * 1024 * 1024, maxAge = 30 * 24 * 60 * 60,
+                 compactPeriod = 60 * 60, codec = None):
+        self._directory = directory
+        self._period = period
+        self._scale = 1
+        self._maxPending = maxPending
+        self._segmentSize = segmentSize
+        self._blockRows = blockRows
+        self._maxBytes = maxBytes
+        self._maxAge = maxAge
+        self._compactPeriod = compactPeriod
+        self._codec = GorillaCodec(Sensor.TIMESTAMP) if codec is None else codec
+        self._compress = codec is not None
+        self._layouts = dict()      # sensor id -> layout
+        self._pending = dict()      # sensor id -> columns
+        self._counts = dict()       # sensor id -> events pending
+        self._segments = dict()     # sensor id -> [[name, layout, first time, last time, size, blocks, compressed]]
+        self._fds = dict()          # sensor id -> (segment fd, index fd)
+        self._sealed = set()        # sensor ids whose current segment mustn't be appended to
+        self._lock = threading.Lock()
+
+        self._written = metrics.counter("whether_store_events_total",
+                                        "Events written to the store")
+        self._writeTime = metrics.histogram("whether_store_write_seconds",
+                                            "Time taken to write each batch to the store")
+        metrics.gauge("whether_store_bytes", "Size of the store",
+                      f=lambda: sum([s[4] for ss in self._segments.values() for s in ss]))
+
+        os.makedirs(directory, exist_ok=True)
+        self._scan()
+        for s in sensors:
+            s.addListener(self.record)
+
+    def period(self):
+        '''Return the period between writes. This is the period
+        set for the store multiplied by its scale.
+
+        :returns: the period in seconds'''
+        return self._period * self._scale
+
+    def setScale(self, scale):
+        '''Scale the period, for example to save power.
+
+        :param scale: the scale factor'''
+        self._scale = scale
+
+    # ---------- Files ----------
+
+    def _sensorDirectory(self, id):
+        '''Return the directory holding a sensor's segments.
+
+        :param id: the sensor id
+        :returns: the directory'''
+        return os.path.join(self._directory, id)
+
+    def _segmentFile(self, id, name, suffix = None):
+        '''Return the file name of a segment or its index.
+
+        :param id: the sensor id
+        :param name: the segment name
+        :param suffix: (optional) the suffix (defaults to the segment suffix)
+        :returns: the file name'''
+        return os.path.join(self._sensorDirectory(id),
+                            "{n:016d}{s}".format(n=name,
+                                                 s=self.SEGMENT_SUFFIX if suffix is None else suffix))
+
+    def _readLayout(self, fh):
+        '''Read the layout at the start of a segment.
+
+        :param fh: the open segment file
+        :returns: a (layout, compressed, header size) triple'''
+        (magic, n) = self._HEADER.unpack(fh.read(self._HEADER.size))
+        if magic not in [self._MAGIC, self._MAGIC_COMPRESSED]:
+            raise ValueError("Not a segment file")
+        layout = tuple([tuple(c) for c in json.loads(fh.read(n))])
+        return (layout, magic == self._MAGIC_COMPRESSED, self._HEADER.size + n)
+
+    def _writeLayout(self, fh, layout, compressed):
+        '''Write the layout at the start of a segment.
+
+        :param fh: the open segment file
+        :param layout: the layout
+        :param compressed: True if the segment's blocks are compressed
+        :returns: the header size'''
+        data = json.dumps(layout).encode()
+        magic = self._MAGIC_COMPRESSED if compressed else self._MAGIC
+        fh.write(self._HEADER.pack(magic, len(data)))
+        fh.write(data)
+        return self._HEADER.size + len(data)
+
+    def _walkSegment(self, fn):
+        '''Read the block headers of a segment, to rebuild its index.
+        A truncated block at the end of the file (from a crash
+        mid-write) is ignored.
+
+        :param fn: the file name
+        :returns: a (layout, compressed, index entries, end offset) tuple'''
+        entries = []
+        size = os.path.getsize(fn)
+        with open(fn, 'rb') as fh:
+            (layout, compressed, i) = self._readLayout(fh)
+            while i + self._BLOCK.size <= size:
+                fh.seek(i)
+                (n, length, tmin, tmax) = self._BLOCK.unpack(fh.read(self._BLOCK.size))
+                j = i + self._BLOCK.size + length
+                if j > size:
+                    break
+                entries.append((tmin, tmax, i, n))
+                i = j
+        return (layout, compressed, entries, i)
+
+    def _readIndex(self, id, name):
+        '''Read the index of a segment.
+
+        :param id: the sensor id
+        :param name: the segment name
+        :returns: a list of (first time, last time, offset, events) entries'''
+        with open(self._segmentFile(id, name, self.INDEX_SUFFIX), 'rb') as fh:
+            data = fh.read()
+        return [e for e in self._INDEX.iter_unpack(data[:len(data) - len(data) % self._INDEX.size])]
+
+    def _writeIndex(self, fn, entries):
+        '''Write an index file atomically.
+
+        :param fn: the file name
+        :param entries: the index entries'''
+        with open(fn + ".tmp", 'wb') as fh:
+            for e in entries:
+                fh.write(self._INDEX.pack(*e))
+        os.replace(fn + ".tmp", fn)
+
+    def _scan(self):
+        '''Scan the directory for existing segments. Each index is
+        checked against its segment, and rebuilt if they disagree.'''
+        for id in sorted(os.listdir(self._directory)):
+            d = self._sensorDirectory(id)
+            if not os.path.isdir(d):
+                continue
+            segments = []
+            for fn in sorted([fn for fn in os.listdir(d) if fn.endswith(self.SEGMENT_SUFFIX)]):
+                name = int(fn[:-len(self.SEGMENT_SUFFIX)])
+                sfn = self._segmentFile(id, name)
+                try:
+                    (layout, compressed, entries, size) = self._walkSegment(sfn)
+                except (OSError, ValueError, struct.error):
+                    logger.warning("Discarding unreadable segment {fn}".format(fn=sfn))
+                    self._remove(id, name)
+                    continue
+                try:
+                    if self._readIndex(id, name) != entries:
+                        raise ValueError("index mismatch")
+                except (OSError, ValueError):
+                    logger.info("Rebuilding index for {fn}".format(fn=sfn))
+                    self._writeIndex(self._segmentFile(id, name, self.INDEX_SUFFIX), entries)
+                if size < os.path.getsize(sfn):
+                    with open(sfn, 'r+b') as fh:
+                        fh.truncate(size)
+                tmin = entries[0][0] if len(entries) > 0 else None
+                tmax = entries[-1][1] if len(entries) > 0 else None
+                segments.append([name, layout, tmin, tmax, size, len(entries), compressed])
+            if len(segments) > 0:
+                self._segments[id] = segments
+
+    def _remove(self, id, name):
+        '''Delete a segment and its index.
+
+        :param id: the sensor id
+        :param name: the segment name'''
+        for suffix in [self.SEGMENT_SUFFIX, self.INDEX_SUFFIX]:
+            try:
+                os.remove(self._segmentFile(id, name, suffix))
+            except FileNotFoundError:
+                pass
+
+    # ---------- Recording ----------
+
+    def _layout(self, s, ev):
+        '''Work out the layout for a sensor's events: the timestamp
+        first, followed by the other tags in the sensor's binary
+        layout, or by the tags of the first event.
+
+        :param s: the sensor
+        :param ev: the first event
+        :returns: a tuple of (tag, format code) pairs'''
+        fs = s.EVENT.formats() if s.EVENT is not None else dict()
+        if len(fs) == 0:
+            for (t, v) in ev.items():
+                fs[t] = '{n}s'.format(n=self.STRING_SIZE) if isinstance(v, str) else 'd'
+        return tuple([(Sensor.TIMESTAMP, 'd')] + [(t, c) for (t, c) in fs.items()
+                                                  if t not in [Sensor.TIMESTAMP, Sensor.ID]])
+
+    def record(self, s, ev):
+        '''Record an event. This is called by the sensors for
+        each event.
+
+        :param s: the sensor
+        :param ev: the event'''
+        id = s.id()
+        cols = self._pending.get(id)
+        if cols is None:
+            layout = self._layouts.get(id)
+            if layout is None:
+                layout = self._layouts[id] = self._layout(s, ev)
+            cols = self._pending[id] = [[] for _ in layout]
+            self._counts[id] = 0
+        elif self._counts[id] >= self._maxPending:
+            metrics.counter("whether_store_dropped_total",
+                            "Events discarded while the store was behind",
+                            dict(sensor=id)).inc()
+            return
+
+        layout = self._layouts[id]
+        t = ev.get(Sensor.TIMESTAMP)
+        cols[0].append(time.time() if t is None else t)
+        for i in range(1, len(layout)):
+            cols[i].append(ev.get(layout[i][0]))
+        self._counts[id] += 1
+
+    def pending(self):
+        '''Return the number of events waiting to be written.
+
+        :returns: the number of events'''
+        return sum(self._counts.values())
+
+    # ---------- Writing ----------
+
+    def _encodeBlock(self, layout, cols, compressed):
+        '''Encode columns as a block.
+
+        :param layout: the layout
+        :param cols: the columns
+        :param compressed: True to compress the columns
+        :returns: the block bytes'''
+        n = len(cols[0])
+        ts = [t for t in cols[0] if t == t]
+        if compressed:
+            data = self._codec.encode(dict(zip([t for (t, _) in layout], cols)), dict(layout))
+        else:
+            data = b''.join([_packColumn(layout[i][1], cols[i]) for i in range(len(layout))])
+        return self._BLOCK.pack(n, len(data), min(ts), max(ts)) + data
+
+    def _decodeBlock(self, layout, data, n, compressed):
+        '''Decode the columns of a block.
+
+        :param layout: the layout
+        :param data: the block's columns
+        :param n: the number of events
+        :param compressed: True if the columns are compressed
+        :returns: a list of columns'''
+        if compressed:
+            cols = self._codec.decode(data)
+            return [cols[t] for (t, _) in layout]
+        cols = []
+        i = 0
+        for (_, code) in layout:
+            (col, i) = _unpackColumn(code, data, i, n)
+            cols.append(col)
+        return cols
+
+    def _open(self, id, layout, t):
+        '''Return the files of the segment being written for a
+        sensor, starting a new one if there isn't one, if the current
+        one is full, or if the sensor's layout or compression has changed.
+
+        :param id: the sensor id
+        :param layout: the layout
+        :param t: the first timestamp of the block to be written
+        :returns: the segment'''
+        segments = self._segments.setdefault(id, [])
+        if len(segments) > 0:
+            s = segments[-1]
+            if s[4] < self._segmentSize and s[1] == layout and s[6] == self._compress and id not in self._sealed:
+                if id not in self._fds:
+                    self._fds[id] = (open(self._segmentFile(id, s[0]), 'ab'),
+                                     open(self._segmentFile(id, s[0], self.INDEX_SUFFIX), 'ab'))
+                return s
+        self._closeFiles(id)
+
+        # name the segment by its first timestamp in ms, after any existing segment
+        name = int(t * 1000)
+        if len(segments) > 0:
+            name = max(name, segments[-1][0] + 1)
+        os.makedirs(self._sensorDirectory(id), exist_ok=True)
+        fh = open(self._segmentFile(id, name), 'wb')
+        size = self._writeLayout(fh, layout, self._compress)
+        fh.flush()
+        self._fds[id] = (fh, open(self._segmentFile(id, name, self.INDEX_SUFFIX), 'wb'))
+        s = [name, layout, None, None, size, 0, self._compress]
+        segments.append(s)
+        self._sealed.discard(id)
+        return s
+
+    def _closeFiles(self, id):
+        '''Close the files of the segment being written for a sensor.
+
+        :param id: the sensor id'''
+        fds = self._fds.pop(id, None)
+        if fds is not None:
+            for fh in fds:
+                try:
+                    fh.close()
+                except OSError:
+                    pass
+
+    def _write(self, batches):
+        '''Encode batches as blocks and append them to the sensors'
+        segments. Each block is written before its index entry, so
+        that the index never refers to data that isn't there. A batch
+        that can't be written is discarded.
+
+        :param batches: a list of (sensor id, layout, columns) triples'''
+        for (id, layout, cols) in batches:
+            try:
+                self._writeBatch(id, layout, cols)
+            except OSError as e:
+                logger.error("Can't store events from {id}: {e}".format(id=id, e=e))
+                metrics.counter("whether_store_errors_total",
+                                "Batches that couldn't be written to the store",
+                                dict(sensor=id)).inc()
+                metrics.counter("whether_store_dropped_total",
+                                "Events discarded while the store was behind",
+                                dict(sensor=id)).inc(len(cols[0]))
+
+                # don't append to a segment that may end in a partial block
+                self._closeFiles(id)
+                self._sealed.add(id)
+
+    def _writeBatch(self, id, layout, cols):
+        '''Encode a batch as a block and append it to the sensor's segment.
+
+        :param id: the sensor id
+        :param layout: the layout
+        :param cols: the columns'''
+        block = self._encodeBlock(layout, cols, self._compress)
+        (n, _, tmin, tmax) = self._BLOCK.unpack_from(block)
+        s = self._open(id, layout, tmin)
+        (fh, ih) = self._fds[id]
+        fh.write(block)
+        fh.flush()
+        ih.write(self._INDEX.pack(tmin, tmax, s[4], n))
+        ih.flush()
+        s[2] = tmin if s[2] is None else min(s[2], tmin)
+        s[3] = tmax if s[3] is None else max(s[3], tmax)
+        s[4] += len(block)
+        s[5] += 1
+        self._written.inc(n)
+
+    def _takeBatches(self):
+        '''Take the events waiting to be written.
+
+        :returns: a list of (sensor id, layout, columns) triples'''
+        batches = []
+        for (id, cols) in self._pending.items():
+            if self._counts[id] > 0:
+                batches.append((id, self._layouts[id], cols))
+        self._pending = dict()
+        self._counts = dict()
+        return batches
+
+    def flush(self):
+        '''Write any events waiting to be written immediately.'''
+        batches = self._takeBatches()
+        if len(batches) > 0:
+            self._lockedWrite(batches)
+
+    def _lockedWrite(self, batches):
+        '''Write batches while holding the store's lock.
+
+        :param batches: a list of (sensor id, layout, columns) triples'''
+        with self._lock:
+            self._write(batches)
+
+    async def write(self):
+        '''Write the events waiting to be written, encoding and
+        writing them from a thread.'''
+        batches = self._takeBatches()
+        if len(batches) > 0:
+            t = time.monotonic()
+            await asyncio.to_thread(self._lockedWrite, batches)
+            self._writeTime.observe(time.monotonic() - t)
+            logger.debug("Stored %s events", sum([len(cols[0]) for (_, _, cols) in batches]))
+
+    # ---------- Reading ----------
+
+    def sensors(self):
+        '''Return the ids of the sensors with data in the store.
+
+        :returns: a list of sensor ids'''
+        return sorted(self._segments.keys())
+
+    def layout(self, id):
+        '''Return the layout of a sensor's latest segment.
+
+        :param id: the sensor id
+        :returns: a tuple of (tag, format code) pairs, or None if there's no data'''
+        segments = self._segments.get(id)
+        if not segments:
+            return None
+        return segments[-1][1]
+
+    def read(self, id, start = None, end = None):
+        '''Read a sensor's events in a time range. Only the blocks
+        whose time ranges overlap the range are read. Events still
+        waiting to be written aren't included.
+
+        The events are returned as columns, one for each tag in the
+        sensor's layouts. Missing values are returned as None.
+
+        :param id: the sensor id
+        :param start: (optional) the earliest time (defaults to the start of the data)
+        :param end: (optional) the time after the latest time (defaults to the end of the data)
+        :returns: a dict mapping tags to lists of values'''
+        start = float('-inf') if start is None else start
+        end = float('inf') if end is None else end
+        result = dict()
+        count = 0
+        with self._lock:
+            for (name, layout, tmin, tmax, _, _, compressed) in list(self._segments.get(id, [])):
+                if tmin is None or tmax < start or tmin >= end:
+                    continue
+                entries = [e for e in self._readIndex(id, name) if e[1] >= start and e[0] < end]
+                if len(entries) == 0:
+                    continue
+                with open(self._segmentFile(id, name), 'rb') as fh:
+                    for (_, _, offset, n) in entries:
+                        fh.seek(offset)
+                        (_, length, _, _) = self._BLOCK.unpack(fh.read(self._BLOCK.size))
+                        cols = self._decodeBlock(layout, fh.read(length), n, compressed)
+                        rows = [i for i in range(n) if start <= cols[0][i] < end]
+
+                        # add the rows, filling tags missing from this layout with None
+                        for ((t, _), col) in zip(layout, cols):
+                            if t not in result:
+                                result[t] = [None] * count
+                            result[t].extend([col[i] for i in rows])
+                        count += len(rows)
+                        for c in result.values():
+                            if len(c) < count:
+                                c.extend([None] * (count - len(c)))
+        return result
+
+    # ---------- Compaction and retention ----------
+
+    def _compactSegment(self, id, s):
+        '''Merge the blocks of a segment into blocks of the compacted size.
+
+        :param id: the sensor id
+        :param s: the segment'''
+        (name, layout, compressed) = (s[0], s[1], s[6])
+        fn = self._segmentFile(id, name)
+        ifn = self._segmentFile(id, name, self.INDEX_SUFFIX)
+        cols = [[] for _ in layout]
+        with open(fn, 'rb') as fh:
+            for (_, _, offset, n) in self._readIndex(id, name):
+                fh.seek(offset)
+                (_, length, _, _) = self._BLOCK.unpack(fh.read(self._BLOCK.size))
+                bcols = self._decodeBlock(layout, fh.read(length), n, compressed)
+                for j in range(len(layout)):
+                    cols[j].extend(bcols[j])
+
+        # rewrite into temporary files, then swap them in
+        entries = []
+        with open(fn + ".tmp", 'wb') as fh:
+            size = self._writeLayout(fh, layout, compressed)
+            for i in range(0, len(cols[0]), self._blockRows):
+                block = self._encodeBlock(layout, [c[i:i + self._blockRows] for c in cols], compressed)
+                (n, _, tmin, tmax) = self._BLOCK.unpack_from(block)
+                entries.append((tmin, tmax, size, n))
+                fh.write(block)
+                size += len(block)
+        with open(ifn + ".tmp", 'wb') as fh:
+            for e in entries:
+                fh.write(self._INDEX.pack(*e))
+        with self._lock:
+            os.replace(fn + ".tmp", fn)
+            os.replace(ifn + ".tmp", ifn)
+            s[4] = size
+            s[5] = len(entries)
+
+    def compact(self):
+        '''Compact the closed segments that hold more blocks than
+        they need, and delete the oldest segments if the retention
+        limits are exceeded. The segments being written are never
+        touched.'''
+        for (id, segments) in list(self._segments.items()):
+            for s in segments[:-1]:
+                rows = sum([e[3] for e in self._readIndex(id, s[0])])
+                if s[5] > (rows + self._blockRows - 1) // self._blockRows:
+                    self._compactSegment(id, s)
+
+        # retention by age, then by size, oldest first
+        now = time.time()
+        closed = sorted([(s[3], id, s) for (id, segments) in self._segments.items()
+                         for s in segments[:-1]], key=lambda c: c[0])
+        total = sum([s[4] for ss in self._segments.values() for s in ss])
+        for (tmax, id, s) in closed:
+            if tmax is not None and now - tmax > self._maxAge:
+                reason = "too old"
+            elif total > self._maxBytes:
+                reason = "store full"
+            else:
+                continue
+            logger.info("Discarding segment {n} of {id} ({r})".format(n=s[0], id=id, r=reason))
+            with self._lock:
+                self._remove(id, s[0])
+                self._segments[id].remove(s)
+            total -= s[4]
+
+    def close(self):
+        '''Write any waiting events and close the store.'''
+        self.flush()
+        for id in list(self._fds.keys()):
+            self._closeFiles(id)
+
+    async def run(self):
+        last = time.monotonic()
+        try:
+            while True:
+                await asyncio.sleep(self.period())
+                try:
+                    await self.write()
+                    if time.monotonic() - last > self._compactPeriod:
+                        last = time.monotonic()
+                        await asyncio.to_thread(self.compact)
+                except Exception as e:
+                    # keep going, as the store mustn't stop the station
+                    logger.error("Store failed: {e}".format(e=e))
+        finally:
+            # don't lose the last events
+            self.close()
+
+
+def _missing(code):
+    '''Return the value stored for a missing value.
+
+    :param code: the format code
+    :returns: the value'''
+    if code.endswith('s'):
+        return b''
+    elif code in 'efd':
+        return float('nan')
+    else:
+        return 0
+
+
+def _packColumn(code, col):
+    '''Pack a column of values into fixed-width binary.
+
+    :param code: the format code
+    :param col: the values
+    :returns: bytes'''
+    m = _missing(code)
+    if code.endswith('s'):
+        vs = [m if v is None else v.encode() for v in col]
+        return struct.pack('<' + code * len(vs), *vs)
+    else:
+        vs = [m if v is None else v for v in col]
+        return struct.pack('<{n}{c}'.format(n=len(vs), c=code), *vs)
+
+
+def _unpackColumn(code, data, i, n):
+    '''Unpack a column of values, decoding missing values as None.
+
+    :param code: the format code
+    :param data: the bytes
+    :param i: the offset of the column
+    :param n: the number of values
+    :returns: a (values, offset after the column) pair'''
+    if code.endswith('s'):
+        fmt = '<' + code * n
+        vs = [v.rstrip(b'\0').decode() for v in struct.unpack_from(fmt, data, i)]
+        vs = [None if v == '' else v for v in vs]
+    else:
+        fmt = '<{n}{c}'.format(n=n, c=code)
+        vs = [None if v != v else v for v in struct.unpack_from(fmt, data, i)]
+    return (vs, i + struct.calcsize(fmt))
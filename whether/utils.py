@@ -61,19 +61,23 @@ def modalTagValue(evs, tag):
     return modalValue
 
 
-def meanTagValue(evs, tag):
+def meanTagValue(evs, tag, default = 0):
     '''Compute the mean value associated with the given tag, which
-    needs to be numeric to make sense.
+    needs to be numeric to make sense. Events with no value for the
+    tag are ignored.
 
     :param evs: the events
     :param tag: the event tag
+    :param default: (optional) the value if there are no values (defaults to 0)
     :returns: the mean value'''
     v, n = 0.0, 0
     for ev in evs:
-        v += ev[tag]
-        n += 1
+        x = ev[tag]
+        if x is not None:
+            v += x
+            n += 1
     if n == 0:
-        return 0
+        return default
     else:
         return  v / n
 
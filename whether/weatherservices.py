@@ -0,0 +1,247 @@
+# Reporters for web weather services
+#
+# Copyright (C) 2023 Simon Dobson
+#
+# This file is part of whether, a modular IoT weather station
+#
+# whether is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# whether is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with whether. If not, see <http://www.gnu.org/licenses/gpl.html>.
+
+import time
+import asyncio
+import requests
+from requests.adapters import HTTPAdapter
+from whether import logger
+from whether.metrics import metrics
+from whether.reporter import Reporter
+
+
+class HTTPSink(Reporter):
+    '''Base class for reporters that upload to a web service.
+
+    Uploads go over a session that keeps its connection to the
+    service alive between periods, and run in a background thread
+    so that a slow service doesn't hold up the rest of the station.
+    Each request has a timeout, and requests that fail with a
+    network error or a server error are retried with increasing
+    delays. Payloads arriving less than the service's minimum
+    interval after the last upload, or while an upload is still
+    being retried, are skipped.
+
+    Sub-classes override :meth:`request` to turn a payload into a
+    request for their service.
+
+    :param sensors: (optional) dict mapping keys to sensors, if the sink is run on its own
+    :param period: (optional) reporting period in seconds (defaults to 60s)
+    :param url: (optional) the service URL (defaults to :attr:`URL`)
+    :param timeout: (optional) time allowed for each request in seconds (defaults to 10s)
+    :param retries: (optional) number of times to retry a failed upload (defaults to 3)
+    :param backoff: (optional) initial delay before retrying in seconds (defaults to 1s)
+    :param minInterval: (optional) minimum time between uploads in seconds (defaults to :attr:`MIN_INTERVAL`)
+    '''
+
+    URL = None            #: The service URL.
+    MIN_INTERVAL = 60     #: The service's default minimum time between uploads in seconds.
+
+
+    def __init__(self, sensors = None, period = 60, url = None,
+                 timeout = 10, retries = 3, backoff = 1, minInterval = None):
+        super().__init__(dict() if sensors is None else sensors, period)
+        self._url = self.URL if url is None else url
+        self._timeout = timeout
+        self._retries = retries
+        self._backoff = backoff
+        self._minInterval = self.MIN_INTERVAL if minInterval is None else minInterval
+        self._last = None
+        self._uploading = None
+
+        # a session holding one kept-alive connection, as we
+        # only ever have one request outstanding
+        self._session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=1)
+        self._session.mount("http://", adapter)
+        self._session.mount("https://", adapter)
+
+        # metrics
+        labels = dict(sink=self.name())
+        self._uploadTime = metrics.histogram("whether_http_upload_seconds",
+                                             "Time taken by each upload request", labels)
+        self._uploadFailures = metrics.counter("whether_http_upload_failures_total",
+                                               "Uploads that failed after any retries", labels)
+        self._skipped = metrics.counter("whether_http_skipped_total",
+                                        "Payloads skipped while uploading or rate limited", labels)
+
+    def request(self, payload):
+        '''Build the request for a payload. This must be overridden
+        by sub-classes.
+
+        :param payload: the payload
+        :returns: a dict of arguments for :meth:`requests.Session.request`'''
+        raise NotImplementedError("request")
+
+    def accepted(self, response):
+        '''Test whether the service accepted an upload. The default
+        accepts any successful status.
+
+        :param response: the response
+        :returns: True if the upload was accepted'''
+        return response.ok
+
+    def uploading(self):
+        '''Test whether an upload is in progress.
+
+        :returns: True if uploading'''
+        return self._uploading is not None and not self._uploading.done()
+
+    def submit(self, payload):
+        '''Start uploading a payload in the background, unless it's
+        too soon after the last upload or an upload is still in
+        progress.
+
+        :param payload: the payload'''
+        now = time.monotonic()
+        if self.uploading():
+            logger.warning("{n}: still uploading, skipping payload".format(n=self.name()))
+            self._skipped.inc()
+            return
+        if self._last is not None and now - self._last < self._minInterval:
+            logger.debug("{n}: rate limited, skipping payload".format(n=self.name()))
+            self._skipped.inc()
+            return
+        self._last = now
+        self._uploading = asyncio.create_task(self.upload(payload))
+
+    async def upload(self, payload):
+        '''Upload a payload, retrying on network and server errors.
+        Client errors aren't retried, as the same request will
+        fail again.
+
+        :param payload: the payload
+        :returns: True if the upload was accepted'''
+        args = self.request(payload)
+        delay = self._backoff
+        for i in range(self._retries + 1):
+            t = time.monotonic()
+            try:
+                r = await asyncio.to_thread(self._session.request, timeout=self._timeout, **args)
+                self._uploadTime.observe(time.monotonic() - t)
+                if self.accepted(r):
+                    logger.debug("{n}: uploaded".format(n=self.name()))
+                    return True
+                elif r.status_code < 500 and r.status_code != 429:
+                    logger.error("{n}: upload rejected ({s}): {b}".format(n=self.name(),
+                                                                         s=r.status_code,
+                                                                         b=r.text[:100]))
+                    self._uploadFailures.inc()
+                    return False
+                reason = "status {s}".format(s=r.status_code)
+            except requests.RequestException as e:
+                reason = str(e)
+            if i < self._retries:
+                logger.warning("{n}: upload failed ({r}), retrying in {d}s".format(n=self.name(),
+                                                                                  r=reason,
+                                                                                  d=delay))
+                await asyncio.sleep(delay)
+                delay *= 2
+        logger.error("{n}: upload failed ({r}), giving up".format(n=self.name(), r=reason))
+        self._uploadFailures.inc()
+        return False
+
+    def close(self):
+        '''Close the session's connection.'''
+        self._session.close()
+
+
+class WeatherUnderground(HTTPSink):
+    '''Reporter for uploading to a Weather Underground personal weather station.
+
+    :param stationId: the station id
+    :param stationKey: the station key
+    :param kwds: other arguments for :class:`HTTPSink`
+    '''
+
+    URL = "https://weatherstation.wunderground.com/weatherstation/updateweatherstation.php"
+    MIN_INTERVAL = 10
+
+
+    def __init__(self, stationId, stationKey, **kwds):
+        super().__init__(**kwds)
+        self._stationId = stationId
+        self._stationKey = stationKey
+
+    def request(self, payload):
+        '''Build an upload in the imperial units the service uses.
+
+        :param payload: the payload
+        :returns: the request arguments'''
+        params = dict(ID=self._stationId,
+                      PASSWORD=self._stationKey,
+                      dateutc="now",
+                      action="updateraw")
+        conversions = [('temperature', 'tempf', lambda t: t * 9 / 5 + 32),
+                       ('humidity', 'humidity', lambda h: h),
+                       ('wind_speed', 'windspeedmph', lambda s: s * 2.23694),
+                       ('wind_speed_gust', 'windgustmph', lambda s: s * 2.23694),
+                       ('wind_dir_deg', 'winddir', lambda d: d),
+                       ('rainfall', 'rainin', lambda r: r / 25.4)]
+        for (f, p, c) in conversions:
+            v = payload.get(f)
+            if v is not None:
+                params[p] = round(c(v), 2)
+        return dict(method="GET", url=self._url, params=params)
+
+    def accepted(self, response):
+        '''The service answers "success" to accepted uploads.
+
+        :param response: the response
+        :returns: True if the upload was accepted'''
+        return response.ok and response.text.strip() == "success"
+
+
+class OpenWeatherMap(HTTPSink):
+    '''Reporter for uploading to an OpenWeatherMap station.
+
+    :param stationId: the station id (as returned when the station was registered)
+    :param apiKey: the API key
+    :param kwds: other arguments for :class:`HTTPSink`
+    '''
+
+    URL = "https://api.openweathermap.org/data/3.0/measurements"
+    MIN_INTERVAL = 60
+
+
+    def __init__(self, stationId, apiKey, **kwds):
+        super().__init__(**kwds)
+        self._stationId = stationId
+        self._apiKey = apiKey
+
+    def request(self, payload):
+        '''Build an upload of a single measurement.
+
+        :param payload: the payload
+        :returns: the request arguments'''
+        m = dict(station_id=self._stationId,
+                 dt=int(time.time()))
+        fields = [('temperature', 'temperature'),
+                  ('humidity', 'humidity'),
+                  ('wind_speed', 'wind_speed'),
+                  ('wind_speed_gust', 'wind_gust'),
+                  ('wind_dir_deg', 'wind_deg'),
+                  ('rainfall', 'rain_1h')]
+        for (f, k) in fields:
+            v = payload.get(f)
+            if v is not None:
+                m[k] = v
+        return dict(method="POST", url=self._url,
+                    params=dict(appid=self._apiKey),
+                    json=[m])
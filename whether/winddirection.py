@@ -17,23 +17,28 @@
 # You should have received a copy of the GNU General Public License
 # along with whether. If not, see <http://www.gnu.org/licenses/gpl.html>.
 
-import asyncio
-import board
-import busio
-import digitalio
-import adafruit_mcp3xxx.mcp3008 as MCP
-from adafruit_mcp3xxx.analog_in import AnalogIn
-from whether import Sampler
+from whether import MCP3008Bus, AnalogueSampler, DirectionTable, eventClass
+from whether.filters import boxcar
 
 
-class WindDirection(Sampler):
+class WindDirection(AnalogueSampler):
     '''Driver for a resistor network wind direction sensor. The
     sensor is connected to an analogue-to-digital converter through
     the SPI interface.
 
     The object takes a calibration table mapping cardinal points to
     raw ADC values that is used to translate the sensor readings
-    into meaningful form.
+    into meaningful form. This can be given either as a dict or as
+    a pre-computed :class:`DirectionTable`.
+
+    The ADC can either be created by the sensor itself, from a chip
+    select pin, or be a :class:`MCP3008Bus` shared with other
+    analogue sensors, in which case the chip select pin is ignored.
+
+    Electrical noise on the resistor network can make readings flip
+    between adjacent points. Oversampling takes a block of readings
+    every period: by default the direction is then chosen by majority
+    vote across the block, or alternatively from the block's average.
 
     :param id: the sensor's id
     :param cs: the chip select pin for the SPI device
@@ -41,49 +46,62 @@ class WindDirection(Sampler):
     :param cal: calibration table
     :param ring: the ring buffer to receive events
     :param period: the reporting period
+    :param adc: (optional) a shared ADC bus
+    :param oversample: (optional) readings to take per sample (defaults to 1)
+    :param vote: (optional) decimate by majority vote rather than averaging (defaults to True)
 
     '''
 
     DIRECTION = "winddir"    #: Event tag for wind direction as a string.
     RAW = "windrawadc"       #: Event tag for raw ADC value.
 
+    #: Event class.
+    EVENT = eventClass("WindDirectionEvent",
+                       [AnalogueSampler.TIMESTAMP, AnalogueSampler.ID, DIRECTION, RAW],
+                       {AnalogueSampler.TIMESTAMP: 'd', DIRECTION: '3s', RAW: 'f'})
+
 
-    def __init__(self, id, cs, ch, cal, ring, period = 1):
-        super().__init__(id, ring, period)
+    def __init__(self, id, cs, ch, cal, ring, period = 1,
+                 adc = None, oversample = 1, vote = True):
+        # create our own ADC (on SPI0) if we're not sharing one
+        if adc is None:
+            adc = MCP3008Bus(cs, tick=period)
+        super().__init__(id, adc, ch, ring, period, oversample)
+        self._vote = vote
 
         # calibration data
+        if not isinstance(cal, DirectionTable):
+            cal = DirectionTable(cal)
         self._calibration = cal
 
-        # SPI interface (assumed to be SPI0)
-        self._spi = busio.SPI(clock=board.SCK, MISO=board.MISO, MOSI=board.MOSI)
-        self._cs = digitalio.DigitalInOut(cs)
-
-        # create the MCP3008
-        self._mcp = MCP.MCP3008(self._spi, self._cs)
-
-        # resistor network channel
-        self._channel = AnalogIn(self._mcp, ch)
-
     def direction(self, r):
         '''Return the wind direction.
 
         :param r: the raw wind direction reading
-        :returns: a pair of a direction string and a rotation in degrees'''
-
-        # extract the nearest matching raw value
-        bestMatch, bestDirection = None, None
-        for (d, v) in self._calibration.items():
-            diff = abs(r - v)
-            if (bestMatch is None) or (diff < bestMatch):
-                bestMatch, bestDirection = diff, d
-
-        # return the best direction
-        return bestDirection
-
-    def sample(self):
-        '''Take a sample from the sensor.
-
-        :returns: a dict'''
-        r = self._channel.value
-        return {self.DIRECTION: self.direction(r),
-                self.RAW: r}
+        :returns: the direction string'''
+        return self._calibration.direction(r)
+
+    def convert(self, r, ev):
+        '''Convert a raw reading into a wind direction event.
+
+        :param r: the raw reading
+        :param ev: the event
+        :returns: True'''
+        ev[self.DIRECTION] = self.direction(r)
+        ev[self.RAW] = r
+        return True
+
+    def convertBlock(self, block, ev):
+        '''Convert a block of raw readings into a wind direction event.
+        The raw value reported is the block's average.
+
+        :param block: an array of raw readings
+        :param ev: the event
+        :returns: True'''
+        r = boxcar(block)
+        if self._vote:
+            ev[self.DIRECTION] = self._calibration.directions()[self._calibration.vote(block)]
+        else:
+            ev[self.DIRECTION] = self.direction(r)
+        ev[self.RAW] = r
+        return True